@@ -1,6 +1,17 @@
 import asyncio
+import dataclasses
 from temporalio import activity
-from shared import BookVacationInput
+from temporalio.client import Client
+from shared import (
+    BOOKING_WORKFLOW_NAME,
+    COMPENSATION_FAILED_ATTRIBUTE,
+    ApprovalRules,
+    BookVacationInput,
+    OrphanedLeg,
+    OrphanScan,
+    OrphanScanResult,
+)
+from approval_rules import load_approval_rules
 import random
 
 
@@ -13,9 +24,13 @@ async def book_hotel(book_input: BookVacationInput) -> dict:
         book_input: Input data for booking a hotel.
 
     Returns:
-        dict: Confirmation of the booking with status information.
+        dict: Confirmation of the booking with status information and the
+            nightly price quoted by the hotel.
     """
     print(f"Booking hotel: {book_input.book_hotel_id}")
+    # Simulate the supplier's quote, which the approval rules check. It stays above
+    # the default auto-approve price, so manual_ bookings still wait for a person.
+    price = round(random.uniform(250, 900), 2)
     
     # Check if this is a manual booking that requires human approval
     if book_input.book_hotel_id.startswith("manual_"):
@@ -27,7 +42,8 @@ async def book_hotel(book_input: BookVacationInput) -> dict:
             "message": "manual_approval_needed",
             "user_id": book_input.book_user_id,
             "needs_approval": True,
-            "manual_approval_needed": True
+            "manual_approval_needed": True,
+            "price": price,
         }
     
     # Simulate a service outage for testing compensation
@@ -40,7 +56,8 @@ async def book_hotel(book_input: BookVacationInput) -> dict:
     return {
         "booked_hotel": book_input.book_hotel_id,
         "status": "confirmed",
-        "message": f"Booked hotel: {book_input.book_hotel_id}"
+        "message": f"Booked hotel: {book_input.book_hotel_id}",
+        "price": price,
     }
 
 
@@ -109,10 +126,16 @@ async def wait_for_human_approval(book_input: BookVacationInput) -> dict:
     # This is a long-running activity that will be completed externally
     # We'll simulate the waiting with a loop that checks for cancellation
     try:
-        # Keep the activity alive until it's cancelled
-        count = 0
+        # Keep the activity alive until it's cancelled. When retried on another
+        # worker, continue counting from the last heartbeat.
+        heartbeat_details = activity.info().heartbeat_details
+        count = heartbeat_details[0].get("heartbeat_count", 0) if heartbeat_details else 0
         while True:
             try:
+                # Hand the wait over to another worker when this one is draining
+                if activity.is_worker_shutdown():
+                    raise RuntimeError("Worker shutting down, approval wait will be retried")
+
                 # Send a heartbeat every 5 seconds to reduce event frequency
                 # Include the approval flags in every heartbeat
                 if count % 5 == 0:
@@ -139,6 +162,9 @@ async def wait_for_human_approval(book_input: BookVacationInput) -> dict:
                         "message": "Approval timed out after 10 minutes"
                     }
             except asyncio.CancelledError:
+                # Cancellation at the end of a worker shutdown is not a decision
+                if activity.is_worker_shutdown():
+                    raise RuntimeError("Worker shut down, approval wait will be retried")
                 # Handle cancellation from asyncio
                 print(f"Activity received asyncio.CancelledError for booking: {book_input.book_hotel_id}")
                 return {
@@ -146,6 +172,8 @@ async def wait_for_human_approval(book_input: BookVacationInput) -> dict:
                     "message": "Booking approved via cancellation"
                 }
     except Exception as e:
+        if activity.is_worker_shutdown():
+            raise
         print(f"Error in wait_for_human_approval: {str(e)}")
         # Return a failure result instead of raising an exception
         return {
@@ -160,6 +188,20 @@ async def wait_for_human_approval(book_input: BookVacationInput) -> dict:
     }
 
 
+@activity.defn
+async def get_approval_rules() -> ApprovalRules:
+    """
+    Load the approval rules configured on this worker.
+
+    Run as a local activity, so the rules end up in the workflow history and a
+    replay sees the same rules even after the file has changed.
+
+    Returns:
+        ApprovalRules: The rules to check manual bookings against.
+    """
+    return load_approval_rules()
+
+
 @activity.defn
 async def complete_hotel_booking(book_input: BookVacationInput) -> dict:
     """
@@ -235,3 +277,154 @@ async def undo_book_flight(book_input: BookVacationInput) -> str:
     # Simulate cancellation
     await asyncio.sleep(0.1)
     return f"Cancelled flight booking: {book_input.book_flight_id}"
+
+
+# Activities that may leave a leg booked at the supplier, and the compensations
+# that release it
+BOOKING_ACTIVITY_LEGS = {
+    "book_car": "car",
+    "book_hotel": "hotel",
+    "complete_hotel_booking": "hotel",
+    "book_flight": "flight",
+}
+UNDO_ACTIVITY_LEGS = {
+    "undo_book_car": "car",
+    "undo_book_hotel": "hotel",
+    "undo_book_flight": "flight",
+}
+
+# Marker that records a local activity's outcome in history
+LOCAL_ACTIVITY_MARKER = "core_local_activity"
+
+
+def local_activity_id(seq, leg, leg_id):
+    """Activity ID of a local booking or compensation call, naming the leg and ID it acts on."""
+    return f"{seq}/{leg}/{leg_id}"
+
+
+# Closed bookings whose saga did not finish its compensations or never got to run them
+ORPHAN_CANDIDATES_QUERY = (
+    f"WorkflowType='{BOOKING_WORKFLOW_NAME}' "
+    "AND (ExecutionStatus IN ('Failed', 'Terminated', 'TimedOut', 'Canceled') "
+    f"OR {COMPENSATION_FAILED_ATTRIBUTE.name}=true)"
+)
+
+
+class ReconciliationActivities:
+    """
+    Activities for the reconciliation workflow that need a Temporal client.
+
+    Args:
+        client: Connected Temporal client used for visibility and history lookups.
+    """
+
+    def __init__(self, client: Client):
+        self._client = client
+
+    @activity.defn
+    async def find_orphaned_bookings(self, scan: OrphanScan) -> OrphanScanResult:
+        """
+        Find legs of recently closed bookings that were booked but never cancelled.
+
+        Candidates come from one visibility query. Only their histories are read,
+        to pair each booking activity with a completed compensation for the same
+        leg and ID.
+
+        Args:
+            scan: Close time window and the most bookings to check.
+
+        Returns:
+            OrphanScanResult: Legs to cancel and how many bookings were checked.
+        """
+        query = (
+            f"{ORPHAN_CANDIDATES_QUERY} AND CloseTime >= '{scan.closed_after}' "
+            f"AND CloseTime < '{scan.closed_before}'"
+        )
+        candidates = []
+        async for execution in self._client.list_workflows(query=query, page_size=100):
+            candidates.append(execution)
+        print(f"Found {len(candidates)} closed bookings to reconcile")
+
+        # Oldest first, so a capped scan checks the bookings that have leaked longest
+        candidates.sort(key=lambda execution: execution.close_time)
+        result = OrphanScanResult(bookings_skipped=max(len(candidates) - scan.max_bookings, 0))
+        for execution in candidates[:scan.max_bookings]:
+            result.orphans.extend(await self._orphaned_legs(execution.id, execution.run_id))
+            result.bookings_scanned += 1
+            activity.heartbeat(result.bookings_scanned)
+        return result
+
+    async def _orphaned_legs(self, workflow_id, run_id):
+        """
+        Return the legs a booking attempted and did not cancel, across continued runs.
+
+        A booking that succeeded keeps the legs in its result's held_legs, so only
+        the legs it replaced by amendment are returned for it.
+        """
+        booked = {}
+        cancelled = set()
+        succeeded = False
+        held_legs = {}
+        while run_id:
+            handle = self._client.get_workflow_handle(workflow_id, run_id=run_id)
+            run_id = None
+            run_input = None
+            scheduled = {}
+            async for event in handle.fetch_history_events():
+                if event.HasField("workflow_execution_started_event_attributes"):
+                    attributes = event.workflow_execution_started_event_attributes
+                    # Legs booked before the booking continued as new are in the earlier run
+                    run_id = attributes.continued_execution_run_id
+                    run_input = (await self._client.data_converter.decode(
+                        attributes.input.payloads[:1], [BookVacationInput]
+                    ))[0]
+                elif event.HasField("workflow_execution_completed_event_attributes"):
+                    attributes = event.workflow_execution_completed_event_attributes
+                    [outcome] = await self._client.data_converter.decode(attributes.result.payloads, [dict])
+                    if outcome.get("status") == "success":
+                        succeeded = True
+                        held_legs = outcome.get("held_legs")
+                elif event.HasField("marker_recorded_event_attributes"):
+                    attributes = event.marker_recorded_event_attributes
+                    if attributes.marker_name != LOCAL_ACTIVITY_MARKER:
+                        continue
+                    [marker] = await self._client.data_converter.decode(attributes.details["data"].payloads, [dict])
+                    name = marker.get("activity_type")
+                    if name not in BOOKING_ACTIVITY_LEGS and name not in UNDO_ACTIVITY_LEGS:
+                        continue
+                    _, leg, leg_id = marker["activity_id"].split("/", 2)
+                    if name in BOOKING_ACTIVITY_LEGS:
+                        # Failed attempts count too, as for regular activities
+                        booked[(leg, leg_id)] = dataclasses.replace(run_input, **{f"book_{leg}_id": leg_id})
+                    elif not attributes.HasField("failure"):
+                        cancelled.add((leg, leg_id))
+                elif event.HasField("activity_task_scheduled_event_attributes"):
+                    attributes = event.activity_task_scheduled_event_attributes
+                    name = attributes.activity_type.name
+                    if name not in BOOKING_ACTIVITY_LEGS and name not in UNDO_ACTIVITY_LEGS:
+                        continue
+                    [book_input] = await self._client.data_converter.decode(
+                        attributes.input.payloads, [BookVacationInput]
+                    )
+                    scheduled[event.event_id] = (name, book_input)
+                    if name in BOOKING_ACTIVITY_LEGS:
+                        # Attempts count too: like the saga, assume a booking may have
+                        # gone through even if the activity failed or timed out
+                        leg = BOOKING_ACTIVITY_LEGS[name]
+                        booked[(leg, getattr(book_input, f"book_{leg}_id"))] = book_input
+                elif event.HasField("activity_task_completed_event_attributes"):
+                    scheduled_event_id = event.activity_task_completed_event_attributes.scheduled_event_id
+                    name, book_input = scheduled.get(scheduled_event_id, (None, None))
+                    if name in UNDO_ACTIVITY_LEGS:
+                        leg = UNDO_ACTIVITY_LEGS[name]
+                        cancelled.add((leg, getattr(book_input, f"book_{leg}_id")))
+
+        if succeeded and held_legs is None:
+            # Completed before results named the held legs; any leg might still be in use
+            print(f"Skipping {workflow_id}: cannot tell which legs the booking still holds")
+            return []
+        return [
+            OrphanedLeg(workflow_id=workflow_id, leg=leg, book_input=book_input)
+            for (leg, leg_id), book_input in booked.items()
+            if (leg, leg_id) not in cancelled and held_legs.get(leg) != leg_id
+        ]
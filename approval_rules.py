@@ -0,0 +1,69 @@
+"""
+Module for deciding manual hotel bookings automatically.
+"""
+
+import dataclasses
+import json
+import os
+from typing import Optional
+
+from shared import ApprovalDecision, ApprovalRules, BookVacationInput
+
+# JSON file with ApprovalRules fields, read by the worker. Missing fields keep
+# their defaults.
+APPROVAL_RULES_FILE = os.environ.get("APPROVAL_RULES_FILE", "approval_rules.json")
+
+
+def load_approval_rules(path: str = APPROVAL_RULES_FILE) -> ApprovalRules:
+    """
+    Load the approval rules from a JSON file.
+
+    Args:
+        path: Path to the rules file.
+
+    Returns:
+        ApprovalRules: The configured rules, or the defaults if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return ApprovalRules()
+    with open(path) as rules_file:
+        config = json.load(rules_file)
+    known = {f.name for f in dataclasses.fields(ApprovalRules)}
+    unknown = set(config) - known
+    if unknown:
+        raise ValueError(f"Unknown approval rules in {path}: {', '.join(sorted(unknown))}")
+    return ApprovalRules(**config)
+
+
+def evaluate_approval(
+    rules: ApprovalRules, book_input: BookVacationInput, price: Optional[float]
+) -> Optional[ApprovalDecision]:
+    """
+    Decide a manual hotel booking from the rules alone.
+
+    Runs inside the workflow, so it must only depend on its arguments.
+
+    Args:
+        rules: The approval rules.
+        book_input: The booking waiting for approval.
+        price: Nightly price quoted by book_hotel, or None without a quote.
+
+    Returns:
+        ApprovalDecision: The decision and the rule that made it, or None when a
+            person has to decide.
+    """
+    hotel = book_input.book_hotel_id
+
+    if hotel in rules.blocked_hotels:
+        return ApprovalDecision("reject", f"hotel {hotel} is blocked")
+    if price is not None and rules.auto_reject_min_price is not None and price >= rules.auto_reject_min_price:
+        return ApprovalDecision("reject", f"price {price} is at or above {rules.auto_reject_min_price}")
+
+    if hotel in rules.allowed_hotels:
+        return ApprovalDecision("approve", f"hotel {hotel} is allowed")
+    if book_input.user_tier in rules.auto_approve_tiers:
+        return ApprovalDecision("approve", f"user tier {book_input.user_tier} is approved automatically")
+    if price is not None and rules.auto_approve_max_price is not None and price <= rules.auto_approve_max_price:
+        return ApprovalDecision("approve", f"price {price} is at or below {rules.auto_approve_max_price}")
+
+    return None
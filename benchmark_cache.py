@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Benchmark how the worker's sticky workflow cache size affects BookingWorkflow.
+
+For each cache size, a worker is started on its own task queue with
+max_cached_workflows set to that size. Many manual bookings are then run
+concurrently against a local Temporal server. Every booking waits for
+approval, takes a few trip amendments and is then approved. When there are more
+open bookings than cache slots, workflows are evicted between their workflow
+tasks, and the next task has to replay the whole history.
+
+The report shows, per cache size, the sticky cache hit rate, the number of full
+replays and forced evictions, and workflow task latency from the SDK's own
+metrics. It ends with a recommended WORKER_MAX_CACHED_WORKFLOWS for run_worker.py.
+
+Requires a local server, e.g. `temporal server start-dev`.
+
+Usage:
+    python benchmark_cache.py [--cache-sizes 0,25,100,500] [--bookings 200] [--amendments 3]
+"""
+
+import argparse
+import asyncio
+import math
+import statistics
+import time
+import uuid
+from collections import defaultdict
+
+from temporalio.client import Client
+from temporalio.runtime import BUFFERED_METRIC_KIND_COUNTER, MetricBuffer, Runtime, TelemetryConfig
+
+from run_worker import create_worker, ensure_search_attributes
+from shared import TEMPORAL_ADDRESS, BookVacationInput, TripAmendment
+from workflows import BookingWorkflow
+
+# Share of workflow tasks that should be served from the cache for a size to be recommended
+TARGET_HIT_RATE = 0.95
+
+
+class MetricCollector:
+    """
+    Drains the runtime's metric buffer in the background and aggregates it.
+
+    Counters are summed and histogram observations (in ms) kept, per metric name.
+    """
+
+    def __init__(self, buffer: MetricBuffer, interval_seconds=0.5):
+        self._buffer = buffer
+        self._interval_seconds = interval_seconds
+        self.counters = defaultdict(int)
+        self.observations = defaultdict(list)
+
+    def drain(self):
+        for update in self._buffer.retrieve_updates():
+            name = update.metric.name.removeprefix("temporal_")
+            if update.metric.kind == BUFFERED_METRIC_KIND_COUNTER:
+                self.counters[name] += update.value
+            else:
+                self.observations[name].append(update.value)
+
+    def reset(self):
+        """Drop everything collected so far, e.g. between runs."""
+        self.drain()
+        self.counters.clear()
+        self.observations.clear()
+
+    async def run(self):
+        # The buffer is bounded, so it has to be drained regularly during a run
+        while True:
+            self.drain()
+            await asyncio.sleep(self._interval_seconds)
+
+
+def percentile(values, fraction):
+    """Return the given percentile of a list of values, or 0 for an empty list."""
+    if not values:
+        return 0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+async def run_bookings(client, task_queue, bookings, amendments, concurrency):
+    """
+    Start manual bookings, amend each of them a few times, then approve them all.
+
+    Amendments go round all the bookings before the next one starts, so each
+    booking's workflow tasks are interleaved with everyone else's.
+
+    Returns:
+        float: Seconds from the first start to the last result.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def call(coro):
+        async with limit:
+            return await coro
+
+    run_id = uuid.uuid4().hex[:8]
+    started = time.perf_counter()
+    handles = await asyncio.gather(*(
+        call(client.start_workflow(
+            BookingWorkflow.run,
+            BookVacationInput(
+                attempts=3,
+                book_user_id=f"cache-bench-{run_id}-{i}",
+                book_car_id=f"car-{i}",
+                book_hotel_id=f"manual_hotel-{i}",
+                book_flight_id=f"flight-{i}",
+            ),
+            id=f"cache-bench-{run_id}-{i}",
+            task_queue=task_queue,
+        ))
+        for i in range(bookings)
+    ))
+
+    for amendment in range(amendments):
+        await asyncio.gather(*(
+            call(handle.execute_update(
+                BookingWorkflow.amendBooking, TripAmendment(leg="car", new_id=f"car-{i}-{amendment}")
+            ))
+            for i, handle in enumerate(handles)
+        ))
+
+    await asyncio.gather(*(call(handle.signal(BookingWorkflow.approvalSignal, "approve")) for handle in handles))
+    await asyncio.gather(*(call(handle.result()) for handle in handles))
+    return time.perf_counter() - started
+
+
+async def benchmark_cache_size(client, collector, cache_size, args):
+    """Run the bookings on a worker with the given cache size and return its report row."""
+    task_queue = f"cache-bench-{uuid.uuid4().hex[:8]}"
+    worker = create_worker(
+        client,
+        task_queue,
+        max_cached_workflows=cache_size,
+        # The worker refuses more workflow task slots than cache slots
+        max_concurrent_workflow_tasks=min(100, cache_size) if cache_size else 100,
+        # Every approval wait holds an activity slot, leave room for the others
+        max_concurrent_activities=args.bookings + 100,
+    )
+    collector.reset()
+    async with worker:
+        elapsed = await run_bookings(client, task_queue, args.bookings, args.amendments, args.concurrency)
+    collector.drain()
+
+    hits = collector.counters["sticky_cache_hit"]
+    misses = collector.counters["sticky_cache_miss"]
+    task_latency = collector.observations["workflow_task_execution_latency"]
+    replay_latency = collector.observations["workflow_task_replay_latency"]
+    queue_latency = collector.observations["workflow_task_schedule_to_start_latency"]
+    return {
+        "cache_size": cache_size,
+        "seconds": elapsed,
+        "workflow_tasks": len(task_latency),
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        # Without a cache every task after a booking's first one is a full replay
+        "full_replays": misses if cache_size else max(len(task_latency) - args.bookings, 0),
+        "forced_evictions": collector.counters["sticky_cache_total_forced_eviction"],
+        "task_p50_ms": percentile(task_latency, 0.5),
+        "task_p95_ms": percentile(task_latency, 0.95),
+        "replay_p95_ms": percentile(replay_latency, 0.95),
+        "queue_p95_ms": percentile(queue_latency, 0.95),
+    }
+
+
+def print_report(rows, bookings):
+    print(
+        f"\n{'cache':>6} {'seconds':>8} {'tasks':>6} {'hit rate':>9} {'replays':>8} {'evicted':>8}"
+        f" {'task p50':>9} {'task p95':>9} {'replay p95':>11} {'queue p95':>10}"
+    )
+    for row in rows:
+        print(
+            f"{row['cache_size']:>6} {row['seconds']:>8.1f} {row['workflow_tasks']:>6} {row['hit_rate']:>9.1%}"
+            f" {row['full_replays']:>8} {row['forced_evictions']:>8} {row['task_p50_ms']:>7.0f}ms"
+            f" {row['task_p95_ms']:>7.0f}ms {row['replay_p95_ms']:>9.0f}ms {row['queue_p95_ms']:>8.0f}ms"
+        )
+
+    good = [row for row in rows if row["hit_rate"] >= TARGET_HIT_RATE]
+    if not good:
+        print(f"\nNo cache size reached a {TARGET_HIT_RATE:.0%} hit rate; try sizes above {bookings}")
+        return
+    best = min(good, key=lambda row: row["cache_size"])
+    # Scale to the open bookings a worker holds, e.g. ones waiting for approval
+    per_booking = best["cache_size"] / bookings
+    print(
+        f"\nSmallest cache with a {TARGET_HIT_RATE:.0%} hit rate: {best['cache_size']}"
+        f" for {bookings} open bookings ({per_booking:.2f} slots per open booking)."
+    )
+    print(
+        "Recommended worker setting: WORKER_MAX_CACHED_WORKFLOWS >="
+        f" {math.ceil(per_booking * 100) / 100} x open bookings per worker, and no lower than"
+        " WORKER_MAX_CONCURRENT_WORKFLOW_TASKS."
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=TEMPORAL_ADDRESS, help="Temporal server address")
+    parser.add_argument("--cache-sizes", default="0,25,100,500", help="Comma-separated max_cached_workflows values")
+    parser.add_argument("--bookings", type=int, default=200, help="Concurrent manual bookings per run")
+    parser.add_argument("--amendments", type=int, default=3, help="Trip amendments per booking")
+    parser.add_argument("--concurrency", type=int, default=50, help="Client calls in flight at once")
+    args = parser.parse_args()
+
+    buffer = MetricBuffer(buffer_size=100_000)
+    runtime = Runtime(telemetry=TelemetryConfig(metrics=buffer))
+    client = await Client.connect(args.target, runtime=runtime)
+    await ensure_search_attributes(client)
+
+    collector = MetricCollector(buffer)
+    collector_task = asyncio.create_task(collector.run())
+    rows = []
+    try:
+        for cache_size in (int(size) for size in args.cache_sizes.split(",")):
+            print(f"Running {args.bookings} bookings with max_cached_workflows={cache_size}")
+            rows.append(await benchmark_cache_size(client, collector, cache_size, args))
+    finally:
+        collector_task.cancel()
+    print_report(rows, args.bookings)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Measure how much the payload compression codec saves per booking.
+
+By default the payloads of one manual booking are built in process: the workflow
+input, every activity input and result, the heartbeats of the approval wait,
+the approval signal and the workflow result. They are encoded with and without
+each codec and the bytes are totalled. No server is needed for this.
+
+With --target, bookings are also run against that server for each codec. The
+report then adds the history bytes per booking as fetched from the server.
+
+Usage:
+    python benchmark_codec.py [--threshold 128] [--heartbeats 20] [--target localhost:7233 --bookings 20]
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+from temporalio.client import Client
+
+from codec import PAYLOAD_COMPRESSION_THRESHOLD, CompressionCodec, data_converter
+from shared import ApprovalRules, BookVacationInput
+
+
+def booking_payload_values(book_input, heartbeats):
+    """
+    Values a manual booking sends as payloads, in the shape the activities produce them.
+
+    Returns:
+        list: Values to encode, one payload each.
+    """
+    hotel_id = book_input.book_hotel_id
+    heartbeat = {
+        "booking_id": hotel_id,
+        "user_id": book_input.book_user_id,
+        "status": "waiting_for_approval",
+        "needs_approval": True,
+        "manual_approval_needed": True,
+    }
+    results = {
+        "booked_car": f"Booked car: {book_input.book_car_id}",
+        "booked_hotel": {
+            "booked_hotel": hotel_id,
+            "status": "confirmed",
+            "message": f"Booked hotel: {hotel_id} (after approval)",
+            "approved": True,
+        },
+        "approval_status": "approved",
+        "booked_flight": f"Booked flight: {book_input.book_flight_id}",
+    }
+    return [
+        # Workflow input, then the input of each activity
+        book_input,
+        *[book_input] * 5,
+        results["booked_car"],
+        {
+            "booked_hotel": hotel_id,
+            "status": "waiting_for_approval",
+            "message": "manual_approval_needed",
+            "user_id": book_input.book_user_id,
+            "needs_approval": True,
+            "manual_approval_needed": True,
+            "price": 320.0,
+        },
+        ApprovalRules(),
+        *[{**heartbeat, "heartbeat_count": count * 5} for count in range(heartbeats)],
+        "approve",
+        {"status": "approved", "message": "Booking approved via cancellation"},
+        results["booked_hotel"],
+        results["booked_flight"],
+        {
+            "status": "success",
+            "message": results,
+            "held_legs": {"car": book_input.book_car_id, "hotel": hotel_id, "flight": book_input.book_flight_id},
+        },
+    ]
+
+
+async def payload_sizes(values, algorithm, threshold):
+    """Return the encoded payload bytes of the values and the time taken to encode and decode them."""
+    converter = data_converter(algorithm, threshold)
+    started = time.perf_counter()
+    payloads = await converter.encode(values)
+    encoded_bytes = sum(payload.ByteSize() for payload in payloads)
+    await converter.decode(payloads, [type(value) for value in values])
+    return encoded_bytes, (time.perf_counter() - started) * 1000
+
+
+async def history_bytes_per_booking(target, algorithm, threshold, bookings):
+    """Run manual bookings with the codec and return their average history size in bytes."""
+    # Imported here so the offline report does not need the worker's dependencies
+    from run_worker import create_worker, ensure_search_attributes
+    from workflows import BookingWorkflow
+
+    client = await Client.connect(target, data_converter=data_converter(algorithm, threshold))
+    await ensure_search_attributes(client)
+    task_queue = f"codec-bench-{uuid.uuid4().hex[:8]}"
+    async with create_worker(client, task_queue, max_concurrent_activities=bookings + 100):
+        handles = await asyncio.gather(*(
+            client.start_workflow(
+                BookingWorkflow.run,
+                BookVacationInput(
+                    attempts=3,
+                    book_user_id=f"{task_queue}-{i}",
+                    book_car_id=f"car-{i}",
+                    book_hotel_id=f"manual_hotel-{i}",
+                    book_flight_id=f"flight-{i}",
+                ),
+                id=f"{task_queue}-{i}",
+                task_queue=task_queue,
+            )
+            for i in range(bookings)
+        ))
+        # Let the approval waits heartbeat a few times
+        await asyncio.sleep(5)
+        await asyncio.gather(*(handle.signal(BookingWorkflow.approvalSignal, "approve") for handle in handles))
+        await asyncio.gather(*(handle.result() for handle in handles))
+
+    total = 0
+    for handle in handles:
+        history = await handle.fetch_history()
+        total += sum(event.ByteSize() for event in history.events)
+    return total / bookings
+
+
+def available_algorithms():
+    algorithms = ["zlib"]
+    try:
+        CompressionCodec("zstd")
+        algorithms.append("zstd")
+    except RuntimeError:
+        print("zstd is not available (needs Python 3.14 or the zstandard package), skipping it")
+    return algorithms
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=int, default=PAYLOAD_COMPRESSION_THRESHOLD, help="Smallest payload to compress, in bytes")
+    parser.add_argument("--heartbeats", type=int, default=20, help="Approval wait heartbeats per booking")
+    parser.add_argument("--target", help="Also run bookings against this Temporal server")
+    parser.add_argument("--bookings", type=int, default=20, help="Bookings per codec with --target")
+    args = parser.parse_args()
+
+    book_input = BookVacationInput(
+        attempts=3,
+        book_user_id=f"jane-doe-{uuid.uuid4().int % 1_000_000:06d}",
+        book_car_id="car-compact-123",
+        book_hotel_id="manual_hotel-grand-456",
+        book_flight_id="flight-lh-789",
+        departure="2026-12-01T09:30:00+00:00",
+    )
+    values = booking_payload_values(book_input, args.heartbeats)
+    algorithms = available_algorithms()
+
+    print(f"\nPayload bytes per manual booking ({len(values)} payloads, threshold {args.threshold} bytes)")
+    baseline, _ = await payload_sizes(values, "", args.threshold)
+    print(f"  {'none':<5} {baseline:>7} bytes")
+    for algorithm in algorithms:
+        size, elapsed_ms = await payload_sizes(values, algorithm, args.threshold)
+        print(
+            f"  {algorithm:<5} {size:>7} bytes  {1 - size / baseline:>6.1%} smaller"
+            f"  {elapsed_ms:.2f} ms to encode and decode"
+        )
+
+    if args.target:
+        print(f"\nHistory bytes per booking, averaged over {args.bookings} bookings on {args.target}")
+        baseline = await history_bytes_per_booking(args.target, "", args.threshold, args.bookings)
+        print(f"  {'none':<5} {baseline:>9.0f} bytes")
+        for algorithm in algorithms:
+            size = await history_bytes_per_booking(args.target, algorithm, args.threshold, args.bookings)
+            print(f"  {algorithm:<5} {size:>9.0f} bytes  {1 - size / baseline:>6.1%} smaller")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
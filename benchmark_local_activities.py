@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Compare bookings run with regular activities against local-activity mode.
+
+The same bookings are run twice against a local Temporal server, first with
+every call as a regular activity and then with local_activities set, so the
+car, flight and compensation calls run as local activities. The report shows
+saga latency from start to result and history events per booking for both
+modes. book_hotel's simulated outage sends some bookings down the
+compensation path, in both modes alike.
+
+Requires a local server, e.g. `temporal server start-dev`.
+
+Usage:
+    python benchmark_local_activities.py [--bookings 100] [--concurrency 20]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from temporalio.client import Client, WorkflowFailureError
+
+from benchmark_cache import percentile
+from run_worker import create_worker, ensure_search_attributes
+from shared import TEMPORAL_ADDRESS, BookVacationInput
+from workflows import BookingWorkflow
+
+
+async def run_booking(client, task_queue, book_input):
+    """Run one booking and return its latency in ms and its history event count."""
+    started = time.perf_counter()
+    handle = await client.start_workflow(
+        BookingWorkflow.run, book_input, id=book_input.book_user_id, task_queue=task_queue
+    )
+    try:
+        await handle.result()
+    except WorkflowFailureError:
+        # Compensated bookings count too, their undo calls are part of the comparison
+        pass
+    latency_ms = (time.perf_counter() - started) * 1000
+    history = await handle.fetch_history()
+    return latency_ms, len(history.events)
+
+
+async def benchmark_mode(client, local_activities, args):
+    """Run the bookings in one mode and return latency and event count statistics."""
+    task_queue = f"la-bench-{uuid.uuid4().hex[:8]}"
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(i):
+        async with limit:
+            return await run_booking(client, task_queue, BookVacationInput(
+                attempts=3,
+                book_user_id=f"{task_queue}-{i}",
+                book_car_id=f"car-{i}",
+                book_hotel_id=f"hotel-{i}",
+                book_flight_id=f"flight-{i}",
+                local_activities=local_activities,
+            ))
+
+    async with create_worker(client, task_queue):
+        outcomes = await asyncio.gather(*(bounded(i) for i in range(args.bookings)))
+    latencies = [latency for latency, _ in outcomes]
+    events = [count for _, count in outcomes]
+    return {
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "events": statistics.mean(events),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=TEMPORAL_ADDRESS, help="Temporal server address")
+    parser.add_argument("--bookings", type=int, default=100, help="Bookings per mode")
+    parser.add_argument("--concurrency", type=int, default=20, help="Bookings in flight at once")
+    args = parser.parse_args()
+
+    client = await Client.connect(args.target)
+    await ensure_search_attributes(client)
+
+    before = await benchmark_mode(client, False, args)
+    after = await benchmark_mode(client, True, args)
+
+    print(f"\n{args.bookings} bookings per mode")
+    print(f"{'mode':<18} {'p50 latency':>12} {'p95 latency':>12} {'events/booking':>15}")
+    for mode, row in (("activities", before), ("local activities", after)):
+        print(f"{mode:<18} {row['p50_ms']:>10.0f}ms {row['p95_ms']:>10.0f}ms {row['events']:>15.1f}")
+    print(
+        f"{'change':<18} {after['p50_ms'] / before['p50_ms'] - 1:>12.0%} {after['p95_ms'] / before['p95_ms'] - 1:>12.0%}"
+        f" {after['events'] / before['events'] - 1:>15.0%}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Measure start-up time of the worker and web app entry points.
+
+Each entry point is imported in a fresh interpreter, once for wall-clock time and
+once with -X importtime for a per-module breakdown. The check fails when an entry
+point exceeds its time budget or imports a module it should not need, e.g. the
+web app pulling in workflow code or the worker pulling in Flask.
+
+Usage:
+    python check_startup.py [--runs 5] [--budget-scale 1.0] [--top 10]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Budgets are generous multiples of a warm start on a laptop; they catch an
+# accidental heavy import, not small drifts.
+ENTRY_POINTS = {
+    "starter": {
+        "budget_ms": 1000,
+        "forbidden": ["workflows", "activities", "temporalio.worker"],
+    },
+    "run_worker": {
+        "budget_ms": 1000,
+        "forbidden": ["flask", "fastapi", "starter"],
+    },
+}
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import(module, runs):
+    """Return the median wall-clock time in ms to start Python and import a module."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", f"import {module}"],
+            cwd=PROJECT_DIR,
+            check=True,
+            capture_output=True,
+        )
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def import_profile(module):
+    """
+    Import a module with -X importtime.
+
+    Returns:
+        dict: Module name to (self_us, cumulative_us).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def check_entry_point(module, config, runs, budget_scale, top):
+    """Print a report for one entry point and return a list of problems."""
+    problems = []
+    wall_ms = time_import(module, runs)
+    profile = import_profile(module)
+    budget_ms = config["budget_ms"] * budget_scale
+
+    print(f"\n{module}: {wall_ms:.0f} ms to import (median of {runs}, budget {budget_ms:.0f} ms)")
+    print(f"  {len(profile)} modules, {profile.get(module, (0, 0))[1] / 1000:.0f} ms cumulative under -X importtime")
+    print("  Slowest modules by self time:")
+    for name, (self_us, cumulative_us) in sorted(profile.items(), key=lambda item: -item[1][0])[:top]:
+        print(f"    {self_us / 1000:8.1f} ms  {name}")
+
+    if wall_ms > budget_ms:
+        problems.append(f"{module} took {wall_ms:.0f} ms to import, budget is {budget_ms:.0f} ms")
+    for forbidden in config["forbidden"]:
+        if forbidden in profile:
+            problems.append(f"{module} imports {forbidden}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Wall-clock samples per entry point")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply all budgets, e.g. for slow CI")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules to show")
+    args = parser.parse_args()
+
+    problems = []
+    for module, config in ENTRY_POINTS.items():
+        problems.extend(check_entry_point(module, config, args.runs, args.budget_scale, args.top))
+
+    if problems:
+        print("\nStart-up check failed:")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("\nStart-up check passed")
+
+
+if __name__ == "__main__":
+    main()
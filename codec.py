@@ -0,0 +1,165 @@
+"""
+Module for the optional payload compression codec.
+
+Workflow and activity inputs, results and heartbeat details are JSON, with the
+same keys repeated in every payload. With PAYLOAD_CODEC set, payloads of at least
+PAYLOAD_COMPRESSION_THRESHOLD bytes are compressed before they leave the process,
+so history storage and network traffic shrink. Smaller payloads are left as they
+are, as compression would not pay for itself.
+
+Booking payloads are a few hundred bytes each, too short to repeat their own
+keys, so they are compressed against a preset dictionary of the keys and values
+they share.
+
+Payloads that were not compressed decode as before, so the codec can be turned on
+for running bookings. Every client that reads booking payloads, i.e. the worker and
+the web app, must use the same setting. The web app serves /codec/decode for the
+Temporal UI.
+"""
+
+import functools
+import os
+import zlib
+from typing import List, Sequence
+
+from temporalio.api.common.v1 import Payload
+from temporalio.converter import DataConverter, PayloadCodec
+
+# "zlib", "zstd" or "" to store payloads uncompressed
+PAYLOAD_CODEC = os.environ.get("PAYLOAD_CODEC", "")
+PAYLOAD_COMPRESSION_THRESHOLD = int(os.environ.get("PAYLOAD_COMPRESSION_THRESHOLD", "128"))
+
+ENCODINGS = {
+    "zlib": b"binary/zlib",
+    "zstd": b"binary/zstd",
+}
+
+# Serialized JSON payloads of the booking workflow, with the values left out.
+# Stored payloads can only be decoded with the dictionary they were compressed
+# with, so once payloads are stored never change it; add a new encoding instead.
+# test_codec.py checks that the dataclass payloads below match their fields.
+PRESET_DICTIONARY = (
+    b'{"approval_deadline":null,"approval_decision":null,"approval_rules":null,"approval_status":null,'
+    b'"approval_tier":1,"compensations":["undo_book_car","undo_book_hotel","undo_book_flight"],'
+    b'"continued_runs":0,"hotel_result":null,"results":{}}'
+    b'{"allowed_hotels":[],"auto_approve_max_price":200.0,"auto_approve_tiers":["gold","platinum"],'
+    b'"auto_reject_min_price":2000.0,"blocked_hotels":[],"escalate_after_seconds":300.0,'
+    b'"escalation_timeout_seconds":300.0}'
+    b'{"message":"Booking approved via cancellation","status":"approved"}'
+    b'{"held_legs":{"car":"car-","flight":"flight-","hotel":"manual_hotel-"},'
+    b'"message":{"approval_status":"approved","booked_car":"Booked car: car-",'
+    b'"booked_flight":"Booked flight: flight-","booked_hotel":{}},"status":"success"}'
+    b'{"approved":true,"booked_hotel":"manual_hotel-","message":"Booked hotel: manual_hotel- (after approval)",'
+    b'"status":"confirmed"}'
+    b'{"booked_hotel":"manual_hotel-","manual_approval_needed":true,"message":"manual_approval_needed",'
+    b'"needs_approval":true,"price":null,"status":"waiting_for_approval","user_id":""}'
+    b'{"booking_id":"manual_hotel-","heartbeat_count":0,"manual_approval_needed":true,"needs_approval":true,'
+    b'"status":"waiting_for_approval","user_id":""}'
+    b'\n\x16\n\x08encoding\x12\njson/plain\x12'
+    b'{"attempts":3,"book_car_id":"car-","book_flight_id":"flight-","book_hotel_id":"manual_hotel-",'
+    b'"book_user_id":"","departure":null,"local_activities":false,"priority":"standard","user_tier":"standard"}'
+)
+
+
+def _zlib():
+    def compress(data):
+        compressor = zlib.compressobj(zdict=PRESET_DICTIONARY)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(data):
+        decompressor = zlib.decompressobj(zdict=PRESET_DICTIONARY)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    return compress, decompress
+
+
+def _zstd():
+    # Python 3.14 ships zstd, older versions need the zstandard package
+    try:
+        from compression import zstd
+    except ImportError:
+        pass
+    else:
+        dictionary = zstd.ZstdDict(PRESET_DICTIONARY, is_raw=True)
+        return (
+            lambda data: zstd.compress(data, zstd_dict=dictionary),
+            lambda data: zstd.decompress(data, zstd_dict=dictionary),
+        )
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("zstd payloads need Python 3.14 or the zstandard package") from e
+    dictionary = zstandard.ZstdCompressionDict(PRESET_DICTIONARY, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    return (
+        zstandard.ZstdCompressor(dict_data=dictionary).compress,
+        zstandard.ZstdDecompressor(dict_data=dictionary).decompress,
+    )
+
+
+@functools.lru_cache
+def _compressors(algorithm):
+    if algorithm == "zlib":
+        return _zlib()
+    if algorithm == "zstd":
+        return _zstd()
+    raise ValueError(f"Unknown payload codec {algorithm!r}, expected one of {', '.join(ENCODINGS)}")
+
+
+class CompressionCodec(PayloadCodec):
+    """
+    Compresses payloads at or above a size threshold.
+
+    The compressed payload wraps the whole original payload, metadata included,
+    under a "binary/zlib" or "binary/zstd" encoding. Decoding handles both
+    algorithms, whichever one is used for encoding.
+
+    Args:
+        algorithm: "zlib" or "zstd".
+        threshold: Smallest serialized payload size in bytes to compress.
+    """
+
+    def __init__(self, algorithm="zlib", threshold=PAYLOAD_COMPRESSION_THRESHOLD):
+        self._compress, _ = _compressors(algorithm)
+        self._encoding = ENCODINGS[algorithm]
+        self._threshold = threshold
+
+    async def encode(self, payloads: Sequence[Payload]) -> List[Payload]:
+        return [self._encode_payload(payload) for payload in payloads]
+
+    async def decode(self, payloads: Sequence[Payload]) -> List[Payload]:
+        return [decode_payload(payload) for payload in payloads]
+
+    def _encode_payload(self, payload):
+        serialized = payload.SerializeToString()
+        if len(serialized) < self._threshold:
+            return payload
+        compressed = self._compress(serialized)
+        if len(compressed) >= len(serialized):
+            return payload
+        return Payload(metadata={"encoding": self._encoding}, data=compressed)
+
+
+def decode_payload(payload):
+    """Return the original payload of a compressed one, and any other payload as is."""
+    encoding = payload.metadata.get("encoding")
+    for algorithm, algorithm_encoding in ENCODINGS.items():
+        if encoding == algorithm_encoding:
+            _, decompress = _compressors(algorithm)
+            return Payload.FromString(decompress(payload.data))
+    return payload
+
+
+def data_converter(algorithm=PAYLOAD_CODEC, threshold=PAYLOAD_COMPRESSION_THRESHOLD):
+    """
+    Return the data converter for Temporal clients.
+
+    Args:
+        algorithm: Compression algorithm, or "" for the default converter.
+        threshold: Smallest serialized payload size in bytes to compress.
+
+    Returns:
+        DataConverter: The default converter, with the compression codec if enabled.
+    """
+    if not algorithm:
+        return DataConverter.default
+    return DataConverter(payload_codec=CompressionCodec(algorithm, threshold))
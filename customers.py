@@ -0,0 +1,66 @@
+"""
+Module for looking up the customer a booking is made for.
+
+The booking form is anonymous. Callers that book for a known customer, such as
+the support desk or a partner, send the customer's API key in the X-Customer-Key
+header. Profiles are kept in a file only the web app reads, so what a booking is
+entitled to never comes from the request body.
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+from shared import USER_TIERS, Customer
+
+# JSON object mapping the SHA-256 hex digest of each customer's API key to the
+# Customer fields, e.g. {"3f7a...": {"name": "Jane Doe", "vip": true, "tier": "gold"}}
+CUSTOMERS_FILE = os.environ.get("CUSTOMERS_FILE", "customers.json")
+CUSTOMER_KEY_HEADER = "X-Customer-Key"
+
+
+def load_customers(path: str = CUSTOMERS_FILE) -> Dict[str, Customer]:
+    """
+    Load the customer directory from a JSON file.
+
+    Args:
+        path: Path to the customers file.
+
+    Returns:
+        dict: Customers by the SHA-256 hex digest of their API key, empty if the
+            file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as customers_file:
+        config = json.load(customers_file)
+    known = {f.name for f in dataclasses.fields(Customer)}
+    customers = {}
+    for key_digest, fields in config.items():
+        unknown = set(fields) - known
+        if unknown:
+            raise ValueError(f"Unknown customer fields in {path}: {', '.join(sorted(unknown))}")
+        customer = Customer(**fields)
+        if customer.tier not in USER_TIERS:
+            raise ValueError(f"Unknown tier {customer.tier!r} in {path}, expected one of {', '.join(USER_TIERS)}")
+        customers[key_digest] = customer
+    return customers
+
+
+def lookup_customer(customers: Dict[str, Customer], api_key: Optional[str]) -> Optional[Customer]:
+    """
+    Find the customer for an API key.
+
+    Args:
+        customers: Directory from load_customers.
+        api_key: Key sent by the caller, or None for an anonymous booking.
+
+    Returns:
+        Customer: The customer, an anonymous Customer when no key was sent, or
+            None when the key is not known.
+    """
+    if not api_key:
+        return Customer()
+    return customers.get(hashlib.sha256(api_key.encode()).hexdigest())
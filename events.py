@@ -0,0 +1,170 @@
+"""
+Module for pushing booking and approval status changes to web clients.
+"""
+
+import asyncio
+import itertools
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+
+class EventBus:
+    """
+    In-process publish/subscribe bus that fans events out to every subscriber.
+
+    Each subscriber (for example an open browser tab on the /events stream) gets its
+    own queue, so the number of viewers never changes how often Temporal is queried.
+    """
+
+    def __init__(self, max_queue_size=100, max_recent=500):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._max_queue_size = max_queue_size
+        self._max_recent = max_recent
+        self._recent = OrderedDict()
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self):
+        """Register a new subscriber and return its event queue."""
+        subscriber = queue.Queue(maxsize=self._max_queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber queue from the bus."""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type, data):
+        """
+        Publish an event to all subscribers.
+
+        Args:
+            event_type: Name of the event, used as the SSE event field.
+            data: JSON serialisable payload. A "workflow_id" key lets clients filter.
+
+        Returns:
+            dict: The published event.
+        """
+        event = {"id": next(self._ids), "type": event_type, "data": data}
+        with self._lock:
+            subscribers = list(self._subscribers)
+            workflow_id = data.get("workflow_id") if isinstance(data, dict) else None
+            if workflow_id:
+                # Remember the latest event per workflow so late subscribers can catch up
+                self._recent[workflow_id] = event
+                self._recent.move_to_end(workflow_id)
+                while len(self._recent) > self._max_recent:
+                    self._recent.popitem(last=False)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Drop events for slow consumers instead of blocking the publisher
+                print(f"Dropping {event_type} event for a slow subscriber")
+        return event
+
+    def last_event(self, workflow_id):
+        """Return the most recent event published for a workflow, if any."""
+        with self._lock:
+            return self._recent.get(workflow_id)
+
+
+def format_sse(event):
+    """Format an event as a server-sent events message."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+
+class BackgroundLoop:
+    """
+    An asyncio event loop running in a daemon thread.
+
+    Flask runs each async view in a short-lived loop, so long-running watchers
+    are scheduled here instead.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="background-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the background loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+class ApprovalWatcher:
+    """
+    Periodically scans for pending approvals and publishes the differences.
+
+    Only one scan runs per interval regardless of how many clients are listening,
+    and no scans run at all while nobody is subscribed.
+    """
+
+    def __init__(self, scan, event_bus, interval_seconds=5):
+        self._scan = scan
+        self._event_bus = event_bus
+        self._interval_seconds = interval_seconds
+        self._snapshot = {}
+        self._loop = None
+        self._wake = None
+
+    def refresh(self):
+        """Request an immediate rescan. Safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def forget(self, workflow_id):
+        """Drop a workflow from the snapshot after it has been cleared elsewhere."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._snapshot.pop, workflow_id, None)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+
+        while True:
+            if self._event_bus.subscriber_count > 0:
+                try:
+                    approvals = await self._scan()
+                    self._publish_changes(approvals)
+                except Exception as e:
+                    print(f"Error scanning pending approvals: {str(e)}")
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _publish_changes(self, approvals):
+        current = {approval["workflow_id"]: approval for approval in approvals}
+
+        for workflow_id, approval in current.items():
+            if workflow_id not in self._snapshot:
+                self._event_bus.publish("approval_added", approval)
+            elif _approval_tier(approval) != _approval_tier(self._snapshot[workflow_id]):
+                self._event_bus.publish("approval_escalated", approval)
+
+        for workflow_id in self._snapshot:
+            if workflow_id not in current:
+                self._event_bus.publish("approval_cleared", {"workflow_id": workflow_id})
+
+        self._snapshot = current
+
+
+def _approval_tier(approval):
+    return approval.get("details", {}).get("approval_tier", 1)
@@ -0,0 +1,415 @@
+"""
+Module for worker interceptors.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, NoReturn, Optional, Type
+
+from temporalio import activity, workflow
+from temporalio.exceptions import FailureError
+from temporalio.worker import (
+    ActivityInboundInterceptor,
+    ContinueAsNewInput,
+    ExecuteActivityInput,
+    ExecuteWorkflowInput,
+    HandleSignalInput,
+    HandleUpdateInput,
+    Interceptor,
+    WorkflowInboundInterceptor,
+    WorkflowInterceptorClassInput,
+    WorkflowOutboundInterceptor,
+)
+
+from activities import BOOKING_ACTIVITY_LEGS
+from read_model import BookingProjector
+from shared import BOOKING_WORKFLOW_NAME
+
+# Log a warning above these sizes. The server warns at 10K events / 10 MB and
+# terminates workflows at 50K events / 50 MB.
+HISTORY_LENGTH_ALERT = 5000
+HISTORY_SIZE_ALERT_BYTES = 5 * 1024 * 1024
+
+
+def record_history_size(reason: str) -> None:
+    """Record the current run's history length and size, and alert when oversized."""
+    info = workflow.info()
+    length = info.get_current_history_length()
+    size = info.get_current_history_size()
+
+    meter = workflow.metric_meter().with_additional_attributes({"workflow_type": info.workflow_type})
+    meter.create_histogram(
+        "workflow_history_length", "History events of a workflow run", "events"
+    ).record(length)
+    meter.create_histogram(
+        "workflow_history_size", "History size of a workflow run", "bytes"
+    ).record(size)
+
+    if length > HISTORY_LENGTH_ALERT or size > HISTORY_SIZE_ALERT_BYTES:
+        meter.create_counter(
+            "workflow_history_oversized", "Workflow runs with an oversized history"
+        ).add(1)
+        workflow.logger.warning(
+            f"Oversized history on {reason}: {info.workflow_id} has {length} events, {size} bytes"
+        )
+
+
+class HistorySizeInterceptor(Interceptor):
+    """
+    Records workflow history length and size as metrics on the worker.
+
+    Sizes are sampled after each signal, on continue-as-new and when a run ends.
+    """
+
+    def workflow_interceptor_class(
+        self, input: WorkflowInterceptorClassInput
+    ) -> Optional[Type[WorkflowInboundInterceptor]]:
+        return _HistorySizeWorkflowInboundInterceptor
+
+
+class _HistorySizeWorkflowInboundInterceptor(WorkflowInboundInterceptor):
+    def init(self, outbound: WorkflowOutboundInterceptor) -> None:
+        super().init(_HistorySizeWorkflowOutboundInterceptor(outbound))
+
+    async def execute_workflow(self, input: ExecuteWorkflowInput) -> Any:
+        result = await super().execute_workflow(input)
+        record_history_size("completion")
+        return result
+
+    async def handle_signal(self, input: HandleSignalInput) -> None:
+        await super().handle_signal(input)
+        record_history_size(f"signal {input.signal}")
+
+
+class _HistorySizeWorkflowOutboundInterceptor(WorkflowOutboundInterceptor):
+    def continue_as_new(self, input: ContinueAsNewInput) -> NoReturn:
+        record_history_size("continue-as-new")
+        super().continue_as_new(input)
+
+
+class BookingProjectionInterceptor(Interceptor):
+    """
+    Projects booking lifecycle events into the SQLite read-model.
+
+    Starts and results come from the workflow, and are skipped while replaying
+    so a cached-out workflow does not publish them again. Leg changes and the
+    approval wait come from the booking activities' results.
+
+    Args:
+        projector: Where to publish the events.
+    """
+
+    def __init__(self, projector: BookingProjector):
+        self._projector = projector
+        # The worker instantiates workflow interceptors itself, so bind the projector to a subclass
+        self._workflow_interceptor_class = type(
+            "_BoundProjectionWorkflowInboundInterceptor",
+            (_ProjectionWorkflowInboundInterceptor,),
+            {"projector": projector},
+        )
+
+    def intercept_activity(self, next: ActivityInboundInterceptor) -> ActivityInboundInterceptor:
+        return _ProjectionActivityInboundInterceptor(next, self._projector)
+
+    def workflow_interceptor_class(
+        self, input: WorkflowInterceptorClassInput
+    ) -> Optional[Type[WorkflowInboundInterceptor]]:
+        return self._workflow_interceptor_class
+
+
+class _ProjectionWorkflowInboundInterceptor(WorkflowInboundInterceptor):
+    projector: BookingProjector
+
+    def _publish(self, **columns):
+        if not workflow.unsafe.is_replaying():
+            now = workflow.now().isoformat()
+            self.projector.publish({"workflow_id": workflow.info().workflow_id, "at": now, **columns})
+
+    async def execute_workflow(self, input: ExecuteWorkflowInput) -> Any:
+        info = workflow.info()
+        if info.workflow_type != BOOKING_WORKFLOW_NAME:
+            return await super().execute_workflow(input)
+
+        # A continued run is the same booking, already in the read-model
+        if info.continued_run_id is None:
+            book_input = input.args[0]
+            self._publish(
+                user_id=book_input.book_user_id,
+                car_id=book_input.book_car_id,
+                hotel_id=book_input.book_hotel_id,
+                flight_id=book_input.book_flight_id,
+                priority=book_input.priority,
+                status="running",
+                started_at=workflow.now().isoformat(),
+            )
+        try:
+            result = await super().execute_workflow(input)
+        except FailureError as e:
+            self._publish(status="failed", message=str(e), closed_at=workflow.now().isoformat())
+            raise
+
+        if isinstance(result, dict) and result.get("status") == "success":
+            self._publish(status="succeeded", closed_at=workflow.now().isoformat())
+        else:
+            message = result.get("message") if isinstance(result, dict) else result
+            self._publish(status="failed", message=str(message), closed_at=workflow.now().isoformat())
+        return result
+
+
+class _ProjectionActivityInboundInterceptor(ActivityInboundInterceptor):
+    def __init__(self, next: ActivityInboundInterceptor, projector: BookingProjector):
+        super().__init__(next)
+        self._projector = projector
+
+    async def execute_activity(self, input: ExecuteActivityInput) -> Any:
+        result = await super().execute_activity(input)
+
+        info = activity.info()
+        leg = BOOKING_ACTIVITY_LEGS.get(info.activity_type)
+        if info.workflow_type == BOOKING_WORKFLOW_NAME and leg:
+            book_input = input.args[0]
+            event = {
+                "workflow_id": info.workflow_id,
+                "at": datetime.now(timezone.utc).isoformat(),
+                # Amendments rebook a leg under a new ID
+                f"{leg}_id": getattr(book_input, f"book_{leg}_id"),
+            }
+            if info.activity_type == "book_hotel" and isinstance(result, dict) and result.get("manual_approval_needed"):
+                event["status"] = "waiting_for_approval"
+            elif info.activity_type == "complete_hotel_booking":
+                event["status"] = "running"
+            self._projector.publish(event)
+        return result
+
+
+# Upper bounds in ms of the latency buckets kept for the debug endpoint
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, float("inf"))
+
+
+class LatencyStats:
+    """Bucketed latency histogram with count, sum and max, for percentile estimates."""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of calls, capped at the max seen."""
+        threshold = fraction * self.count
+        seen = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += bucket_count
+            if seen >= threshold:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else 0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class LatencyRecorder:
+    """
+    Latency histograms and slow-call samples kept in the worker process.
+
+    Thread-safe, as activities run on the worker's event loop and workflows on
+    the workflow task threads.
+
+    Args:
+        slow_threshold_ms: Calls at or above this duration are kept as samples.
+        max_samples: Most recent slow-call samples to keep.
+    """
+
+    def __init__(self, slow_threshold_ms=1000.0, max_samples=100):
+        self.slow_threshold_ms = slow_threshold_ms
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow_calls = deque(maxlen=max_samples)
+
+    def record(self, metric, labels, ms):
+        """
+        Add a latency measurement.
+
+        Args:
+            metric: Name of the measurement, e.g. "activity_execution".
+            labels: Dict of labels the histogram is kept per, e.g. activity type and attempt.
+            ms: Latency in milliseconds.
+        """
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = LatencyStats()
+            stats.record(ms)
+
+    def sample_slow_call(self, duration_ms, details):
+        """Keep the details of a call if it took at least the slow-call threshold."""
+        if duration_ms >= self.slow_threshold_ms:
+            with self._lock:
+                self._slow_calls.append({"duration_ms": round(duration_ms, 1), **details})
+
+    def snapshot(self):
+        """Return all histograms and slow-call samples, slowest histograms first."""
+        with self._lock:
+            histograms = [
+                {"metric": metric, "labels": dict(labels), **stats.summary()}
+                for (metric, labels), stats in self._stats.items()
+            ]
+            slow_calls = list(self._slow_calls)
+        histograms.sort(key=lambda histogram: (histogram["metric"], -histogram["p95_ms"]))
+        return {
+            "slow_threshold_ms": self.slow_threshold_ms,
+            "histograms": histograms,
+            "slow_calls": slow_calls[::-1],
+        }
+
+
+def _attempt_label(attempt):
+    # Keep label cardinality bounded however often an activity retries
+    return str(attempt) if attempt < 5 else "5+"
+
+
+class LatencyInterceptor(Interceptor):
+    """
+    Records activity, update and workflow latencies per type and samples slow calls.
+
+    Activities are measured per type and attempt, along with their
+    schedule-to-start queue latency. Workflows are measured end to end per run,
+    and updates per handler. Measurements go to the worker's metrics (see
+    WORKER_METRICS_PORT) and to a LatencyRecorder for the debug endpoint. Workflow
+    task latency itself is reported by the SDK's own metrics.
+
+    Args:
+        recorder: Where to keep histograms and slow-call samples.
+    """
+
+    def __init__(self, recorder: LatencyRecorder):
+        self._recorder = recorder
+        self._workflow_interceptor_class = type(
+            "_BoundLatencyWorkflowInboundInterceptor",
+            (_LatencyWorkflowInboundInterceptor,),
+            {"recorder": recorder},
+        )
+
+    def intercept_activity(self, next: ActivityInboundInterceptor) -> ActivityInboundInterceptor:
+        return _LatencyActivityInboundInterceptor(next, self._recorder)
+
+    def workflow_interceptor_class(
+        self, input: WorkflowInterceptorClassInput
+    ) -> Optional[Type[WorkflowInboundInterceptor]]:
+        return self._workflow_interceptor_class
+
+
+class _LatencyActivityInboundInterceptor(ActivityInboundInterceptor):
+    def __init__(self, next: ActivityInboundInterceptor, recorder: LatencyRecorder):
+        super().__init__(next)
+        self._recorder = recorder
+
+    async def execute_activity(self, input: ExecuteActivityInput) -> Any:
+        info = activity.info()
+        schedule_to_start_ms = None
+        if not info.is_local and info.current_attempt_scheduled_time and info.started_time:
+            schedule_to_start_ms = (info.started_time - info.current_attempt_scheduled_time).total_seconds() * 1000
+
+        started = time.perf_counter()
+        outcome = "completed"
+        try:
+            return await super().execute_activity(input)
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            labels = {"activity_type": info.activity_type, "attempt": _attempt_label(info.attempt)}
+
+            meter = activity.metric_meter().with_additional_attributes(labels)
+            meter.create_histogram(
+                "booking_activity_execution_latency", "Activity execution time per type and attempt", "ms"
+            ).record(int(duration_ms))
+            self._recorder.record("activity_execution", {**labels, "outcome": outcome}, duration_ms)
+            if schedule_to_start_ms is not None:
+                meter.create_histogram(
+                    "booking_activity_schedule_to_start_latency", "Time activities wait in the task queue", "ms"
+                ).record(int(schedule_to_start_ms))
+                self._recorder.record(
+                    "activity_schedule_to_start", {"task_queue": info.task_queue}, schedule_to_start_ms
+                )
+
+            self._recorder.sample_slow_call(duration_ms, {
+                "kind": "activity",
+                "name": info.activity_type,
+                "attempt": info.attempt,
+                "outcome": outcome,
+                "schedule_to_start_ms": round(schedule_to_start_ms, 1) if schedule_to_start_ms is not None else None,
+                "workflow_id": info.workflow_id,
+                "workflow_type": info.workflow_type,
+                "activity_id": info.activity_id,
+                "task_queue": info.task_queue,
+                "started_at": info.started_time.isoformat() if info.started_time else None,
+            })
+
+
+class _LatencyWorkflowInboundInterceptor(WorkflowInboundInterceptor):
+    recorder: LatencyRecorder
+
+    def _record(self, kind, name, started_at, outcome):
+        # Replays re-run handlers that were measured the first time round
+        if workflow.unsafe.is_replaying():
+            return
+        info = workflow.info()
+        duration_ms = (workflow.now() - started_at).total_seconds() * 1000
+        workflow.metric_meter().create_histogram(
+            f"booking_{kind}_latency", f"Workflow {kind} duration, from workflow time", "ms"
+        ).record(int(duration_ms), {"name": name, "outcome": outcome})
+        self.recorder.record(kind, {"name": name, "outcome": outcome}, duration_ms)
+        self.recorder.sample_slow_call(duration_ms, {
+            "kind": kind,
+            "name": name,
+            "outcome": outcome,
+            "workflow_id": info.workflow_id,
+            "run_id": info.run_id,
+            "task_queue": info.task_queue,
+            "history_length": info.get_current_history_length(),
+            "started_at": started_at.isoformat(),
+        })
+
+    async def execute_workflow(self, input: ExecuteWorkflowInput) -> Any:
+        info = workflow.info()
+        try:
+            result = await super().execute_workflow(input)
+        except workflow.ContinueAsNewError:
+            self._record("workflow", info.workflow_type, info.start_time, "continued_as_new")
+            raise
+        except FailureError as e:
+            self._record("workflow", info.workflow_type, info.start_time, type(e).__name__)
+            raise
+        compensated = isinstance(result, dict) and result.get("status") == "failure"
+        self._record("workflow", info.workflow_type, info.start_time, "compensated" if compensated else "completed")
+        return result
+
+    async def handle_update_handler(self, input: HandleUpdateInput) -> Any:
+        started_at = workflow.now()
+        try:
+            result = await super().handle_update_handler(input)
+        except FailureError as e:
+            self._record("update", input.update, started_at, type(e).__name__)
+            raise
+        self._record("update", input.update, started_at, "completed")
+        return result
@@ -0,0 +1,185 @@
+"""
+Module for the SQLite read-model of bookings.
+
+The worker projects booking lifecycle events into a local SQLite database so
+listings and reports can be served without asking Temporal for workflow
+histories.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+BOOKINGS_DB_PATH = os.environ.get(
+    "BOOKINGS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bookings.db")
+)
+
+BOOKING_STATUSES = ("running", "waiting_for_approval", "succeeded", "failed")
+FINAL_STATUSES = ("succeeded", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    workflow_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    car_id TEXT,
+    hotel_id TEXT,
+    flight_id TEXT,
+    priority TEXT,
+    status TEXT NOT NULL,
+    message TEXT,
+    started_at TEXT,
+    updated_at TEXT NOT NULL,
+    closed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS bookings_by_user ON bookings (user_id, updated_at, workflow_id);
+CREATE INDEX IF NOT EXISTS bookings_by_status ON bookings (status, updated_at, workflow_id);
+CREATE INDEX IF NOT EXISTS bookings_by_hotel ON bookings (hotel_id, updated_at, workflow_id);
+CREATE INDEX IF NOT EXISTS bookings_by_update ON bookings (updated_at, workflow_id);
+"""
+
+# Columns an event may set. Missing values keep what is stored.
+EVENT_COLUMNS = ("user_id", "car_id", "hotel_id", "flight_id", "priority", "status", "message", "started_at", "closed_at")
+
+
+class BookingStore:
+    """
+    SQLite store for the booking read-model.
+
+    Uses WAL mode so the web app can read while the worker writes.
+
+    Args:
+        path: Path to the SQLite database file.
+    """
+
+    def __init__(self, path=BOOKINGS_DB_PATH):
+        self._path = path
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # A connection per call keeps the store safe to share between threads
+        connection = sqlite3.connect(self._path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def apply(self, events):
+        """
+        Write a batch of booking events in a single transaction.
+
+        Args:
+            events: Dicts with a "workflow_id", an "at" timestamp and any of EVENT_COLUMNS.
+        """
+        rows = [
+            {"workflow_id": event["workflow_id"], "at": event["at"], **{column: event.get(column) for column in EVENT_COLUMNS}}
+            for event in events
+        ]
+        columns = ", ".join(EVENT_COLUMNS)
+        values = ", ".join(
+            "COALESCE(:status, 'running')" if column == "status" else f":{column}" for column in EVENT_COLUMNS
+        )
+        updates = ", ".join(
+            f"{column} = COALESCE(:{column}, {column})" for column in EVENT_COLUMNS if column != "status"
+        )
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    f"""
+                    INSERT INTO bookings (workflow_id, {columns}, updated_at)
+                    VALUES (:workflow_id, {values}, :at)
+                    ON CONFLICT (workflow_id) DO UPDATE SET
+                        {updates},
+                        -- Late progress events never reopen a finished booking
+                        status = CASE
+                            WHEN status IN {FINAL_STATUSES} AND :closed_at IS NULL THEN status
+                            ELSE COALESCE(:status, status)
+                        END,
+                        updated_at = :at
+                    """,
+                    rows,
+                )
+        finally:
+            connection.close()
+
+    def list_bookings(self, user_id=None, status=None, hotel_id=None, limit=50, after=None):
+        """
+        List bookings, most recently updated first.
+
+        Args:
+            user_id: Only bookings of this user.
+            status: Only bookings in this status.
+            hotel_id: Only bookings of this hotel.
+            limit: Maximum number of bookings to return.
+            after: (updated_at, workflow_id) of the last booking of the previous page.
+
+        Returns:
+            list: Bookings as dicts.
+        """
+        conditions = []
+        params = []
+        for column, value in (("user_id", user_id), ("status", status), ("hotel_id", hotel_id)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if after:
+            # Keyset pagination, so deep pages cost the same as the first one
+            conditions.append("(updated_at, workflow_id) < (?, ?)")
+            params.extend(after)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                f"SELECT * FROM bookings {where} ORDER BY updated_at DESC, workflow_id DESC LIMIT ?",
+                [*params, limit],
+            ).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+
+class BookingProjector:
+    """
+    Buffers booking events and writes them to a BookingStore in batches.
+
+    publish() never blocks, so it is safe to call from workflow and activity
+    interceptors. A writer thread flushes when a batch is full or has waited
+    flush_interval seconds.
+    """
+
+    def __init__(self, store, batch_size=100, flush_interval=1.0):
+        self._store = store
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._events = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="booking-projector", daemon=True)
+        self._thread.start()
+
+    def publish(self, event):
+        """Queue an event for the next batch."""
+        self._events.put(event)
+
+    def close(self):
+        """Write the remaining events and stop the writer thread."""
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._events.empty()):
+            batch = []
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._events.get(timeout=max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    if time.monotonic() >= deadline or self._stopped.is_set():
+                        break
+            if batch:
+                try:
+                    self._store.apply(batch)
+                except sqlite3.Error as e:
+                    print(f"Error writing {len(batch)} booking events: {str(e)}")
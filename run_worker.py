@@ -1,34 +1,185 @@
 import asyncio
+import json
+import os
+import signal
+from datetime import timedelta
 
-from temporalio.client import Client
+from temporalio.api.enums.v1 import IndexedValueType
+from temporalio.api.operatorservice.v1 import (
+    AddSearchAttributesRequest,
+    ListSearchAttributesRequest,
+)
+from temporalio.client import (
+    Client,
+    Schedule,
+    ScheduleActionStartWorkflow,
+    ScheduleAlreadyRunningError,
+    ScheduleIntervalSpec,
+    ScheduleOverlapPolicy,
+    SchedulePolicy,
+    ScheduleSpec,
+)
+from temporalio.runtime import PrometheusConfig, Runtime, TelemetryConfig
 from temporalio.worker import Worker
+from temporalio.worker.workflow_sandbox import SandboxedWorkflowRunner, SandboxRestrictions
 
 from activities import (
+    ReconciliationActivities,
     book_car,
     book_flight,
     book_hotel,
     complete_hotel_booking,
+    get_approval_rules,
     undo_book_car,
     undo_book_flight,
     undo_book_hotel,
     wait_for_human_approval,
 )
-from shared import TASK_QUEUE_NAME
-from workflows import BookingWorkflow
+from interceptors import BookingProjectionInterceptor, HistorySizeInterceptor, LatencyInterceptor, LatencyRecorder
+from read_model import BookingProjector, BookingStore
+from shared import (
+    APPROVAL_PENDING_ATTRIBUTE,
+    APPROVAL_TIER_ATTRIBUTE,
+    BOOKING_NAMESPACES,
+    COMPENSATION_FAILED_ATTRIBUTE,
+    HOTEL_ID_ATTRIBUTE,
+    PRIORITY_TASK_QUEUE_NAME,
+    RECONCILIATION_WORKFLOW_NAME,
+    TASK_QUEUE_NAME,
+    ReconciliationInput,
+    get_client,
+)
+from workflows import PASSTHROUGH_MODULES, BookingWorkflow, ReconcileBookingsWorkflow, RetryOrphanedLegsWorkflow
 
 interrupt_event = asyncio.Event()
 
+# Time in-flight activities get to finish once the worker stops polling
+GRACEFUL_SHUTDOWN_TIMEOUT = timedelta(
+    seconds=float(os.environ.get("WORKER_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+)
+HEALTH_PORT = int(os.environ.get("WORKER_HEALTH_PORT", "8081"))
+# Serve SDK and workflow metrics (e.g. workflow_history_size) for Prometheus when set
+METRICS_PORT = os.environ.get("WORKER_METRICS_PORT")
 
-async def main():
+# Task queues this process polls, with their own activity and workflow task slots.
+# The priority lane is kept small and mostly idle so urgent bookings start at once
+# even when the standard queue is backlogged. Set WORKER_LANES to run one lane per
+# process and scale them separately.
+#
+# The workflow cache should hold every booking a worker has open, as bookings sit
+# in approval waits for minutes. An evicted booking replays its whole history on
+# its next signal, update or timer; benchmark_cache.py measures the hit rate.
+LANES = {
+    "standard": {
+        "task_queue": TASK_QUEUE_NAME,
+        "max_concurrent_activities": int(os.environ.get("WORKER_MAX_CONCURRENT_ACTIVITIES", "100")),
+        "max_concurrent_workflow_tasks": int(os.environ.get("WORKER_MAX_CONCURRENT_WORKFLOW_TASKS", "100")),
+        "max_cached_workflows": int(os.environ.get("WORKER_MAX_CACHED_WORKFLOWS", "1000")),
+    },
+    "priority": {
+        "task_queue": PRIORITY_TASK_QUEUE_NAME,
+        "max_concurrent_activities": int(os.environ.get("WORKER_PRIORITY_MAX_CONCURRENT_ACTIVITIES", "20")),
+        "max_concurrent_workflow_tasks": int(os.environ.get("WORKER_PRIORITY_MAX_CONCURRENT_WORKFLOW_TASKS", "20")),
+        "max_cached_workflows": int(os.environ.get("WORKER_PRIORITY_MAX_CACHED_WORKFLOWS", "250")),
+    },
+}
+ENABLED_LANES = os.environ.get("WORKER_LANES", "standard,priority").split(",")
+
+# Activity, update and workflow calls at least this slow are kept as samples for GET /debug/latency
+SLOW_CALL_THRESHOLD_MS = float(os.environ.get("WORKER_SLOW_CALL_THRESHOLD_MS", "1000"))
+
+# Project booking events into the SQLite read-model served by GET /bookings
+READ_MODEL_ENABLED = os.environ.get("BOOKINGS_READ_MODEL", "1") != "0"
+
+# How often ReconcileBookingsWorkflow looks for bookings that leaked a leg; 0 disables it
+RECONCILIATION_SCHEDULE_ID = "booking-reconciliation"
+RECONCILIATION_INTERVAL = timedelta(minutes=float(os.environ.get("RECONCILIATION_INTERVAL_MINUTES", "15")))
+
+
+async def ensure_search_attributes(client: Client):
     """
-    Main function to start the worker.
+    Register the custom search attributes used by the booking listings.
+
+    Args:
+        client: Connected Temporal client.
     """
-    client = await Client.connect("localhost:7233")
+    existing = await client.operator_service.list_search_attributes(
+        ListSearchAttributesRequest(namespace=client.namespace)
+    )
+    required = {
+        APPROVAL_PENDING_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_BOOL,
+        HOTEL_ID_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_KEYWORD,
+        APPROVAL_TIER_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_INT,
+        COMPENSATION_FAILED_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_BOOL,
+    }
+    missing = {
+        name: value_type
+        for name, value_type in required.items()
+        if name not in existing.custom_attributes
+    }
+    if missing:
+        print(f"Registering search attributes: {', '.join(missing)}")
+        await client.operator_service.add_search_attributes(
+            AddSearchAttributesRequest(namespace=client.namespace, search_attributes=missing)
+        )
 
-    worker = Worker(
+
+async def ensure_reconciliation_schedule(client: Client):
+    """
+    Create the schedule that runs ReconcileBookingsWorkflow, unless it already exists.
+
+    Args:
+        client: Connected Temporal client.
+    """
+    if not RECONCILIATION_INTERVAL:
+        return
+    if "standard" not in [lane.strip() for lane in ENABLED_LANES]:
+        # Reconciliation runs on the standard queue, which this process does not poll;
+        # the process that runs the standard lane creates the schedule
+        print(f"Not creating schedule {RECONCILIATION_SCHEDULE_ID}: the standard lane is not enabled")
+        return
+    try:
+        await client.create_schedule(
+            RECONCILIATION_SCHEDULE_ID,
+            Schedule(
+                action=ScheduleActionStartWorkflow(
+                    RECONCILIATION_WORKFLOW_NAME,
+                    # Each run scans one interval's worth of closed bookings
+                    ReconciliationInput(window_seconds=RECONCILIATION_INTERVAL.total_seconds()),
+                    id=RECONCILIATION_SCHEDULE_ID,
+                    task_queue=LANES["standard"]["task_queue"],
+                ),
+                spec=ScheduleSpec(intervals=[ScheduleIntervalSpec(every=RECONCILIATION_INTERVAL)]),
+                # A run that starts late still covers its own window, so buffer it
+                # instead of skipping it
+                policy=SchedulePolicy(overlap=ScheduleOverlapPolicy.BUFFER_ONE),
+            ),
+        )
+        print(f"Created schedule {RECONCILIATION_SCHEDULE_ID} every {RECONCILIATION_INTERVAL}")
+    except ScheduleAlreadyRunningError:
+        pass
+
+
+def create_worker(client: Client, task_queue: str, projector=None, latency_recorder=None, **options) -> Worker:
+    """
+    Create a worker for the booking workflow and activities on one task queue.
+
+    Args:
+        client: Connected Temporal client.
+        task_queue: Task queue to poll.
+        projector: BookingProjector for the read-model, if enabled.
+        latency_recorder: LatencyRecorder for latency histograms and slow-call samples, if enabled.
+        **options: Extra Worker options, e.g. concurrency limits.
+    """
+    interceptors = [HistorySizeInterceptor()]
+    if projector is not None:
+        interceptors.append(BookingProjectionInterceptor(projector))
+    if latency_recorder is not None:
+        interceptors.append(LatencyInterceptor(latency_recorder))
+    return Worker(
         client,
-        task_queue=TASK_QUEUE_NAME,
-        workflows=[BookingWorkflow],
+        task_queue=task_queue,
+        workflows=[BookingWorkflow, ReconcileBookingsWorkflow, RetryOrphanedLegsWorkflow],
         activities=[
             book_car,
             book_hotel,
@@ -38,21 +189,143 @@ async def main():
             undo_book_flight,
             wait_for_human_approval,
             complete_hotel_booking,
+            get_approval_rules,
+            ReconciliationActivities(client).find_orphaned_bookings,
         ],
+        workflow_runner=SandboxedWorkflowRunner(
+            restrictions=SandboxRestrictions.default.with_passthrough_modules(*PASSTHROUGH_MODULES)
+        ),
+        interceptors=interceptors,
+        graceful_shutdown_timeout=GRACEFUL_SHUTDOWN_TIMEOUT,
+        **options,
     )
-    print("\nWorker started, ctrl+c to exit\n")
-    await worker.run()
+
+
+class WorkerHealth:
+    """
+    Liveness, readiness and drain state of the worker, served over HTTP.
+
+    GET /healthz is the liveness probe, GET /readyz the readiness probe and
+    POST /drain stops polling and lets in-flight tasks finish. GET /debug/latency
+    returns the latency histograms and slow-call samples of a LatencyRecorder.
+    """
+
+    def __init__(self, latency_recorder=None):
+        self.latency_recorder = latency_recorder
+        self.ready = False
+        self.draining = False
+        self.drained = False
+        self.drain_event = asyncio.Event()
+
+    def route(self, method, path):
+        """Return the HTTP status line and JSON body for a request."""
+        if method == "GET" and path == "/healthz":
+            return "200 OK", {"status": "alive"}
+        if method == "GET" and path == "/readyz":
+            if self.ready:
+                return "200 OK", {"status": "ready"}
+            status = "drained" if self.drained else "draining" if self.draining else "starting"
+            return "503 Service Unavailable", {"status": status}
+        if method == "POST" and path == "/drain":
+            self.drain_event.set()
+            return "202 Accepted", {"status": "draining"}
+        if method == "GET" and path == "/debug/latency" and self.latency_recorder is not None:
+            return "200 OK", self.latency_recorder.snapshot()
+        return "404 Not Found", {"error": f"Unknown endpoint: {method} {path}"}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the headers, none of the endpoints take a body
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            method, path = request_line.decode().split()[:2]
+            status, body = self.route(method, path)
+        except Exception as e:
+            status, body = "400 Bad Request", {"error": str(e)}
+
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def main():
+    """
+    Main function to start a worker for each booking namespace and enabled lane.
+
+    SIGINT/SIGTERM or POST /drain stop polling for new tasks and give in-flight
+    activities up to GRACEFUL_SHUTDOWN_TIMEOUT to finish. After a drain the process
+    keeps serving health checks until it is signalled to exit.
+    """
+    runtime = None
+    if METRICS_PORT:
+        runtime = Runtime(
+            telemetry=TelemetryConfig(metrics=PrometheusConfig(bind_address=f"0.0.0.0:{METRICS_PORT}"))
+        )
+    # Each booking namespace gets its own workers, all over one connection
+    clients = []
+    for namespace in BOOKING_NAMESPACES:
+        client = await get_client(namespace, runtime=runtime)
+        await ensure_search_attributes(client)
+        await ensure_reconciliation_schedule(client)
+        clients.append(client)
+
+    projector = BookingProjector(BookingStore()) if READ_MODEL_ENABLED else None
+    latency_recorder = LatencyRecorder(slow_threshold_ms=SLOW_CALL_THRESHOLD_MS)
+    workers = [
+        create_worker(client, projector=projector, latency_recorder=latency_recorder, **LANES[lane.strip()])
+        for client in clients
+        for lane in ENABLED_LANES
+    ]
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, interrupt_event.set)
+
+    health = WorkerHealth(latency_recorder)
+    health_server = await asyncio.start_server(health.handle, port=HEALTH_PORT)
+
+    worker_tasks = [asyncio.create_task(worker.run()) for worker in workers]
+    health.ready = True
+    task_queues = ", ".join(f"{worker.client.namespace}/{worker.task_queue}" for worker in workers)
+    print(f"\nWorker started on {task_queues}, ctrl+c to exit (health checks on port {HEALTH_PORT})\n")
+
     try:
-        await interrupt_event.wait()
+        stop_tasks = [
+            asyncio.create_task(interrupt_event.wait()),
+            asyncio.create_task(health.drain_event.wait()),
+        ]
+        await asyncio.wait([*worker_tasks, *stop_tasks], return_when=asyncio.FIRST_COMPLETED)
+        for task in stop_tasks:
+            task.cancel()
+
+        health.ready = False
+        health.draining = True
+        print("\nDraining: polling stopped, waiting for in-flight activities\n")
+        await asyncio.gather(*(
+            worker.shutdown() for worker, task in zip(workers, worker_tasks) if not task.done()
+        ))
+        # Re-raises if a worker stopped because of a fatal error
+        await asyncio.gather(*worker_tasks)
+        health.drained = True
+
+        if not interrupt_event.is_set():
+            print("\nWorker drained, waiting for a stop signal\n")
+            await interrupt_event.wait()
     finally:
+        health_server.close()
+        await health_server.wait_closed()
+        if projector is not None:
+            # Write the events buffered during the drain
+            await asyncio.to_thread(projector.close)
         print("\nShutting down the worker\n")
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(main())
-    except KeyboardInterrupt:
-        print("\nInterrupt received, shutting down...\n")
-        interrupt_event.set()
-        loop.run_until_complete(loop.shutdown_asyncgens())
+    asyncio.run(main())
@@ -1,4 +1,16 @@
-from dataclasses import dataclass
+import asyncio
+import dataclasses
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from temporalio.client import Client, Interceptor, OutboundInterceptor
+from temporalio.common import SearchAttributeKey
+from temporalio.service import KeepAliveConfig, TLSConfig
+
+from codec import data_converter
 
 
 @dataclass
@@ -8,6 +20,353 @@ class BookVacationInput:
     book_car_id: str
     book_hotel_id: str
     book_flight_id: str
+    # "standard" or "vip"
+    priority: str = "standard"
+    # ISO 8601 departure time; activity timeouts are derived from what is left of it
+    departure: Optional[str] = None
+    # Loyalty tier from the customer directory, used by the approval rules
+    user_tier: str = "standard"
+    # Run the short car, flight and compensation calls as local activities
+    local_activities: bool = False
+
+
+@dataclass
+class Customer:
+    """Profile of a known customer, looked up by the web app from its API key."""
+
+    name: str = ""
+    # Bookings for VIP customers run on the priority lane
+    vip: bool = False
+    # Loyalty tier, one of USER_TIERS; some tiers are approved automatically
+    tier: str = "standard"
+
+
+@dataclass
+class ApprovalRules:
+    """
+    Rules for deciding manual_ hotel bookings without waiting for a person.
+
+    Reject rules are checked first, then approve rules. Bookings that match
+    neither wait for an approver, and escalate to the second approver tier when
+    the first one does not decide in time. Prices are the hotel supplier's quote
+    and tiers come from the customer directory, never from the booking request.
+    Price rules are skipped for bookings without a quote.
+    """
+
+    auto_approve_max_price: Optional[float] = 200.0
+    auto_reject_min_price: Optional[float] = 2000.0
+    # Hotels that are always approved or always rejected
+    allowed_hotels: list = field(default_factory=list)
+    blocked_hotels: list = field(default_factory=list)
+    # User tiers whose bookings are approved whatever the price
+    auto_approve_tiers: list = field(default_factory=lambda: ["gold", "platinum"])
+    # Time the first approver tier gets before escalating, and the second tier
+    # gets before the booking is rejected
+    escalate_after_seconds: float = 300.0
+    escalation_timeout_seconds: float = 300.0
+
+
+@dataclass
+class ApprovalDecision:
+    # "approve" or "reject"
+    decision: str
+    reason: str
+
+
+@dataclass
+class BookingState:
+    """Saga progress carried over when BookingWorkflow continues as new."""
+
+    results: dict = field(default_factory=dict)
+    # Names of the compensation activities, in the order they were registered
+    compensations: list = field(default_factory=list)
+    hotel_result: Any = None
+    approval_status: Optional[str] = None
+    approval_deadline: Optional[str] = None
+    # Rules the booking was checked against, and the approver tier it waits on
+    approval_rules: Optional[ApprovalRules] = None
+    approval_tier: int = 1
+    # Decision signalled while the run was waiting to continue as new
+    approval_decision: Optional[str] = None
+    continued_runs: int = 0
+
+
+@dataclass
+class TripAmendment:
+    # Leg to change: "car", "hotel" or "flight"
+    leg: str
+    new_id: str
+
+
+@dataclass
+class ReconciliationInput:
+    """Settings for a ReconcileBookingsWorkflow run."""
+
+    # Each run scans bookings that closed in one window, ending settle_seconds
+    # before the run was scheduled so visibility has caught up. Matching the
+    # window to the schedule interval makes consecutive runs cover each booking once.
+    window_seconds: float = 900.0
+    settle_seconds: float = 60.0
+    # Compensations issued in parallel, and the most bookings checked per run
+    batch_size: int = 10
+    max_bookings: int = 200
+
+
+@dataclass
+class OrphanScan:
+    # ISO 8601 close time window, start inclusive and end exclusive
+    closed_after: str
+    closed_before: str
+    max_bookings: int
+
+
+@dataclass
+class OrphanedLeg:
+    """A leg a closed booking may still hold at the supplier."""
+
+    workflow_id: str
+    # "car", "hotel" or "flight"
+    leg: str
+    book_input: BookVacationInput
+
+
+@dataclass
+class OrphanScanResult:
+    orphans: List[OrphanedLeg] = field(default_factory=list)
+    bookings_scanned: int = 0
+    # Bookings in the window beyond max_bookings, left unchecked
+    bookings_skipped: int = 0
+
+
+@dataclass
+class OrphanRetry:
+    """Legs a reconciliation run could not cancel, retried by RetryOrphanedLegsWorkflow."""
+
+    legs: List[OrphanedLeg]
+    # Wait before each round, and the most rounds before the legs are left to an operator
+    retry_interval_seconds: float = 900.0
+    max_rounds: int = 96
+    batch_size: int = 10
+    # Rounds done by earlier runs of the continue-as-new chain
+    rounds: int = 0
 
 
 TASK_QUEUE_NAME = "saga-task-queue"
+# Urgent bookings run on their own queue and worker slots, so a backlog on the
+# standard queue does not delay them
+PRIORITY_TASK_QUEUE_NAME = "saga-priority-task-queue"
+
+PRIORITY_LEVELS = ("standard", "vip")
+USER_TIERS = ("standard", "gold", "platinum")
+# Bookings departing sooner than this are routed to the priority queue
+URGENT_DEPARTURE_WINDOW = timedelta(hours=24)
+
+# Registered workflow type name. Clients start bookings by name so they do not
+# have to import the workflow code.
+BOOKING_WORKFLOW_NAME = "BookingWorkflow"
+RECONCILIATION_WORKFLOW_NAME = "ReconcileBookingsWorkflow"
+RECONCILIATION_RETRY_WORKFLOW_NAME = "RetryOrphanedLegsWorkflow"
+
+# Custom search attributes used to list bookings with visibility queries instead of
+# opening each workflow. The worker registers them on the namespace at startup.
+APPROVAL_PENDING_ATTRIBUTE = SearchAttributeKey.for_bool("ApprovalPending")
+HOTEL_ID_ATTRIBUTE = SearchAttributeKey.for_keyword("HotelId")
+APPROVAL_TIER_ATTRIBUTE = SearchAttributeKey.for_int("ApprovalTier")
+# Set when a booking ended with compensations that did not succeed
+COMPENSATION_FAILED_ATTRIBUTE = SearchAttributeKey.for_bool("CompensationFailed")
+
+
+def departure_time(book_input: BookVacationInput) -> Optional[datetime]:
+    """Return the booking's departure as an aware datetime, assuming UTC if naive."""
+    if not book_input.departure:
+        return None
+    departure = datetime.fromisoformat(book_input.departure)
+    if departure.tzinfo is None:
+        departure = departure.replace(tzinfo=timezone.utc)
+    return departure
+
+
+def booking_task_queue(book_input: BookVacationInput, now: Optional[datetime] = None) -> str:
+    """
+    Choose the task queue for a booking.
+
+    Args:
+        book_input: The booking to route.
+        now: Current time, defaults to the wall clock.
+
+    Returns:
+        str: PRIORITY_TASK_QUEUE_NAME for VIP or near-departure bookings,
+            TASK_QUEUE_NAME otherwise.
+    """
+    if book_input.priority == "vip":
+        return PRIORITY_TASK_QUEUE_NAME
+    departure = departure_time(book_input)
+    now = now or datetime.now(timezone.utc)
+    if departure is not None and departure - now <= URGENT_DEPARTURE_WINDOW:
+        return PRIORITY_TASK_QUEUE_NAME
+    return TASK_QUEUE_NAME
+
+
+# Connection settings shared by the worker, the web app and the scripts
+TEMPORAL_ADDRESS = os.environ.get("TEMPORAL_ADDRESS", "localhost:7233")
+TEMPORAL_NAMESPACE = os.environ.get("TEMPORAL_NAMESPACE", "default")
+# Namespaces bookings are spread over, to scale past one namespace's rate limits.
+# Every namespace needs a worker; run_worker.py polls all of them.
+BOOKING_NAMESPACES = [
+    namespace.strip()
+    for namespace in os.environ.get("TEMPORAL_BOOKING_NAMESPACES", TEMPORAL_NAMESPACE).split(",")
+    if namespace.strip()
+]
+# Set TEMPORAL_TLS=1 for TLS with the system CAs, or give certificate files
+TEMPORAL_TLS = os.environ.get("TEMPORAL_TLS", "0") == "1"
+TEMPORAL_TLS_CA_CERT = os.environ.get("TEMPORAL_TLS_CA_CERT")
+TEMPORAL_TLS_CLIENT_CERT = os.environ.get("TEMPORAL_TLS_CLIENT_CERT")
+TEMPORAL_TLS_CLIENT_KEY = os.environ.get("TEMPORAL_TLS_CLIENT_KEY")
+TEMPORAL_TLS_SERVER_NAME = os.environ.get("TEMPORAL_TLS_SERVER_NAME")
+TEMPORAL_KEEP_ALIVE_SECONDS = float(os.environ.get("TEMPORAL_KEEP_ALIVE_SECONDS", "30"))
+TEMPORAL_KEEP_ALIVE_TIMEOUT_SECONDS = float(os.environ.get("TEMPORAL_KEEP_ALIVE_TIMEOUT_SECONDS", "15"))
+# Default timeout for client calls that do not wait on a workflow; 0 leaves the SDK default
+TEMPORAL_RPC_TIMEOUT_SECONDS = float(os.environ.get("TEMPORAL_RPC_TIMEOUT_SECONDS", "10"))
+
+# Client calls that return promptly. Long polls, such as waiting for a workflow
+# result or an update, must not get the default timeout.
+BOUNDED_CLIENT_CALLS = (
+    "cancel_workflow",
+    "count_workflows",
+    "create_schedule",
+    "describe_workflow",
+    "list_workflows",
+    "query_workflow",
+    "signal_workflow",
+    "start_workflow",
+    "terminate_workflow",
+)
+
+_clients: Dict[str, Client] = {}
+# Held while a client is created, so concurrent first calls share one connection
+_clients_lock = asyncio.Lock()
+
+
+class RpcTimeoutInterceptor(Interceptor):
+    """
+    Client interceptor that applies a default RPC timeout to calls that return promptly.
+
+    Args:
+        timeout: Timeout for calls made without an explicit rpc_timeout.
+    """
+
+    def __init__(self, timeout: timedelta):
+        self._timeout = timeout
+
+    def intercept_client(self, next: OutboundInterceptor) -> OutboundInterceptor:
+        return _RpcTimeoutOutboundInterceptor(next, self._timeout)
+
+
+class _RpcTimeoutOutboundInterceptor(OutboundInterceptor):
+    def __init__(self, next: OutboundInterceptor, timeout: timedelta):
+        super().__init__(next)
+        self._timeout = timeout
+
+    def _with_timeout(self, input):
+        if input.rpc_timeout is None:
+            return dataclasses.replace(input, rpc_timeout=self._timeout)
+        return input
+
+    def fetch_workflow_history_events(self, input):
+        # Waiting for new events is how results are awaited, so leave it unbounded
+        if not input.wait_new_event:
+            input = self._with_timeout(input)
+        return self.next.fetch_workflow_history_events(input)
+
+
+def _bounded_call(name):
+    def call(self, input):
+        return getattr(self.next, name)(self._with_timeout(input))
+
+    call.__name__ = name
+    return call
+
+
+for _name in BOUNDED_CLIENT_CALLS:
+    setattr(_RpcTimeoutOutboundInterceptor, _name, _bounded_call(_name))
+
+
+def _tls_config():
+    if not (TEMPORAL_TLS_CA_CERT or TEMPORAL_TLS_CLIENT_CERT):
+        return TEMPORAL_TLS
+
+    def read(path):
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    return TLSConfig(
+        server_root_ca_cert=read(TEMPORAL_TLS_CA_CERT),
+        domain=TEMPORAL_TLS_SERVER_NAME,
+        client_cert=read(TEMPORAL_TLS_CLIENT_CERT),
+        client_private_key=read(TEMPORAL_TLS_CLIENT_KEY),
+    )
+
+
+async def get_client(namespace: Optional[str] = None, runtime=None) -> Client:
+    """
+    Return this process's Temporal client for a namespace, connecting on first use.
+
+    All namespaces share one connection to TEMPORAL_ADDRESS, so a process never
+    opens more than one however many namespaces it uses.
+
+    Args:
+        namespace: Namespace to use, defaults to TEMPORAL_NAMESPACE.
+        runtime: Runtime for the connection, e.g. with metrics. Only used by the
+            call that connects.
+
+    Returns:
+        Client: The shared client for the namespace.
+    """
+    namespace = namespace or TEMPORAL_NAMESPACE
+    client = _clients.get(namespace)
+    if client is not None:
+        return client
+    async with _clients_lock:
+        if namespace not in _clients:
+            _clients[namespace] = await _create_client(namespace, runtime)
+    return _clients[namespace]
+
+
+async def _create_client(namespace, runtime):
+    interceptors = []
+    if TEMPORAL_RPC_TIMEOUT_SECONDS:
+        interceptors.append(RpcTimeoutInterceptor(timedelta(seconds=TEMPORAL_RPC_TIMEOUT_SECONDS)))
+    if _clients:
+        connected = next(iter(_clients.values()))
+        client = Client(
+            connected.service_client,
+            namespace=namespace,
+            data_converter=connected.data_converter,
+            interceptors=interceptors,
+        )
+    else:
+        client = await Client.connect(
+            TEMPORAL_ADDRESS,
+            namespace=namespace,
+            data_converter=data_converter(),
+            interceptors=interceptors,
+            tls=_tls_config(),
+            keep_alive_config=KeepAliveConfig(
+                interval_millis=int(TEMPORAL_KEEP_ALIVE_SECONDS * 1000),
+                timeout_millis=int(TEMPORAL_KEEP_ALIVE_TIMEOUT_SECONDS * 1000),
+            ),
+            runtime=runtime,
+        )
+    return client
+
+
+def booking_namespace(workflow_id: str) -> str:
+    """Return the namespace a booking lives in, from a stable hash of its workflow ID."""
+    return BOOKING_NAMESPACES[zlib.crc32(workflow_id.encode()) % len(BOOKING_NAMESPACES)]
+
+
+async def booking_clients() -> List[Client]:
+    """Return a client for each of the BOOKING_NAMESPACES."""
+    return [await get_client(namespace) for namespace in BOOKING_NAMESPACES]
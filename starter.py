@@ -3,29 +3,446 @@ Module to run the workflow.
 """
 
 import asyncio
+import base64
+import hashlib
+import threading
+import time
 import uuid
 import os
 import json
+import queue
 import re
+import zlib
+
+from flask import Flask, Response, jsonify, request, render_template, send_from_directory
+from google.protobuf import json_format
+from google.protobuf.message import DecodeError
+from temporalio.api.common.v1 import Payloads
+from temporalio.client import Client, WorkflowUpdateFailedError
+from temporalio.common import SearchAttributePair, TypedSearchAttributes
+from temporalio.service import RPCError, RPCStatusCode
+
+from codec import decode_payload
+from customers import CUSTOMER_KEY_HEADER, load_customers, lookup_customer
+from events import ApprovalWatcher, BackgroundLoop, EventBus, format_sse
+from read_model import BOOKING_STATUSES, BookingStore
+from shared import (
+    APPROVAL_PENDING_ATTRIBUTE,
+    APPROVAL_TIER_ATTRIBUTE,
+    BOOKING_WORKFLOW_NAME,
+    HOTEL_ID_ATTRIBUTE,
+    BookVacationInput,
+    TripAmendment,
+    booking_clients,
+    booking_namespace,
+    booking_task_queue,
+    departure_time,
+)
+
+
+async def describe_running_workflows(temporal_client: Client):
+    """
+    Describe all running workflows and their pending activities.
+
+    Args:
+        temporal_client: Connected Temporal client.
+
+    Returns:
+        list: Workflow details, including approval information where found.
+    """
+    workflows = []
+
+    # Get all running workflows
+    workflow_iterator = temporal_client.list_workflows(
+        query="ExecutionStatus='Running'"
+    )
+
+    async for workflow in workflow_iterator:
+        try:
+            handle = temporal_client.get_workflow_handle(workflow.id)
 
-from flask import Flask, jsonify, request, render_template, send_from_directory
-from temporalio.client import Client
-from temporalio.common import QueryRejectCondition
-from temporalio.service import RPCError
+            # Get basic workflow info
+            workflow_info = {
+                "id": workflow.id,
+                "run_id": workflow.run_id if hasattr(workflow, "run_id") else "unknown",
+                "status": "Running"
+            }
 
-from shared import TASK_QUEUE_NAME, BookVacationInput
-from workflows import BookingWorkflow
+            # Try to get workflow description
+            try:
+                desc = await handle.describe()
+                if hasattr(desc, 'workflow_execution_info'):
+                    info = desc.workflow_execution_info
+                    if hasattr(info, 'type') and hasattr(info.type, 'name'):
+                        workflow_info["type"] = info.type.name
+                    if hasattr(info, 'status'):
+                        workflow_info["status"] = str(info.status)
+                    if hasattr(info, 'start_time'):
+                        workflow_info["start_time"] = str(info.start_time)
+            except Exception as e:
+                workflow_info["describe_error"] = str(e)
 
+            # Try to get workflow history to check for activities
+            try:
+                history = await handle.fetch_history()
+                pending_activities = []
+
+                for event in history.events:
+                    try:
+                        # Check for activity started events that haven't completed
+                        if hasattr(event, 'event_type') and hasattr(event.event_type, 'name') and event.event_type.name == 'EVENT_TYPE_ACTIVITY_TASK_SCHEDULED':
+                            if hasattr(event, 'activity_task_scheduled_event_attributes'):
+                                attrs = event.activity_task_scheduled_event_attributes
+                                activity_id = attrs.activity_id if hasattr(attrs, 'activity_id') else "unknown"
+
+                                # Check if activity_type is an object with a name attribute
+                                activity_type = "unknown"
+                                if hasattr(attrs, 'activity_type'):
+                                    if hasattr(attrs.activity_type, 'name'):
+                                        activity_type = attrs.activity_type.name
+                                    else:
+                                        activity_type = str(attrs.activity_type)
+
+                                # Check if this activity has a completion event
+                                is_completed = False
+                                for completion_event in history.events:
+                                    try:
+                                        if (hasattr(completion_event, 'event_type') and
+                                            hasattr(completion_event.event_type, 'name') and
+                                            completion_event.event_type.name in ['EVENT_TYPE_ACTIVITY_TASK_COMPLETED',
+                                                                              'EVENT_TYPE_ACTIVITY_TASK_FAILED',
+                                                                              'EVENT_TYPE_ACTIVITY_TASK_CANCELED']):
+
+                                            # Check if this completion event is for our activity
+                                            if (hasattr(completion_event, 'activity_task_completed_event_attributes') and
+                                                hasattr(completion_event.activity_task_completed_event_attributes, 'scheduled_event_id') and
+                                                completion_event.activity_task_completed_event_attributes.scheduled_event_id == event.event_id):
+                                                is_completed = True
+                                                break
+                                    except Exception as e:
+                                        print(f"Error checking completion event: {str(e)}")
+                                        continue
+
+                                if not is_completed:
+                                    pending_activities.append({
+                                        "id": activity_id,
+                                        "type": activity_type
+                                    })
+                    except Exception as e:
+                        print(f"Error processing event: {str(e)}")
+                        continue
+
+                workflow_info["pending_activities"] = pending_activities
+
+                # Check if this workflow has a wait_for_human_approval activity
+                for activity in pending_activities:
+                    if "wait_for_human_approval" in activity["type"]:
+                        workflow_info["needs_approval"] = True
+
+                        # Try to extract hotel ID from history
+                        hotel_id = None
+                        for event in history.events:
+                            try:
+                                event_str = str(event)
+                                if "manual_" in event_str:
+                                    match = re.search(r'manual_\w+', event_str)
+                                    if match:
+                                        hotel_id = match.group(0)
+                                        break
+                            except Exception as e:
+                                print(f"Error extracting hotel ID: {str(e)}")
+                                continue
+
+                        if hotel_id:
+                            workflow_info["hotel_id"] = hotel_id
+
+                        break
+            except Exception as e:
+                workflow_info["history_error"] = str(e)
+
+            workflows.append(workflow_info)
+        except Exception as e:
+            workflows.append({
+                "id": workflow.id if hasattr(workflow, "id") else "unknown",
+                "error": str(e)
+            })
+
+    return workflows
+
+
+# Visibility query for bookings waiting on a human. ApprovalPending is upserted by
+# BookingWorkflow, so the server does the filtering and no history is fetched.
+PENDING_APPROVALS_QUERY = (
+    f"WorkflowType='{BOOKING_WORKFLOW_NAME}' AND ExecutionStatus='Running' "
+    f"AND {APPROVAL_PENDING_ATTRIBUTE.name}=true"
+)
+
+
+def encode_page_token(token):
+    """Encode a visibility page token for use in JSON and query strings."""
+    return base64.urlsafe_b64encode(token).decode() if token else None
+
+
+def decode_page_token(token):
+    """Decode a page token produced by encode_page_token."""
+    return base64.urlsafe_b64decode(token.encode()) if token else None
+
+
+async def scan_pending_approvals(temporal_client: Client, page_size=100, next_page_token=None):
+    """
+    List one page of hotel bookings waiting on human approval.
+
+    Args:
+        temporal_client: Connected Temporal client.
+        page_size: Maximum number of approvals to return.
+        next_page_token: Encoded token from a previous page, or None for the first page.
+
+    Returns:
+        dict: Pending approvals and the token for the next page (None on the last page).
+    """
+    print("Fetching pending approvals...")
+
+    workflow_iterator = temporal_client.list_workflows(
+        query=PENDING_APPROVALS_QUERY,
+        page_size=page_size,
+        next_page_token=decode_page_token(next_page_token),
+    )
+    await workflow_iterator.fetch_next_page()
+
+    pending_approvals = []
+    for workflow in workflow_iterator.current_page:
+        booking_details = {
+            "workflow_id": workflow.id,
+            "status": "waiting_for_approval",
+            "workflow_type": workflow.workflow_type,
+            "start_time": str(workflow.start_time),
+        }
 
-def create_app(temporal_client: Client):
+        hotel_id = workflow.typed_search_attributes.get(HOTEL_ID_ATTRIBUTE)
+        if hotel_id:
+            booking_details["hotel_id"] = hotel_id
+        # Set to 2 once the first approver tier has not decided in time
+        booking_details["approval_tier"] = workflow.typed_search_attributes.get(APPROVAL_TIER_ATTRIBUTE) or 1
+
+        pending_approvals.append({
+            "workflow_id": workflow.id,
+            "details": booking_details,
+            "started_at": str(workflow.start_time),
+        })
+
+    print(f"Found {len(pending_approvals)} pending approvals")
+    return {
+        "pending_approvals": pending_approvals,
+        "next_page_token": encode_page_token(workflow_iterator.next_page_token),
+    }
+
+
+async def scan_booking_namespaces(temporal_clients, page_size=100, page_token=None):
+    """
+    List one page of pending approvals across the booking namespaces.
+
+    Namespaces are listed one after the other. The page token is the index of the
+    namespace and that namespace's own token, joined by a dot.
+
+    Args:
+        temporal_clients: One client per booking namespace.
+        page_size: Maximum number of approvals to return.
+        page_token: Token from a previous page, or None for the first page.
+
+    Returns:
+        dict: Pending approvals and the token for the next page (None on the last page).
+    """
+    index, _, token = (page_token or "0.").partition(".")
+    index = int(index)
+    while True:
+        page = await scan_pending_approvals(temporal_clients[index], page_size, token or None)
+        if page["next_page_token"]:
+            page["next_page_token"] = f"{index}.{page['next_page_token']}"
+            return page
+        index += 1
+        token = None
+        if index == len(temporal_clients):
+            return page
+        # An empty namespace does not end the listing
+        if page["pending_approvals"]:
+            page["next_page_token"] = f"{index}."
+            return page
+
+
+async def count_pending_approvals(temporal_client: Client):
+    """
+    Count hotel bookings waiting on human approval.
+
+    Args:
+        temporal_client: Connected Temporal client.
+
+    Returns:
+        int: Number of pending approvals.
+    """
+    result = await temporal_client.count_workflows(PENDING_APPROVALS_QUERY)
+    return result.count
+
+
+class ResponseCache:
+    """
+    Short-TTL cache for read endpoints with singleflight request coalescing.
+
+    Concurrent requests for the same key share one computation, which runs on the
+    background loop, so many reviewers refreshing at once cause a single scan.
+    """
+
+    def __init__(self, background, ttl_seconds=3.0):
+        self._background = background
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+        self._generation = 0
+
+    async def get(self, key, compute):
+        """
+        Get a cached value, computing it if missing or expired.
+
+        Args:
+            key: Cache key.
+            compute: Coroutine function producing a JSON serialisable value.
+
+        Returns:
+            tuple: The value and its ETag.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] > time.monotonic():
+                return entry["value"], entry["etag"]
+
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._background.submit(self._fill(key, compute, self._generation))
+                self._inflight[key] = future
+
+        return await asyncio.wrap_future(future)
+
+    def invalidate(self):
+        """Drop all entries, e.g. after the app changed workflow state."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._inflight.clear()
+
+    async def _fill(self, key, compute, generation):
+        try:
+            value = await compute()
+            body = json.dumps(value, sort_keys=True, default=str)
+            etag = hashlib.sha1(body.encode()).hexdigest()
+            with self._lock:
+                # Results started before an invalidation are returned but not stored
+                if generation == self._generation:
+                    self._entries[key] = {
+                        "value": value,
+                        "etag": etag,
+                        "expires_at": time.monotonic() + self._ttl_seconds,
+                    }
+            return value, etag
+        finally:
+            with self._lock:
+                if generation == self._generation:
+                    self._inflight.pop(key, None)
+
+
+def cached_json_response(payload, etag):
+    """Build a JSON response with an ETag, answering 304 when the client is current."""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    # Let browsers keep the body but always revalidate it
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+# Origin of the Temporal UI allowed to call the /codec endpoints
+CODEC_CORS_ORIGIN = os.environ.get("CODEC_CORS_ORIGIN", "http://localhost:8233")
+# Start bookings with their short car, flight and compensation calls as local activities
+BOOKING_LOCAL_ACTIVITIES = os.environ.get("BOOKING_LOCAL_ACTIVITIES", "0") == "1"
+
+
+def create_app(temporal_clients):
+    """
+    Create the web app.
+
+    Args:
+        temporal_clients: One client per booking namespace, in BOOKING_NAMESPACES order.
+    """
     app = Flask(__name__)
+    clients_by_namespace = {client.namespace: client for client in temporal_clients}
+
+    def booking_client(workflow_id):
+        """Return the client for the namespace a booking lives in."""
+        return clients_by_namespace[booking_namespace(workflow_id)]
 
     # Create static folder if it doesn't exist
     os.makedirs(os.path.join(os.path.dirname(__file__), 'static'), exist_ok=True)
 
+    # Status changes are pushed to browsers over /events. A single watcher feeds the
+    # bus, so the load on Temporal does not grow with the number of open tabs.
+    event_bus = EventBus()
+    background = BackgroundLoop()
+    response_cache = ResponseCache(background)
+    # Read-model written by the worker; listings read it instead of Temporal
+    booking_store = BookingStore()
+    customers = load_customers()
+
+    async def cached_pending_approvals(page_size=100, page_token=None):
+        """Pending approvals shared between the watcher and the read endpoint."""
+        return await response_cache.get(
+            ("pending-approvals", page_size, page_token),
+            lambda: scan_booking_namespaces(temporal_clients, page_size, page_token),
+        )
+
+    async def watched_pending_approvals():
+        # The watcher diffs the first page of each namespace; one page holds up to 1000 approvals
+        pages = await asyncio.gather(*(
+            response_cache.get(
+                ("watched-approvals", client.namespace),
+                lambda client=client: scan_pending_approvals(client, page_size=1000),
+            )
+            for client in temporal_clients
+        ))
+        return [approval for page, _ in pages for approval in page["pending_approvals"]]
+
+    approval_watcher = ApprovalWatcher(watched_pending_approvals, event_bus)
+    background.submit(approval_watcher.run())
+
+    def booking_search_attributes(hotel):
+        """Search attributes set when a booking workflow is started."""
+        return TypedSearchAttributes([
+            SearchAttributePair(HOTEL_ID_ATTRIBUTE, hotel),
+            SearchAttributePair(APPROVAL_PENDING_ATTRIBUTE, False),
+        ])
+
     def generate_unique_username(name):
         return f'{name.replace(" ", "-").lower()}-{str(uuid.uuid4().int)[:6]}'
 
+    async def publish_booking_result(workflow_id):
+        """Wait for a booking workflow to finish and publish its result."""
+        try:
+            result = await booking_client(workflow_id).get_workflow_handle(workflow_id).result()
+            status = result.get("status", "completed") if isinstance(result, dict) else "completed"
+            event_bus.publish("booking_completed", {
+                "workflow_id": workflow_id,
+                "user_id": workflow_id,
+                "result": result,
+                "status": status,
+            })
+        except Exception as e:
+            print(f"Error waiting for booking {workflow_id}: {str(e)}")
+            event_bus.publish("booking_completed", {
+                "workflow_id": workflow_id,
+                "user_id": workflow_id,
+                "status": "error",
+                "error": str(e),
+            })
+        response_cache.invalidate()
+        approval_watcher.refresh()
+
     @app.route('/')
     def index():
         """Serve the booking form page."""
@@ -44,11 +461,18 @@ def create_app(temporal_client: Client):
         Returns:
             Response: JSON response with booking details or error message.
         """
+        customer = lookup_customer(customers, request.headers.get(CUSTOMER_KEY_HEADER))
+        if customer is None:
+            return jsonify({"error": f"Unknown {CUSTOMER_KEY_HEADER}"}), 401
+
         user_id = generate_unique_username(request.json.get("name"))
         attempts = request.json.get("attempts")
         car = request.json.get("car")
         hotel = request.json.get("hotel")
         flight = request.json.get("flight")
+        # Only known VIP customers get the priority lane, whatever the request says
+        priority = "vip" if customer.vip else "standard"
+        departure = request.json.get("departure") or None
 
         input_data = BookVacationInput(
             attempts=int(attempts),
@@ -56,43 +480,65 @@ def create_app(temporal_client: Client):
             book_car_id=car,
             book_hotel_id=hotel,
             book_flight_id=flight,
+            priority=priority,
+            departure=departure,
+            # The approval rules trust the tier, so it comes from the directory too
+            user_tier=customer.tier,
+            local_activities=BOOKING_LOCAL_ACTIVITIES,
         )
-
-        result = await temporal_client.execute_workflow(
-            BookingWorkflow.run,
+        try:
+            if departure:
+                # Normalise to UTC so the workflow and the routing agree on the deadline
+                input_data.departure = departure_time(input_data).isoformat()
+        except ValueError:
+            return jsonify({"error": f"Invalid departure time {departure!r}, expected ISO 8601"}), 400
+        # VIP and near-departure bookings go to the priority lane
+        task_queue = booking_task_queue(input_data)
+
+        # Non-blocking mode: start the workflow and push the result over /events
+        if request.json.get("wait", True) is False:
+            await booking_client(user_id).start_workflow(
+                BOOKING_WORKFLOW_NAME,
+                input_data,
+                id=user_id,
+                task_queue=task_queue,
+                search_attributes=booking_search_attributes(hotel),
+            )
+            response_cache.invalidate()
+            # Whether the booking waits for an approver is only known once the approval
+            # rules have run; /events reports approval_added or booking_completed
+            event_bus.publish("booking_started", {
+                "workflow_id": user_id,
+                "user_id": user_id,
+                "hotel_id": hotel,
+            })
+            background.submit(publish_booking_result(user_id))
+            return jsonify({
+                "user_id": user_id,
+                "workflow_id": user_id,
+                "status": "started",
+                "hotel_id": hotel,
+                "task_queue": task_queue,
+            }), 202
+
+        handle = await booking_client(user_id).start_workflow(
+            BOOKING_WORKFLOW_NAME,
             input_data,
             id=user_id,
-            task_queue=TASK_QUEUE_NAME,
+            task_queue=task_queue,
+            search_attributes=booking_search_attributes(hotel),
         )
+        response_cache.invalidate()
+        result = await handle.result()
+        response_cache.invalidate()
 
-        # Determine the booking status based on the result
+        # The workflow has finished, so any approval was already decided by the
+        # rules or an approver; the status comes from the result alone
         status = "completed"
+        if isinstance(result, dict) and result.get("status") == "failure":
+            status = "failed"
 
-        # Check if this is a manual booking that needs approval
-        needs_approval = False
-
-        # Case 1: Check if result is a dictionary with a message containing manual_approval_needed
-        if isinstance(result, dict):
-            if "message" in result and isinstance(result["message"], dict):
-                if "booked_hotel" in result["message"] and "manual_approval_needed" in str(result["message"]["booked_hotel"]):
-                    status = "waiting_for_approval"
-                    needs_approval = True
-            # Case 2: Direct booked_hotel property
-            elif "booked_hotel" in result and "manual_approval_needed" in str(result["booked_hotel"]):
-                status = "waiting_for_approval"
-                needs_approval = True
-
-        # Case 3: Check if hotel ID starts with "manual"
-        if hotel.startswith("manual"):
-            status = "waiting_for_approval"
-            needs_approval = True
-
-        # Case 4: Check if result is a string containing manual_approval_needed
-        if isinstance(result, str) and "manual_approval_needed" in result:
-            status = "waiting_for_approval"
-            needs_approval = True
-
-        # Case 5: Check if result is "Voyage cancelled"
+        # Check if result is "Voyage cancelled"
         if result == "Voyage cancelled":
             status = "cancelled"
 
@@ -101,310 +547,250 @@ def create_app(temporal_client: Client):
             "user_id": user_id,
             "result": result,
             "status": status,
-            "workflow_id": user_id  # Use the user_id as the workflow_id since that's what we use when creating the workflow
+            "workflow_id": user_id,  # Use the user_id as the workflow_id since that's what we use when creating the workflow
+            "task_queue": task_queue,
         }
 
-        if needs_approval:
-            response["needs_approval"] = True
-            response["hotel_id"] = hotel
-
         if status == "cancelled":
             response["cancelled"] = True
 
         return jsonify(response)
 
-    @app.route("/debug-workflows", methods=["GET"])
-    async def debug_workflows():
-        """
-        Simple debug endpoint to list all running workflows.
+    @app.route("/amend-booking", methods=["POST"])
+    async def amend_booking():
         """
-        workflows = []
+        Change one leg of a running booking without restarting the saga.
 
-        # Get all running workflows
-        workflow_iterator = temporal_client.list_workflows(
-            query="ExecutionStatus='Running'"
-        )
+        Only the changed leg is rebooked and only its old booking is cancelled.
 
-        async for workflow in workflow_iterator:
-            try:
-                handle = temporal_client.get_workflow_handle(workflow.id)
-
-                # Get basic workflow info
-                workflow_info = {
-                    "id": workflow.id,
-                    "run_id": workflow.run_id if hasattr(workflow, "run_id") else "unknown",
-                    "status": "Running"
-                }
-
-                # Try to get workflow description
-                try:
-                    desc = await handle.describe()
-                    if hasattr(desc, 'workflow_execution_info'):
-                        info = desc.workflow_execution_info
-                        if hasattr(info, 'type') and hasattr(info.type, 'name'):
-                            workflow_info["type"] = info.type.name
-                        if hasattr(info, 'status'):
-                            workflow_info["status"] = str(info.status)
-                        if hasattr(info, 'start_time'):
-                            workflow_info["start_time"] = str(info.start_time)
-                except Exception as e:
-                    workflow_info["describe_error"] = str(e)
-
-                # Try to get workflow history to check for activities
-                try:
-                    history = await handle.fetch_history()
-                    pending_activities = []
-
-                    for event in history.events:
-                        try:
-                            # Check for activity started events that haven't completed
-                            if hasattr(event, 'event_type') and hasattr(event.event_type, 'name') and event.event_type.name == 'EVENT_TYPE_ACTIVITY_TASK_SCHEDULED':
-                                if hasattr(event, 'activity_task_scheduled_event_attributes'):
-                                    attrs = event.activity_task_scheduled_event_attributes
-                                    activity_id = attrs.activity_id if hasattr(attrs, 'activity_id') else "unknown"
-
-                                    # Check if activity_type is an object with a name attribute
-                                    activity_type = "unknown"
-                                    if hasattr(attrs, 'activity_type'):
-                                        if hasattr(attrs.activity_type, 'name'):
-                                            activity_type = attrs.activity_type.name
-                                        else:
-                                            activity_type = str(attrs.activity_type)
-
-                                    # Check if this activity has a completion event
-                                    is_completed = False
-                                    for completion_event in history.events:
-                                        try:
-                                            if (hasattr(completion_event, 'event_type') and
-                                                hasattr(completion_event.event_type, 'name') and
-                                                completion_event.event_type.name in ['EVENT_TYPE_ACTIVITY_TASK_COMPLETED',
-                                                                                  'EVENT_TYPE_ACTIVITY_TASK_FAILED',
-                                                                                  'EVENT_TYPE_ACTIVITY_TASK_CANCELED']):
-
-                                                # Check if this completion event is for our activity
-                                                if (hasattr(completion_event, 'activity_task_completed_event_attributes') and
-                                                    hasattr(completion_event.activity_task_completed_event_attributes, 'scheduled_event_id') and
-                                                    completion_event.activity_task_completed_event_attributes.scheduled_event_id == event.event_id):
-                                                    is_completed = True
-                                                    break
-                                        except Exception as e:
-                                            print(f"Error checking completion event: {str(e)}")
-                                            continue
-
-                                    if not is_completed:
-                                        pending_activities.append({
-                                            "id": activity_id,
-                                            "type": activity_type
-                                        })
-                        except Exception as e:
-                            print(f"Error processing event: {str(e)}")
-                            continue
-
-                    workflow_info["pending_activities"] = pending_activities
-
-                    # Check if this workflow has a wait_for_human_approval activity
-                    for activity in pending_activities:
-                        if "wait_for_human_approval" in activity["type"]:
-                            workflow_info["needs_approval"] = True
-
-                            # Try to extract hotel ID from history
-                            hotel_id = None
-                            for event in history.events:
-                                try:
-                                    event_str = str(event)
-                                    if "manual_" in event_str:
-                                        match = re.search(r'manual_\w+', event_str)
-                                        if match:
-                                            hotel_id = match.group(0)
-                                            break
-                                except Exception as e:
-                                    print(f"Error extracting hotel ID: {str(e)}")
-                                    continue
-
-                            if hotel_id:
-                                workflow_info["hotel_id"] = hotel_id
-
-                            break
-                except Exception as e:
-                    workflow_info["history_error"] = str(e)
-
-                workflows.append(workflow_info)
-            except Exception as e:
-                workflows.append({
-                    "id": workflow.id if hasattr(workflow, "id") else "unknown",
-                    "error": str(e)
-                })
+        Returns:
+            Response: JSON response with the amendment result or error message.
+        """
+        data = request.json
+        workflow_id = data.get("workflow_id")
+        leg = data.get("leg")
+        new_id = data.get("new_id")
 
-        return jsonify({"workflows": workflows})
+        if not workflow_id or not leg or not new_id:
+            return jsonify({"error": "Missing workflow_id, leg or new_id"}), 400
 
-    @app.route("/pending-approvals", methods=["GET"])
-    async def get_pending_approvals():
+        print(f"Amending {leg} of booking {workflow_id} to {new_id}")
+        handle = booking_client(workflow_id).get_workflow_handle(workflow_id)
+        try:
+            result = await handle.execute_update("amendBooking", TripAmendment(leg=leg, new_id=new_id))
+        except WorkflowUpdateFailedError as e:
+            message = str(e.cause) if e.cause else str(e)
+            print(f"Amendment rejected for {workflow_id}: {message}")
+            return jsonify({"error": message}), 409
+        except RPCError as e:
+            print(f"Error amending booking {workflow_id}: {str(e)}")
+            return jsonify({"error": e.message}), 404 if e.status == RPCStatusCode.NOT_FOUND else 500
+
+        response_cache.invalidate()
+        event_bus.publish("booking_amended", {"workflow_id": workflow_id, **result})
+        return jsonify({"success": True, "workflow_id": workflow_id, "amendment": result})
+
+    @app.route("/events", methods=["GET"])
+    def stream_events():
         """
-        Get a list of pending hotel booking approvals.
+        Stream booking and approval status changes as server-sent events.
 
-        Returns:
-            Response: JSON response with pending approvals.
+        Query parameters:
+            workflow_id: Only stream events for this workflow (optional).
         """
-        print("Fetching pending approvals...")
+        workflow_id = request.args.get("workflow_id")
+        subscriber = event_bus.subscribe()
+        approval_watcher.refresh()
 
-        # Get all running workflows with a limit to avoid processing too many
-        workflow_iterator = temporal_client.list_workflows(
-            query="ExecutionStatus='Running'",
-            page_size=50  # Limit the number of workflows to process
+        def generate():
+            try:
+                # Replay the latest event so a client that subscribes late does not miss it
+                if workflow_id:
+                    last = event_bus.last_event(workflow_id)
+                    if last:
+                        yield format_sse(last)
+
+                while True:
+                    try:
+                        event = subscriber.get(timeout=15)
+                    except queue.Empty:
+                        # Comment line keeps proxies from closing an idle connection
+                        yield ": keep-alive\n\n"
+                        continue
+
+                    if workflow_id and event["data"].get("workflow_id") != workflow_id:
+                        continue
+                    yield format_sse(event)
+            finally:
+                event_bus.unsubscribe(subscriber)
+
+        return Response(
+            generate(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
 
-        pending_approvals = []
-        workflow_count = 0
-        max_workflows = 100  # Set a maximum number of workflows to process
+    @app.route("/debug-workflows", methods=["GET"])
+    async def debug_workflows():
+        """
+        Simple debug endpoint to list all running workflows.
+        """
+        async def describe_all():
+            described = await asyncio.gather(*(describe_running_workflows(client) for client in temporal_clients))
+            return [workflow for workflows in described for workflow in workflows]
 
-        # Process workflows in batches
-        async for workflow in workflow_iterator:
-            workflow_count += 1
-            if workflow_count > max_workflows:
-                break  # Stop processing after reaching the maximum
+        workflows, etag = await response_cache.get("debug-workflows", describe_all)
+        return cached_json_response({"workflows": workflows}, etag)
 
-            print(f"Checking workflow: {workflow.id}")
+    @app.route("/pending-approvals", methods=["GET"])
+    async def get_pending_approvals():
+        """
+        Get a page of pending hotel booking approvals.
 
-            try:
-                # Get the workflow handle
-                handle = temporal_client.get_workflow_handle(workflow.id)
-
-                # First check if this workflow has a wait_for_human_approval activity
-                # by examining the pending activities
-                try:
-                    desc = await handle.describe()
-                    history = await handle.fetch_history()
-
-                    # Look for wait_for_human_approval activity in the history
-                    needs_approval = False
-                    hotel_id = None
-
-                    # Method 1: Check for pending activities
-                    for event in history.events:
-                        try:
-                            event_str = str(event)
-
-                            # Look for wait_for_human_approval activity
-                            if "wait_for_human_approval" in event_str:
-                                needs_approval = True
-                                print(f"Found wait_for_human_approval in workflow {workflow.id}")
-                                break
-
-                            # Look for manual booking indicators
-                            if "manual_approval_needed" in event_str or "manual_" in event_str or "waiting_for_approval" in event_str:
-                                needs_approval = True
-                                print(f"Found manual booking indicator in workflow {workflow.id}")
-
-                                # Try to extract hotel ID
-                                match = re.search(r'manual_\w+', event_str)
-                                if match:
-                                    hotel_id = match.group(0)
-                                    print(f"Found hotel ID in history: {hotel_id}")
-                                break
-                        except Exception as e:
-                            print(f"Error examining event: {str(e)}")
-                            continue
-
-                    # Method 2: Check for specific activity types
-                    if not needs_approval:
-                        for event in history.events:
-                            try:
-                                if (hasattr(event, 'event_type') and
-                                    hasattr(event.event_type, 'name') and
-                                    event.event_type.name == 'EVENT_TYPE_ACTIVITY_TASK_SCHEDULED'):
-
-                                    if hasattr(event, 'activity_task_scheduled_event_attributes'):
-                                        attrs = event.activity_task_scheduled_event_attributes
-
-                                        if hasattr(attrs, 'activity_type') and hasattr(attrs.activity_type, 'name'):
-                                            activity_name = attrs.activity_type.name
-                                            if activity_name == 'wait_for_human_approval':
-                                                needs_approval = True
-                                                print(f"Found wait_for_human_approval activity in workflow {workflow.id}")
-                                                break
-                            except Exception as e:
-                                print(f"Error checking activity type: {str(e)}")
-                                continue
+        Query parameters:
+            page_size: Number of approvals per page (default 100, at most 1000).
+            page_token: next_page_token from the previous response.
 
-                    # If we found a workflow that needs approval, add it to pending approvals
-                    if needs_approval:
-                        # Extract booking details
-                        booking_details = {
-                            "workflow_id": workflow.id,
-                            "status": "waiting_for_approval"
-                        }
+        Returns:
+            Response: JSON response with pending approvals and the next page token.
+        """
+        page_size = max(1, min(request.args.get("page_size", 100, type=int), 1000))
+        page_token = request.args.get("page_token")
 
-                        if hotel_id:
-                            booking_details["hotel_id"] = hotel_id
+        try:
+            page, etag = await cached_pending_approvals(page_size, page_token)
+        except (ValueError, IndexError):
+            return jsonify({"error": "Invalid page_token"}), 400
+        except RPCError as e:
+            print(f"Error listing pending approvals: {str(e)}")
+            return jsonify({
+                "error": f"Failed to list pending approvals: {e.message}. "
+                         f"Make sure the {APPROVAL_PENDING_ATTRIBUTE.name} and {HOTEL_ID_ATTRIBUTE.name} "
+                         "search attributes are registered (the worker registers them on startup)."
+            }), 503
+        return cached_json_response(page, etag)
+
+    @app.route("/bookings", methods=["GET"])
+    def list_bookings():
+        """
+        List bookings from the read-model, most recently updated first.
+
+        Query parameters:
+            user_id, status, hotel_id: Optional exact-match filters.
+            limit: Number of bookings per page (default 50, at most 200).
+            cursor: next_cursor from the previous response.
 
-                        # Try to extract more details from the workflow
-                        try:
-                            if hasattr(desc, 'type') and hasattr(desc.type, 'name'):
-                                booking_details["workflow_type"] = desc.type.name
+        Returns:
+            Response: JSON response with bookings and the cursor for the next page.
+        """
+        status = request.args.get("status")
+        if status and status not in BOOKING_STATUSES:
+            return jsonify({"error": f"Unknown status {status!r}, expected one of {', '.join(BOOKING_STATUSES)}"}), 400
+        limit = max(1, min(request.args.get("limit", 50, type=int), 200))
+        try:
+            cursor = request.args.get("cursor")
+            after = json.loads(decode_page_token(cursor)) if cursor else None
+            if after is not None and not (isinstance(after, list) and len(after) == 2):
+                raise ValueError(cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+        bookings = booking_store.list_bookings(
+            user_id=request.args.get("user_id"),
+            status=status,
+            hotel_id=request.args.get("hotel_id"),
+            limit=limit,
+            after=after,
+        )
+        next_cursor = None
+        if len(bookings) == limit:
+            last = bookings[-1]
+            next_cursor = encode_page_token(json.dumps([last["updated_at"], last["workflow_id"]]).encode())
+        return jsonify({"bookings": bookings, "next_cursor": next_cursor})
+
+    @app.route("/codec/<operation>", methods=["POST", "OPTIONS"])
+    async def codec(operation):
+        """
+        Codec server for the Temporal UI and CLI, so compressed payloads stay readable.
 
-                            if hasattr(desc, 'start_time'):
-                                booking_details["start_time"] = str(desc.start_time)
-                        except Exception as e:
-                            print(f"Error extracting workflow details: {str(e)}")
+        Set the UI's codec endpoint to http://<this host>:5050/codec. POST /codec/decode
+        and /codec/encode take and return {"payloads": [...]} in protobuf JSON.
 
-                        print(f"Adding workflow to pending approvals: {workflow.id}")
-                        pending_approvals.append({
-                            "workflow_id": workflow.id,
-                            "details": booking_details,
-                            "started_at": str(desc.start_time) if hasattr(desc, 'start_time') else None,
-                        })
+        Returns:
+            Response: JSON response with the decoded or encoded payloads.
+        """
+        cors_headers = {
+            "Access-Control-Allow-Origin": CODEC_CORS_ORIGIN,
+            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type, X-Namespace",
+            "Access-Control-Allow-Credentials": "true",
+        }
+        if operation not in ("decode", "encode"):
+            return jsonify({"error": f"Unknown codec operation {operation!r}"}), 404, cors_headers
+        if request.method == "OPTIONS":
+            return "", 204, cors_headers
 
-                except Exception as e:
-                    print(f"Error processing workflow history: {str(e)}")
-                    continue
+        try:
+            payloads = json_format.Parse(request.get_data(), Payloads()).payloads
+            if operation == "decode":
+                # Decode whatever was compressed, even if this app does not compress
+                result = [decode_payload(payload) for payload in payloads]
+            elif temporal_clients[0].data_converter.payload_codec is not None:
+                result = await temporal_clients[0].data_converter.payload_codec.encode(payloads)
+            else:
+                result = list(payloads)
+        except (json_format.ParseError, DecodeError, zlib.error, ValueError, RuntimeError) as e:
+            # Corrupt compressed data or an invalid inner payload is the caller's error, not ours
+            return jsonify({"error": f"Failed to {operation} payloads: {str(e)}"}), 400, cors_headers
+
+        return Response(
+            json_format.MessageToJson(Payloads(payloads=result)),
+            mimetype="application/json",
+            headers=cors_headers,
+        )
 
-            except Exception as e:
-                # Skip workflows that have errors
-                print(f"Error processing workflow {workflow.id}: {str(e)}")
-                continue
+    @app.route("/pending-approvals/count", methods=["GET"])
+    async def get_pending_approvals_count():
+        """
+        Count pending hotel booking approvals.
 
-        print(f"Found {workflow_count} running workflows and {len(pending_approvals)} pending approvals")
-        print(f"Pending approvals: {pending_approvals}")
-        return jsonify({"pending_approvals": pending_approvals})
+        Returns:
+            Response: JSON response with the number of pending approvals.
+        """
+        try:
+            async def count_all():
+                return sum(await asyncio.gather(*(count_pending_approvals(client) for client in temporal_clients)))
+
+            count, etag = await response_cache.get("pending-approvals-count", count_all)
+        except RPCError as e:
+            print(f"Error counting pending approvals: {str(e)}")
+            return jsonify({"error": f"Failed to count pending approvals: {e.message}"}), 503
+        return cached_json_response({"count": count}, etag)
+
+    async def send_approval(workflow_id, decision):
+        """Signal an approval decision to a booking and tell watchers it is no longer pending."""
+        await booking_client(workflow_id).get_workflow_handle(workflow_id).signal("approvalSignal", decision)
+        response_cache.invalidate()
+        event_bus.publish("approval_cleared", {"workflow_id": workflow_id, "decision": decision})
+        approval_watcher.forget(workflow_id)
 
     @app.route("/approve-booking", methods=["POST"])
-    def approve_booking():
+    async def approve_booking():
         """Approve or reject a booking."""
-        try:
-            # Get data from request
-            data = request.json
-            workflow_id = data.get('workflow_id')
-            decision = data.get('decision')
+        data = request.json
+        workflow_id = data.get('workflow_id')
+        decision = data.get('decision')
 
-            if not workflow_id or not decision:
-                return jsonify({"error": "Missing workflow_id or decision"}), 400
+        if not workflow_id or not decision:
+            return jsonify({"error": "Missing workflow_id or decision"}), 400
 
-            print(f"Approving booking for workflow {workflow_id} with decision {decision}")
-            
-            # Use the CLI approach that we know works
-            import subprocess
-            import json
-            
-            # Escape the decision for the CLI
-            escaped_decision = json.dumps(decision)
-            
-            # Build the command
-            cmd = f"temporal workflow signal --workflow-id {workflow_id} --name approvalSignal --input {escaped_decision}"
-            print(f"Running CLI command: {cmd}")
-            
-            # Run the command
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print(f"Signal sent successfully via CLI: {result.stdout}")
-                return jsonify({"success": True, "message": f"Booking {decision}d successfully"})
-            else:
-                print(f"Error sending signal via CLI: {result.stderr}")
-                return jsonify({"error": f"Failed to send signal: {result.stderr}"}), 500
-                
-        except Exception as e:
+        print(f"Approving booking for workflow {workflow_id} with decision {decision}")
+        try:
+            await send_approval(workflow_id, decision)
+        except RPCError as e:
             print(f"Error in approve_booking: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            return jsonify({"error": f"Failed to send signal: {e.message}"}), 404 if e.status == RPCStatusCode.NOT_FOUND else 500
+        return jsonify({"success": True, "message": f"Booking {decision}d successfully"})
 
     @app.route("/approval-form", methods=["GET"])
     def approval_form():
@@ -422,17 +808,17 @@ def create_app(temporal_client: Client):
         return jsonify({"status": "ok", "message": "Server is running correctly"})
 
     @app.route("/test-approve/<workflow_id>", methods=["GET"])
-    def test_approve(workflow_id):
+    async def test_approve(workflow_id):
         """Test endpoint to directly approve a booking."""
         try:
             print(f"Test approving booking for workflow {workflow_id}")
             
             # Get the workflow handle directly
-            handle = temporal_client.get_workflow_handle(workflow_id)
+            handle = booking_client(workflow_id).get_workflow_handle(workflow_id)
             
             # Send the signal with the decision as a string
             print(f"Sending signal with decision: approve")
-            handle.signal("approvalSignal", "approve")
+            await handle.signal("approvalSignal", "approve")
             print(f"Signal sent successfully to workflow {workflow_id}")
             
             return jsonify({"success": True, "message": f"Test approval sent successfully"})
@@ -441,38 +827,21 @@ def create_app(temporal_client: Client):
             return jsonify({"error": str(e)}), 500
 
     @app.route("/cli-approve/<workflow_id>", methods=["GET"])
-    def cli_approve(workflow_id):
-        """Test endpoint to directly approve a booking using the CLI."""
+    async def cli_approve(workflow_id):
+        """Test endpoint to approve a booking the way the approval form does."""
+        print(f"CLI approving booking for workflow {workflow_id}")
         try:
-            print(f"CLI approving booking for workflow {workflow_id}")
-            
-            # Use subprocess to run the temporal CLI command
-            import subprocess
-            
-            # Build the command
-            cmd = f"temporal workflow signal --workflow-id {workflow_id} --name approvalSignal --input '\"approve\"'"
-            print(f"Running CLI command: {cmd}")
-            
-            # Run the command
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print(f"Signal sent successfully via CLI: {result.stdout}")
-                return jsonify({"success": True, "message": f"CLI approval sent successfully", "output": result.stdout})
-            else:
-                print(f"Error sending signal via CLI: {result.stderr}")
-                return jsonify({"error": f"Failed to send signal: {result.stderr}"}), 500
-                
-        except Exception as e:
+            await send_approval(workflow_id, "approve")
+        except RPCError as e:
             print(f"Error in cli_approve: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            return jsonify({"error": f"Failed to send signal: {e.message}"}), 404 if e.status == RPCStatusCode.NOT_FOUND else 500
+        return jsonify({"success": True, "message": "CLI approval sent successfully"})
 
     return app
 
 
 async def main():
-    temporal_client = await Client.connect("localhost:7233")
-    app = create_app(temporal_client)
+    app = create_app(await booking_clients())
     app.run(host="0.0.0.0", port=5050, debug=True)
 
 
@@ -55,6 +55,42 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 500);
     });
 
+    // Wait for the booking_completed event of a workflow on the server-sent event stream
+    function waitForBookingCompletion(workflowId) {
+        return new Promise(function(resolve) {
+            const source = new EventSource(`/events?workflow_id=${encodeURIComponent(workflowId)}`);
+            source.addEventListener('booking_completed', function(event) {
+                source.close();
+                resolve(JSON.parse(event.data));
+            });
+            // EventSource reconnects by itself after network errors, and the server
+            // replays the latest event for the workflow on reconnect
+        });
+    }
+
+    // Wait until a booking either waits for an approver or finishes. The approval
+    // rules decide whether a manual hotel needs a human, so the hotel ID cannot tell.
+    function waitForBookingProgress(workflowId) {
+        return new Promise(function(resolve) {
+            const source = new EventSource(`/events?workflow_id=${encodeURIComponent(workflowId)}`);
+            source.addEventListener('approval_added', function(event) {
+                source.close();
+                const approval = JSON.parse(event.data);
+                resolve({
+                    workflow_id: approval.workflow_id,
+                    user_id: approval.workflow_id,
+                    hotel_id: approval.details.hotel_id,
+                    status: 'waiting_for_approval',
+                    needs_approval: true
+                });
+            });
+            source.addEventListener('booking_completed', function(event) {
+                source.close();
+                resolve(JSON.parse(event.data));
+            });
+        });
+    }
+
     // Function to handle approval or rejection
     async function handleApprovalDecision(workflowId, decision) {
         try {
@@ -154,36 +190,35 @@ document.addEventListener('DOMContentLoaded', function() {
             flight: document.getElementById('flight').value
         };
 
+        // Send the departure in UTC; bookings close to departure get a priority lane
+        const departure = document.getElementById('departure').value;
+        if (departure) {
+            formData.departure = new Date(departure).toISOString();
+        }
+
         try {
-            // Check if this is a manual booking based on hotel ID
-            const isManualHotel = formData.hotel.startsWith('manual');
-            
-            // Set a timeout to prevent the UI from being stuck if the request takes too long
-            const timeoutPromise = new Promise((_, reject) => {
-                setTimeout(() => {
-                    reject(new Error('Request timeout - but your booking might still be processing'));
-                }, 10000); // 10 seconds timeout
-            });
-            
-            // Send API request with timeout
-            const fetchPromise = fetch('/book', {
+            // Start the booking without holding the request open; the workflow
+            // result is pushed to us over the /events stream
+            const response = await fetch('/book', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify(formData)
+                body: JSON.stringify({ ...formData, wait: false })
             });
-            
-            // Race between the fetch and the timeout
-            const response = await Promise.race([fetchPromise, timeoutPromise]);
-            
+
             // Parse response
-            const data = await response.json();
+            let data = await response.json();
+
+            // Show the result once the booking finishes or starts waiting for an approver
+            if (response.ok) {
+                data = await waitForBookingProgress(data.workflow_id);
+            }
 
             // Display result
             let resultHTML = '';
 
-            if (response.ok) {
+            if (response.ok && data.status !== 'error') {
                 // Check if this is a manual approval booking
                 // Log the data for debugging
                 console.log("Booking result data:", data);
@@ -231,12 +266,6 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
                 }
                 
-                // Case 3: If the hotel ID itself contains "manual" (fallback)
-                if (formData.hotel && formData.hotel.startsWith('manual')) {
-                    needsManualApproval = true;
-                    hotelId = formData.hotel;
-                }
-                
                 if (needsManualApproval) {
                     resultHTML += `<div class="success manual-approval-banner">
                         <h3>Booking Initiated - Manual Approval Required</h3>
@@ -259,14 +288,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
                 
                 // Format the result object
-                resultHTML += `<div class="result-details">
-                    <h4>Booking Details:</h4>
-                    <pre>${JSON.stringify(data.result, null, 2)}</pre>
-                </div>`;
+                if (data.result !== undefined) {
+                    resultHTML += `<div class="result-details">
+                        <h4>Booking Details:</h4>
+                        <pre>${JSON.stringify(data.result, null, 2)}</pre>
+                    </div>`;
+                }
             } else {
                 resultHTML += `<div class="error">
                     <h3>Booking Failed</h3>
-                    <p>${data.message || 'An error occurred during booking.'}</p>
+                    <p>${data.message || data.error || 'An error occurred during booking.'}</p>
                 </div>`;
             }
 
@@ -275,6 +306,18 @@ document.addEventListener('DOMContentLoaded', function() {
             // Hide form, show result
             bookingForm.parentElement.classList.add('hidden');
             resultCard.classList.remove('hidden');
+
+            // Update the status in place once the approved booking completes
+            if (response.ok && data.needs_approval) {
+                waitForBookingCompletion(data.workflow_id).then(function(completed) {
+                    const statusElement = resultContent.querySelector('.status-waiting');
+                    if (statusElement) {
+                        const succeeded = completed.result && completed.result.status === 'success';
+                        statusElement.textContent = succeeded ? 'Complete' : 'Not Completed';
+                        statusElement.className = succeeded ? 'status-complete' : 'status-waiting';
+                    }
+                });
+            }
             
             // Add event listeners to approval buttons if they exist
             const approveBtn = document.getElementById('approveBtn');
@@ -293,30 +336,13 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         } catch (error) {
             console.error('Error:', error);
-            
-            // Check if this is a timeout for a manual booking
-            if (error.message.includes('timeout') && formData.hotel.startsWith('manual')) {
-                resultHTML = `
-                    <div class="success manual-approval-banner">
-                        <h3>Booking Initiated - Manual Approval Required</h3>
-                        <p><strong>User ID:</strong> ${formData.name}-XXXX (ID being generated)</p>
-                        <p><strong>Status:</strong> <span class="status-waiting">Processing</span></p>
-                    </div>
-                    
-                    <div class="manual-approval-info">
-                        <p>Your booking for hotel <strong>${formData.hotel}</strong> requires manual approval.</p>
-                        <p>The booking is still being processed. Please check the <a href="/approval-form">Pending Approvals</a> page in a few moments.</p>
-                        <p>The server is taking longer than expected to respond, but your booking is likely still being processed.</p>
-                    </div>
-                `;
-            } else {
-                resultHTML = `
-                    <div class="error">
-                        <h3>Error</h3>
-                        <p>An unexpected error occurred: ${error.message}</p>
-                    </div>
-                `;
-            }
+
+            const resultHTML = `
+                <div class="error">
+                    <h3>Error</h3>
+                    <p>An unexpected error occurred: ${error.message}</p>
+                </div>
+            `;
             
             resultContent.innerHTML = resultHTML;
 
@@ -4,7 +4,8 @@ Simple script to test approving a workflow directly.
 """
 
 import sys
-from temporalio.client import Client
+
+from shared import booking_namespace, get_client
 
 async def main():
     # Get the workflow ID from command line
@@ -15,9 +16,9 @@ async def main():
     workflow_id = sys.argv[1]
     print(f"Approving workflow: {workflow_id}")
     
-    # Connect to Temporal server
-    client = await Client.connect("localhost:7233")
-    print("Connected to Temporal server")
+    # Connect to the namespace the booking lives in
+    client = await get_client(booking_namespace(workflow_id))
+    print(f"Connected to Temporal namespace {client.namespace}")
     
     # Get the workflow handle
     handle = client.get_workflow_handle(workflow_id)
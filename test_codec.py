@@ -0,0 +1,60 @@
+"""
+Tests for the payload compression codec.
+
+Run with: uv run pytest test_codec.py
+"""
+
+import pytest
+from temporalio.converter import DataConverter
+
+from codec import PRESET_DICTIONARY, data_converter
+from shared import ApprovalRules, BookingState, BookVacationInput
+
+
+def booking_input(hotel_id):
+    return BookVacationInput(
+        attempts=3,
+        book_user_id="test-user",
+        book_car_id="car-1",
+        book_hotel_id=hotel_id,
+        book_flight_id="flight-1",
+    )
+
+
+def serialized(value):
+    return DataConverter.default.payload_converter.to_payloads([value])[0].data
+
+
+def test_preset_dictionary_matches_the_booking_dataclasses():
+    # The dictionary holds these payloads as they serialize, so a field added to
+    # or removed from the dataclasses must be reflected in it before payloads are stored
+    templates = [
+        BookingState(compensations=["undo_book_car", "undo_book_hotel", "undo_book_flight"]),
+        ApprovalRules(),
+        BookVacationInput(
+            attempts=3,
+            book_user_id="",
+            book_car_id="car-",
+            book_hotel_id="manual_hotel-",
+            book_flight_id="flight-",
+        ),
+    ]
+
+    for template in templates:
+        assert serialized(template) in PRESET_DICTIONARY, type(template).__name__
+
+
+@pytest.mark.asyncio
+async def test_compression_codec_shrinks_large_payloads_only():
+    converter = data_converter("zlib", threshold=128)
+    book_input = booking_input("manual_hotel")
+
+    small, large = await converter.encode(["approve", book_input])
+    assert small.metadata["encoding"] == b"json/plain"
+    assert large.metadata["encoding"] == b"binary/zlib"
+    [uncompressed] = await data_converter("").encode([book_input])
+    assert large.ByteSize() < uncompressed.ByteSize() / 2
+
+    assert await converter.decode([small, large], [str, BookVacationInput]) == ["approve", book_input]
+    # Payloads stored before the codec was enabled still decode
+    assert await converter.decode([uncompressed], [BookVacationInput]) == [book_input]
@@ -0,0 +1,24 @@
+"""
+Tests for the customer directory.
+
+Run with: uv run pytest test_customers.py
+"""
+
+import hashlib
+import json
+
+from customers import load_customers, lookup_customer
+from shared import Customer
+
+
+def test_vip_status_and_tier_come_from_the_customer_directory(tmp_path):
+    path = tmp_path / "customers.json"
+    path.write_text(json.dumps({
+        hashlib.sha256(b"jane-key").hexdigest(): {"name": "Jane Doe", "vip": True, "tier": "gold"},
+    }))
+    customers = load_customers(str(path))
+
+    assert lookup_customer(customers, "jane-key") == Customer(name="Jane Doe", vip=True, tier="gold")
+    # Anonymous bookings are standard, unknown keys are refused
+    assert lookup_customer(customers, None) == Customer()
+    assert lookup_customer(customers, "guessed-key") is None
@@ -0,0 +1,21 @@
+"""
+Tests for the latency recorder behind GET /debug/latency.
+
+Run with: uv run pytest test_interceptors.py
+"""
+
+from interceptors import LatencyRecorder
+
+
+def test_latency_recorder_estimates_percentiles_and_keeps_slow_calls():
+    recorder = LatencyRecorder(slow_threshold_ms=1000)
+    for ms in [3] * 90 + [40] * 9 + [2000]:
+        recorder.record("activity_execution", {"activity_type": "book_car"}, ms)
+        recorder.sample_slow_call(ms, {"name": "book_car"})
+
+    [histogram] = recorder.snapshot()["histograms"]
+    assert histogram["count"] == 100
+    assert histogram["p50_ms"] == 5
+    assert histogram["p95_ms"] == 50
+    assert histogram["max_ms"] == 2000
+    assert recorder.snapshot()["slow_calls"] == [{"duration_ms": 2000, "name": "book_car"}]
@@ -0,0 +1,90 @@
+"""
+Tests for the task queue routing and the Temporal client setup in shared.py.
+
+Run with: uv run pytest test_shared.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from temporalio.client import FetchWorkflowHistoryEventsInput, OutboundInterceptor, SignalWorkflowInput
+
+from shared import (
+    PRIORITY_TASK_QUEUE_NAME,
+    TASK_QUEUE_NAME,
+    BookVacationInput,
+    RpcTimeoutInterceptor,
+    booking_task_queue,
+    get_client,
+)
+
+
+def booking_input(**options):
+    return BookVacationInput(
+        attempts=3,
+        book_user_id="test-user",
+        book_car_id="car-1",
+        book_hotel_id="hotel-1",
+        book_flight_id="flight-1",
+        **options,
+    )
+
+
+def test_urgent_and_vip_bookings_use_the_priority_queue():
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    assert booking_task_queue(booking_input(), now) == TASK_QUEUE_NAME
+    assert booking_task_queue(booking_input(priority="vip"), now) == PRIORITY_TASK_QUEUE_NAME
+    soon = (now + timedelta(hours=3)).isoformat()
+    assert booking_task_queue(booking_input(departure=soon), now) == PRIORITY_TASK_QUEUE_NAME
+    later = (now + timedelta(days=30)).isoformat()
+    assert booking_task_queue(booking_input(departure=later), now) == TASK_QUEUE_NAME
+
+
+@pytest.mark.asyncio
+async def test_rpc_timeout_applies_to_prompt_calls_only():
+    calls = []
+
+    class RecordingOutbound(OutboundInterceptor):
+        async def signal_workflow(self, input):
+            calls.append(input.rpc_timeout)
+
+        def fetch_workflow_history_events(self, input):
+            calls.append(input.rpc_timeout)
+
+    outbound = RpcTimeoutInterceptor(timedelta(seconds=5)).intercept_client(RecordingOutbound(None))
+    await outbound.signal_workflow(SignalWorkflowInput(
+        id="booking", run_id=None, signal="approvalSignal", args=["approve"],
+        headers={}, rpc_metadata={}, rpc_timeout=None,
+    ))
+    await outbound.signal_workflow(SignalWorkflowInput(
+        id="booking", run_id=None, signal="approvalSignal", args=["approve"],
+        headers={}, rpc_metadata={}, rpc_timeout=timedelta(seconds=1),
+    ))
+    # Waiting for a workflow result is a long poll
+    outbound.fetch_workflow_history_events(FetchWorkflowHistoryEventsInput(
+        id="booking", run_id=None, page_size=None, next_page_token=None, wait_new_event=True,
+        event_filter_type=None, skip_archival=False, rpc_metadata={}, rpc_timeout=None,
+    ))
+
+    assert calls == [timedelta(seconds=5), timedelta(seconds=1), None]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_calls_share_one_connection(monkeypatch):
+    connects = []
+
+    async def connect(target, namespace, **kwargs):
+        connects.append(namespace)
+        # Yield so the other first call runs while this one is connecting
+        await asyncio.sleep(0.01)
+        return object()
+
+    monkeypatch.setattr("shared._clients", {})
+    monkeypatch.setattr("shared.Client.connect", connect)
+    first, second = await asyncio.gather(get_client("bookings"), get_client("bookings"))
+
+    assert connects == ["bookings"]
+    assert first is second
+
@@ -0,0 +1,82 @@
+"""
+Tests for the web app's response cache.
+
+Run with: uv run pytest test_starter.py
+"""
+
+import asyncio
+import threading
+
+import pytest
+from flask import Flask
+
+from events import BackgroundLoop
+from starter import ResponseCache, cached_json_response
+
+
+def blocking_compute(computed, release):
+    """Cache fill that records each call and holds until release is set."""
+    async def compute():
+        computed.append(len(computed) + 1)
+        fill = len(computed)
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        return {"fill": fill}
+
+    return compute
+
+
+@pytest.mark.asyncio
+async def test_response_cache_coalesces_concurrent_requests():
+    cache = ResponseCache(BackgroundLoop())
+    computed = []
+    release = threading.Event()
+    compute = blocking_compute(computed, release)
+
+    gets = [asyncio.ensure_future(cache.get("pending-approvals", compute)) for _ in range(20)]
+    await asyncio.sleep(0.1)
+    release.set()
+    results = await asyncio.gather(*gets)
+
+    assert computed == [1]
+    assert {etag for _, etag in results} == {results[0][1]}
+    # Served from the cache until the TTL runs out
+    assert await cache.get("pending-approvals", compute) == results[0]
+    assert computed == [1]
+
+
+@pytest.mark.asyncio
+async def test_response_cache_drops_fills_started_before_invalidation():
+    cache = ResponseCache(BackgroundLoop())
+    computed = []
+    release = threading.Event()
+    compute = blocking_compute(computed, release)
+
+    stale = asyncio.ensure_future(cache.get("pending-approvals", compute))
+    await asyncio.sleep(0.1)
+    cache.invalidate()
+    # A request after the invalidation does not join the fill already running
+    fresh = asyncio.ensure_future(cache.get("pending-approvals", compute))
+    await asyncio.sleep(0.1)
+    release.set()
+
+    assert (await stale)[0] == {"fill": 1}
+    assert (await fresh)[0] == {"fill": 2}
+    # Only the fill started after the invalidation was stored
+    assert (await cache.get("pending-approvals", compute))[0] == {"fill": 2}
+    assert computed == [1, 2]
+
+
+def test_cached_response_answers_not_modified_for_current_etag():
+    app = Flask(__name__)
+
+    with app.test_request_context(headers={"If-None-Match": '"abc"'}):
+        response = cached_json_response({"count": 1}, "abc")
+    assert response.status_code == 304
+
+    with app.test_request_context(headers={"If-None-Match": '"stale"'}):
+        response = cached_json_response({"count": 1}, "abc")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"abc"'
+    assert response.get_json() == {"count": 1}
+
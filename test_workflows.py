@@ -0,0 +1,667 @@
+"""
+Tests for BookingWorkflow using the time-skipping test server.
+
+The activities are replaced by mocks registered under the same names, so the
+approval, rejection, timeout and compensation paths run in seconds instead of
+waiting out the 10 minute approval timeout in real time.
+
+Run with: uv run pytest test_workflows.py
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import timedelta
+
+import pytest
+import pytest_asyncio
+from temporalio import activity
+from temporalio.api.enums.v1 import IndexedValueType
+from temporalio.api.operatorservice.v1 import AddSearchAttributesRequest
+from temporalio.client import WorkflowUpdateFailedError
+from temporalio.exceptions import ApplicationError
+from temporalio.service import RPCError
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import UnsandboxedWorkflowRunner, Worker
+from temporalio.worker.workflow_sandbox import SandboxedWorkflowRunner, SandboxRestrictions
+
+from activities import ReconciliationActivities
+from interceptors import BookingProjectionInterceptor, LatencyInterceptor, LatencyRecorder
+from read_model import BookingProjector, BookingStore
+from shared import (
+    APPROVAL_PENDING_ATTRIBUTE,
+    APPROVAL_TIER_ATTRIBUTE,
+    COMPENSATION_FAILED_ATTRIBUTE,
+    HOTEL_ID_ATTRIBUTE,
+    ApprovalRules,
+    BookVacationInput,
+    OrphanedLeg,
+    OrphanScan,
+    OrphanScanResult,
+    ReconciliationInput,
+    TripAmendment,
+)
+from workflows import PASSTHROUGH_MODULES, BookingWorkflow, ReconcileBookingsWorkflow, RetryOrphanedLegsWorkflow
+
+pytestmark = pytest.mark.asyncio(loop_scope="module")
+
+# Wall-clock budget per test, including the ones that skip the 10 minute timeout
+MAX_TEST_SECONDS = 10
+
+
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def env():
+    async with await WorkflowEnvironment.start_time_skipping() as env:
+        # BookingWorkflow upserts these while a booking waits for approval
+        await env.client.operator_service.add_search_attributes(
+            AddSearchAttributesRequest(
+                namespace=env.client.namespace,
+                search_attributes={
+                    APPROVAL_PENDING_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_BOOL,
+                    HOTEL_ID_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_KEYWORD,
+                    APPROVAL_TIER_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_INT,
+                    COMPENSATION_FAILED_ATTRIBUTE.name: IndexedValueType.INDEXED_VALUE_TYPE_BOOL,
+                },
+            )
+        )
+        yield env
+
+
+class MockActivities:
+    """
+    Mocked booking activities that record the order they were called in.
+
+    Args:
+        flight_error: Exception raised by book_flight, if any.
+        approval_result: Result returned immediately by wait_for_human_approval.
+            When None, the activity heartbeats until it is cancelled.
+        rules: Approval rules returned by get_approval_rules.
+        failing_undo: Name of a compensation that always fails, if any.
+        orphan_scan: Result returned by find_orphaned_bookings.
+        hotel_price: Nightly price quoted by book_hotel, if any.
+    """
+
+    def __init__(
+        self, flight_error=None, approval_result=None, rules=None, failing_undo=None, orphan_scan=None, hotel_price=None
+    ):
+        self.calls = []
+        self.approval_started = asyncio.Event()
+        self.flight_error = flight_error
+        self.approval_result = approval_result
+        self.rules = rules or ApprovalRules()
+        self.failing_undo = failing_undo
+        self.orphan_scan = orphan_scan or OrphanScanResult()
+        self.hotel_price = hotel_price
+        # Set to an asyncio.Event to hold compensations until it is set
+        self.undo_release = None
+        self.undo_started = asyncio.Event()
+
+    def activities(self):
+        @activity.defn(name="book_car")
+        async def book_car(book_input: BookVacationInput) -> str:
+            self.calls.append("book_car")
+            return f"Booked car: {book_input.book_car_id}"
+
+        @activity.defn(name="book_hotel")
+        async def book_hotel(book_input: BookVacationInput) -> dict:
+            self.calls.append("book_hotel")
+            if book_input.book_hotel_id.startswith("manual_"):
+                return {
+                    "booked_hotel": book_input.book_hotel_id,
+                    "status": "waiting_for_approval",
+                    "manual_approval_needed": True,
+                    "price": self.hotel_price,
+                }
+            return {"booked_hotel": book_input.book_hotel_id, "status": "confirmed"}
+
+        @activity.defn(name="book_flight")
+        async def book_flight(book_input: BookVacationInput) -> str:
+            self.calls.append("book_flight")
+            if self.flight_error:
+                raise self.flight_error
+            return f"Booked flight: {book_input.book_flight_id}"
+
+        @activity.defn(name="wait_for_human_approval")
+        async def wait_for_human_approval(book_input: BookVacationInput) -> dict:
+            self.calls.append("wait_for_human_approval")
+            self.approval_started.set()
+            if self.approval_result is not None:
+                return self.approval_result
+            try:
+                while True:
+                    activity.heartbeat()
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                return {"status": "cancelled"}
+
+        @activity.defn(name="complete_hotel_booking")
+        async def complete_hotel_booking(book_input: BookVacationInput) -> dict:
+            self.calls.append("complete_hotel_booking")
+            return {"booked_hotel": book_input.book_hotel_id, "status": "confirmed", "approved": True}
+
+        @activity.defn(name="get_approval_rules")
+        async def get_approval_rules() -> ApprovalRules:
+            return self.rules
+
+        @activity.defn(name="find_orphaned_bookings")
+        async def find_orphaned_bookings(scan: OrphanScan) -> OrphanScanResult:
+            self.calls.append("find_orphaned_bookings")
+            return self.orphan_scan
+
+        def undo(name):
+            @activity.defn(name=name)
+            async def undo_booking(book_input: BookVacationInput) -> str:
+                self.calls.append(name)
+                self.undo_started.set()
+                if self.undo_release is not None:
+                    await self.undo_release.wait()
+                if name == self.failing_undo:
+                    raise ApplicationError("Supplier unavailable", non_retryable=True)
+                return f"Cancelled: {name}"
+
+            return undo_booking
+
+        return [
+            book_car,
+            book_hotel,
+            book_flight,
+            wait_for_human_approval,
+            complete_hotel_booking,
+            get_approval_rules,
+            find_orphaned_bookings,
+            undo("undo_book_car"),
+            undo("undo_book_hotel"),
+            undo("undo_book_flight"),
+        ]
+
+    def compensations(self):
+        return [call for call in self.calls if call.startswith("undo_")]
+
+
+def booking_worker(env, task_queue, mocks, interceptors=(), workflow_runner=None):
+    return Worker(
+        env.client,
+        task_queue=task_queue,
+        workflows=[BookingWorkflow, ReconcileBookingsWorkflow, RetryOrphanedLegsWorkflow],
+        activities=mocks.activities(),
+        workflow_runner=workflow_runner or SandboxedWorkflowRunner(
+            restrictions=SandboxRestrictions.default.with_passthrough_modules(*PASSTHROUGH_MODULES)
+        ),
+        interceptors=interceptors,
+    )
+
+
+def booking_input(hotel_id, **options):
+    return BookVacationInput(
+        attempts=3,
+        book_user_id=f"test-user-{uuid.uuid4()}",
+        book_car_id="car-1",
+        book_hotel_id=hotel_id,
+        book_flight_id="flight-1",
+        **options,
+    )
+
+
+async def start_booking(env, task_queue, book_input):
+    return await env.client.start_workflow(
+        BookingWorkflow.run,
+        book_input,
+        id=book_input.book_user_id,
+        task_queue=task_queue,
+    )
+
+
+async def test_booking_without_approval_succeeds(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("hotel-1"))
+        result = await handle.result()
+
+    assert result["status"] == "success"
+    assert mocks.calls == ["book_car", "book_hotel", "book_flight"]
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_manual_booking_approved(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        # Time only skips while waiting on a result, so the approval timer cannot fire here
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        result = await handle.result()
+
+    assert result["status"] == "success"
+    assert result["message"]["approval_status"] == "approved"
+    assert "complete_hotel_booking" in mocks.calls
+    assert mocks.compensations() == []
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_manual_booking_rejected_runs_compensations(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        await handle.signal(BookingWorkflow.approvalSignal, "reject")
+        result = await handle.result()
+
+    assert result["status"] == "failure"
+    assert "rejected" in result["message"]
+    assert "book_flight" not in mocks.calls
+    assert mocks.compensations() == ["undo_book_hotel", "undo_book_car"]
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_manual_booking_times_out(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(approval_result={"status": "timeout", "message": "Approval timed out"})
+
+    async with booking_worker(env, task_queue, mocks):
+        workflow_started_at = await env.get_current_time()
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        result = await handle.result()
+        workflow_finished_at = await env.get_current_time()
+
+    # Neither approver tier decided, so both 5 minute windows elapsed in skipped time
+    assert workflow_finished_at - workflow_started_at >= timedelta(minutes=10)
+    assert result["status"] == "failure"
+    assert "complete_hotel_booking" not in mocks.calls
+    assert mocks.compensations() == ["undo_book_hotel", "undo_book_car"]
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_flight_failure_runs_compensations_in_reverse(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(flight_error=ApplicationError("No seats left", non_retryable=True))
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("hotel-1"))
+        result = await handle.result()
+
+    assert result["status"] == "failure"
+    assert mocks.compensations() == ["undo_book_flight", "undo_book_hotel", "undo_book_car"]
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_amendment_rebooks_only_the_changed_leg(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+
+        # The car is already booked, so it is rebooked and the old one cancelled
+        car = await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="car", new_id="car-2"))
+        # The flight is not booked yet, so only the ID changes
+        flight = await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="flight", new_id="flight-2"))
+
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        result = await handle.result()
+
+    assert car["status"] == "rebooked"
+    assert flight["status"] == "updated"
+    assert mocks.calls.count("book_car") == 2
+    assert mocks.calls.count("book_flight") == 1
+    assert mocks.compensations() == ["undo_book_car"]
+    assert result["message"]["booked_car"] == "Booked car: car-2"
+    assert result["message"]["booked_flight"] == "Booked flight: flight-2"
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_amendment_keeps_new_leg_when_old_one_cannot_be_cancelled(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(failing_undo="undo_book_car")
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        car = await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="car", new_id="car-2"))
+        description = await handle.describe()
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        result = await handle.result()
+
+    assert car["status"] == "rebooked"
+    assert car["failed_compensation"] == "undo_book_car"
+    # The old car is left for reconciliation, the saga goes on with the new one
+    assert description.typed_search_attributes.get(COMPENSATION_FAILED_ATTRIBUTE) is True
+    assert result["status"] == "success"
+    assert result["message"]["booked_car"] == "Booked car: car-2"
+    # Reconciliation cancels only the car the amendment replaced, not the live legs
+    orphans = await ReconciliationActivities(env.client)._orphaned_legs(handle.id, handle.result_run_id)
+    assert [(orphan.leg, orphan.book_input.book_car_id) for orphan in orphans] == [("car", "car-1")]
+
+
+async def test_invalid_amendment_is_rejected(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+
+        with pytest.raises(WorkflowUpdateFailedError):
+            await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="boat", new_id="boat-1"))
+
+        await handle.signal(BookingWorkflow.approvalSignal, "reject")
+        await handle.result()
+
+
+async def test_saga_continues_as_new_between_legs(env, monkeypatch):
+    # Unsandboxed so the workflow sees the lowered limit: every step continues as new
+    monkeypatch.setattr("workflows.HISTORY_LENGTH_LIMIT", 0)
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+    failing_mocks = MockActivities(flight_error=ApplicationError("No seats left", non_retryable=True))
+
+    async with booking_worker(env, task_queue, mocks, workflow_runner=UnsandboxedWorkflowRunner()):
+        handle = await start_booking(env, task_queue, booking_input("hotel-1"))
+        result = await handle.result()
+        description = await env.client.get_workflow_handle(handle.id).describe()
+    async with booking_worker(env, task_queue, failing_mocks, workflow_runner=UnsandboxedWorkflowRunner()):
+        failing = await start_booking(env, task_queue, booking_input("hotel-1"))
+        failure = await failing.result()
+
+    # The car and hotel runs each continued as new, and no leg was booked twice
+    assert description.run_id != handle.run_id
+    assert mocks.calls == ["book_car", "book_hotel", "book_flight"]
+    assert result["status"] == "success"
+    assert result["message"] == {
+        "booked_car": "Booked car: car-1",
+        "booked_hotel": {"booked_hotel": "hotel-1", "status": "confirmed"},
+        "booked_flight": "Booked flight: flight-1",
+    }
+    # The compensation stack was carried over both continuations
+    assert failure["status"] == "failure"
+    assert failing_mocks.compensations() == ["undo_book_flight", "undo_book_hotel", "undo_book_car"]
+
+
+async def test_approval_wait_continues_as_new_and_refuses_amendments_meanwhile(env, monkeypatch):
+    # A fresh run waits for approval with about 20 events; amendments push it past 40
+    monkeypatch.setattr("workflows.HISTORY_LENGTH_LIMIT", 40)
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks, workflow_runner=UnsandboxedWorkflowRunner()):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        # Without a run ID, calls go to whichever run is current
+        latest = env.client.get_workflow_handle(handle.id)
+
+        amended_flight = "flight-1"
+        for i in range(30):
+            try:
+                # An amendment left behind by continue-as-new would never return
+                await asyncio.wait_for(
+                    latest.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="flight", new_id=f"flight-{i + 2}")),
+                    MAX_TEST_SECONDS,
+                )
+                amended_flight = f"flight-{i + 2}"
+            except (WorkflowUpdateFailedError, RPCError):
+                # Refused while the run was continuing as new
+                pass
+            if (await latest.describe()).run_id != handle.run_id:
+                break
+
+        assert (await latest.describe()).run_id != handle.run_id
+        await latest.signal(BookingWorkflow.approvalSignal, "approve")
+        result = await latest.result()
+
+    assert result["status"] == "success"
+    assert result["message"]["approval_status"] == "approved"
+    assert result["message"]["booked_flight"] == f"Booked flight: {amended_flight}"
+    # The continued run restarted the approval wait but did not rebook anything
+    assert mocks.calls.count("wait_for_human_approval") == 2
+    assert mocks.calls.count("book_car") == 1
+    assert mocks.calls.count("book_hotel") == 1
+    assert mocks.compensations() == []
+
+
+async def test_approval_sent_while_continuing_as_new_is_carried_over(env, monkeypatch):
+    monkeypatch.setattr("workflows.HISTORY_LENGTH_LIMIT", 10_000)
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+    mocks.undo_release = asyncio.Event()
+
+    async with booking_worker(env, task_queue, mocks, workflow_runner=UnsandboxedWorkflowRunner()):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        amendment = asyncio.create_task(
+            handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="flight", new_id="flight-2"))
+        )
+        await asyncio.wait_for(mocks.undo_started.wait(), MAX_TEST_SECONDS)
+
+        # The next activation starts continue-as-new, which waits for the amendment
+        monkeypatch.setattr("workflows.HISTORY_LENGTH_LIMIT", 0)
+        with pytest.raises(WorkflowUpdateFailedError):
+            await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="flight", new_id="flight-3"))
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        mocks.undo_release.set()
+        assert (await amendment)["status"] == "rebooked"
+        result = await env.client.get_workflow_handle(handle.id).result()
+
+    # The continued run uses the decision instead of waiting again and timing out
+    assert result["status"] == "success"
+    assert result["message"]["approval_status"] == "approved"
+    assert result["message"]["booked_flight"] == "Booked flight: flight-2"
+
+
+async def test_approval_wait_ends_at_departure(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        workflow_started_at = await env.get_current_time()
+        departure = workflow_started_at + timedelta(minutes=2)
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel", departure=departure.isoformat()))
+        result = await handle.result()
+        workflow_finished_at = await env.get_current_time()
+
+    # Nobody approved, so the wait stopped at departure instead of after 10 minutes
+    assert workflow_finished_at - workflow_started_at < timedelta(minutes=10)
+    assert result["status"] == "failure"
+    assert mocks.compensations() == ["undo_book_hotel", "undo_book_car"]
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_booking_after_departure_fails_without_booking(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    async with booking_worker(env, task_queue, mocks):
+        departed = (await env.get_current_time()) - timedelta(hours=1)
+        handle = await start_booking(env, task_queue, booking_input("hotel-1", departure=departed.isoformat()))
+        result = await handle.result()
+
+    assert result["status"] == "failure"
+    assert "has passed" in result["message"]
+    assert mocks.calls == []
+
+
+async def test_approval_rules_approve_cheap_bookings_without_waiting(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(hotel_price=120.0)
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        result = await handle.result()
+
+    assert result["status"] == "success"
+    assert "price 120.0" in result["message"]["approval_rule"]
+    assert "wait_for_human_approval" not in mocks.calls
+    assert "complete_hotel_booking" in mocks.calls
+
+
+async def test_approval_rules_reject_blocked_hotels(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(rules=ApprovalRules(blocked_hotels=["manual_hotel"]))
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel", user_tier="platinum"))
+        result = await handle.result()
+
+    assert result["status"] == "failure"
+    assert "approval rules" in result["message"]
+    assert "wait_for_human_approval" not in mocks.calls
+    assert mocks.compensations() == ["undo_book_hotel", "undo_book_car"]
+
+
+async def test_undecided_approval_escalates_to_second_tier(env):
+    started = time.perf_counter()
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(rules=ApprovalRules(escalate_after_seconds=60, escalation_timeout_seconds=600))
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        await env.sleep(timedelta(minutes=2))
+
+        description = await handle.describe()
+        assert description.typed_search_attributes.get(APPROVAL_TIER_ATTRIBUTE) == 2
+
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        result = await handle.result()
+
+    assert result["status"] == "success"
+    assert result["message"]["approval_status"] == "approved"
+    assert time.perf_counter() - started < MAX_TEST_SECONDS
+
+
+async def test_failed_compensation_is_flagged_for_reconciliation(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(
+        flight_error=ApplicationError("No seats left", non_retryable=True),
+        failing_undo="undo_book_hotel",
+    )
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("hotel-1"))
+        result = await handle.result()
+        description = await handle.describe()
+
+    # The other compensations still ran
+    assert mocks.compensations() == ["undo_book_flight", "undo_book_hotel", "undo_book_car"]
+    assert result["failed_compensations"] == ["undo_book_hotel"]
+    assert description.typed_search_attributes.get(COMPENSATION_FAILED_ATTRIBUTE) is True
+
+
+async def test_reconciliation_cancels_orphaned_legs_in_batches(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    orphans = [
+        OrphanedLeg(workflow_id="booking-1", leg="hotel", book_input=booking_input("hotel-1")),
+        OrphanedLeg(workflow_id="booking-2", leg="car", book_input=booking_input("hotel-2")),
+        OrphanedLeg(workflow_id="booking-3", leg="flight", book_input=booking_input("hotel-3")),
+    ]
+    mocks = MockActivities(
+        failing_undo="undo_book_flight",
+        orphan_scan=OrphanScanResult(orphans=orphans, bookings_scanned=3),
+    )
+
+    async with booking_worker(env, task_queue, mocks):
+        result = await env.client.execute_workflow(
+            ReconcileBookingsWorkflow.run,
+            ReconciliationInput(batch_size=2),
+            id=f"reconcile-{uuid.uuid4()}",
+            task_queue=task_queue,
+        )
+        assert sorted(mocks.compensations()) == ["undo_book_car", "undo_book_flight", "undo_book_hotel"]
+
+        # The supplier recovers, and the failed leg is retried after the run ended
+        mocks.failing_undo = None
+        retried = await env.client.get_workflow_handle(result["retry_workflow_id"]).result()
+
+    assert result["bookings_scanned"] == 3
+    assert {leg["workflow_id"] for leg in result["cancelled"]} == {"booking-1", "booking-2"}
+    assert result["failed"] == [{"workflow_id": "booking-3", "leg": "flight"}]
+    assert retried == {"cancelled": [{"workflow_id": "booking-3", "leg": "flight"}], "failed": []}
+    assert mocks.compensations().count("undo_book_flight") == 2
+
+
+async def test_bookings_are_projected_into_the_read_model(env, tmp_path):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+    store = BookingStore(str(tmp_path / "bookings.db"))
+    projector = BookingProjector(store, flush_interval=0.1)
+
+    async with booking_worker(env, task_queue, mocks, [BookingProjectionInterceptor(projector)]):
+        book_input = booking_input("manual_hotel")
+        handle = await start_booking(env, task_queue, book_input)
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="car", new_id="car-2"))
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        await handle.result()
+    projector.close()
+
+    [booking] = store.list_bookings(user_id=book_input.book_user_id)
+    assert booking["status"] == "succeeded"
+    assert booking["hotel_id"] == "manual_hotel"
+    assert booking["car_id"] == "car-2"
+    assert booking["closed_at"] is not None
+
+
+async def test_latency_interceptor_records_activities_and_updates(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+    recorder = LatencyRecorder(slow_threshold_ms=0)
+
+    async with booking_worker(env, task_queue, mocks, [LatencyInterceptor(recorder)]):
+        handle = await start_booking(env, task_queue, booking_input("manual_hotel"))
+        await asyncio.wait_for(mocks.approval_started.wait(), MAX_TEST_SECONDS)
+        await handle.execute_update(BookingWorkflow.amendBooking, TripAmendment(leg="car", new_id="car-2"))
+        await handle.signal(BookingWorkflow.approvalSignal, "approve")
+        await handle.result()
+
+    snapshot = recorder.snapshot()
+    recorded = {(histogram["metric"], histogram["labels"].get("activity_type") or histogram["labels"].get("name"))
+                for histogram in snapshot["histograms"]}
+    assert ("activity_execution", "book_car") in recorded
+    assert ("activity_schedule_to_start", None) in recorded
+    assert ("update", "amendBooking") in recorded
+    assert ("workflow", "BookingWorkflow") in recorded
+    assert {sample["kind"] for sample in snapshot["slow_calls"]} == {"activity", "update", "workflow"}
+
+
+async def test_local_activity_mode_shortens_history(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities()
+
+    event_counts = {}
+    async with booking_worker(env, task_queue, mocks):
+        for local_activities in (False, True):
+            handle = await start_booking(env, task_queue, booking_input("hotel-1", local_activities=local_activities))
+            assert (await handle.result())["status"] == "success"
+            event_counts[local_activities] = len((await handle.fetch_history()).events)
+
+    assert mocks.calls.count("book_car") == 2
+    assert event_counts[True] < event_counts[False]
+
+
+async def test_reconciliation_finds_legs_left_by_local_activities(env):
+    task_queue = f"tq-{uuid.uuid4()}"
+    mocks = MockActivities(
+        flight_error=ApplicationError("No seats left", non_retryable=True),
+        failing_undo="undo_book_car",
+    )
+
+    async with booking_worker(env, task_queue, mocks):
+        handle = await start_booking(env, task_queue, booking_input("hotel-1", local_activities=True))
+        result = await handle.result()
+
+    assert mocks.compensations() == ["undo_book_flight", "undo_book_hotel", "undo_book_car"]
+    assert result["failed_compensations"] == ["undo_book_car"]
+    orphans = await ReconciliationActivities(env.client)._orphaned_legs(handle.id, handle.result_run_id)
+    assert [(orphan.leg, orphan.book_input.book_car_id) for orphan in orphans] == [("car", "car-1")]
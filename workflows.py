@@ -3,27 +3,96 @@ Module for defining saga workflows.
 """
 
 # @@@SNIPSTART saga-py-workflows-import
-from datetime import timedelta
+from datetime import datetime, timedelta
+from typing import Optional
 import asyncio
+import dataclasses
 
 from temporalio import workflow
-from temporalio.common import RetryPolicy
+from temporalio.common import RetryPolicy, SearchAttributeKey
+from temporalio.workflow import ParentClosePolicy
+from temporalio.exceptions import ActivityError, ApplicationError
 
 with workflow.unsafe.imports_passed_through():
     from activities import (
         BookVacationInput,
+        ReconciliationActivities,
         book_car,
         book_flight,
         book_hotel,
         complete_hotel_booking,
+        get_approval_rules,
+        local_activity_id,
         undo_book_car,
         undo_book_flight,
         undo_book_hotel,
         wait_for_human_approval,
     )
+    from approval_rules import evaluate_approval
+    from shared import (
+        APPROVAL_PENDING_ATTRIBUTE,
+        APPROVAL_TIER_ATTRIBUTE,
+        BOOKING_WORKFLOW_NAME,
+        COMPENSATION_FAILED_ATTRIBUTE,
+        HOTEL_ID_ATTRIBUTE,
+        RECONCILIATION_RETRY_WORKFLOW_NAME,
+        RECONCILIATION_WORKFLOW_NAME,
+        BookingState,
+        OrphanRetry,
+        OrphanScan,
+        ReconciliationInput,
+        TripAmendment,
+        departure_time,
+    )
+
+# Modules the sandbox shares with the worker instead of re-importing them for every
+# workflow run. They hold no workflow state, so sharing them is deterministic.
+PASSTHROUGH_MODULES = ("activities", "approval_rules", "shared")
+
+# Continue as new once a run's history passes this many events. Long approval
+# waits, repeated signals and amendments then replay from a short history.
+HISTORY_LENGTH_LIMIT = 2000
+
+# Upper bounds for booking activities and the approval wait. Bookings with a
+# departure time get tighter limits from whatever is left before departure.
+BOOKING_ACTIVITY_TIMEOUT = timedelta(seconds=10)
+APPROVAL_TIMEOUT = timedelta(minutes=10)
+
+# Compensations retry for a few minutes, then the booking is flagged with
+# CompensationFailed for ReconcileBookingsWorkflow to pick up
+COMPENSATION_RETRY_POLICY = RetryPolicy(maximum_attempts=10, maximum_interval=timedelta(seconds=30))
 
+# Calls that finish in about 100 ms. Bookings started with local_activities run
+# them on the workflow's own worker as local activities, which skips the task
+# queue round trip and records one marker event instead of three activity events.
+# The approval wait and the hotel calls always run as regular activities.
+LOCAL_ACTIVITY_LEGS = {
+    book_car: "car",
+    book_flight: "flight",
+    undo_book_car: "car",
+    undo_book_hotel: "hotel",
+    undo_book_flight: "flight",
+}
+# A local attempt holds up the workflow task, so attempts are kept short. Retries
+# that back off for longer than the threshold wait on a durable timer instead.
+LOCAL_ACTIVITY_TIMEOUT = timedelta(seconds=5)
+LOCAL_RETRY_THRESHOLD = timedelta(seconds=10)
 
-@workflow.defn
+# Compensation activities by name, used to rebuild the stack from BookingState
+COMPENSATIONS = {fn.__name__: fn for fn in (undo_book_car, undo_book_hotel, undo_book_flight)}
+
+# Set by the server on workflows started by a schedule
+SCHEDULED_START_TIME_ATTRIBUTE = SearchAttributeKey.for_datetime("TemporalScheduledStartTime")
+
+# Booking and compensation activity for each leg that can be amended
+LEGS = {
+    "car": (book_car, undo_book_car),
+    "hotel": (book_hotel, undo_book_hotel),
+    "flight": (book_flight, undo_book_flight),
+}
+
+
+@workflow.defn(name=BOOKING_WORKFLOW_NAME)
 class BookingWorkflow:
     """
     Workflow class for booking a vacation.
@@ -32,6 +101,14 @@ class BookingWorkflow:
     def __init__(self):
         self.approval_decision = None
         self._approval_received = False
+        self._state = BookingState()
+        self._book_input = None
+        self._step_lock = asyncio.Lock()
+        self._finished = False
+        # Set once the run has started to continue as new; amendments are refused from then on
+        self._continuing = False
+        self._local_activity_count = 0
+        self._approval_search_attributes = False
 
     @workflow.signal
     def approvalSignal(self, details):
@@ -48,207 +125,699 @@ class BookingWorkflow:
         self._approval_received = True
         workflow.logger.info(f"Set approval decision to: {self.approval_decision}")
 
+    @workflow.update
+    async def amendBooking(self, amendment: TripAmendment) -> dict:
+        """
+        Update handler that changes one leg of the trip.
+
+        A leg that is already booked is rebooked with the new ID and only the old
+        booking for that leg is compensated. A leg that is not booked yet just has
+        its ID replaced, so the saga books the new choice when it gets there.
+
+        Args:
+            amendment (TripAmendment): The leg to change and its new ID.
+
+        Returns:
+            dict: What was done for the leg and the new booking result, if any.
+        """
+        workflow.logger.info(f"Received amendment: {amendment}")
+        # An update can be delivered before the run method has stored the input
+        await workflow.wait_condition(lambda: self._book_input is not None)
+        book_activity, undo_activity = LEGS[amendment.leg]
+        result_key = f"booked_{amendment.leg}"
+
+        # Wait for the step in progress, if any, so the leg's state is settled. Waiting
+        # on the condition instead of queueing on the lock lets the amendment be refused
+        # if the run continues as new meanwhile, rather than being left behind.
+        await workflow.wait_condition(lambda: self._continuing or not self._step_lock.locked())
+        if self._continuing:
+            raise ApplicationError("Booking is continuing as a new run, retry the amendment")
+        async with self._step_lock:
+            if self._finished:
+                raise ApplicationError("Booking has already finished and can no longer be amended")
+
+            old_input = self._book_input
+            new_input = dataclasses.replace(old_input, **{f"book_{amendment.leg}_id": amendment.new_id})
+
+            if amendment.leg == "hotel" and result_key not in self._state.results and self._state.hotel_result is not None:
+                raise ApplicationError("Hotel booking is waiting for approval and cannot be amended")
+
+            if result_key not in self._state.results:
+                self._book_input = new_input
+                return {"leg": amendment.leg, "status": "updated", "new_id": amendment.new_id}
+
+            # Book the new leg before releasing the old one, so a failed rebooking
+            # leaves the original booking in place
+            new_result = await self._execute_leg_activity(
+                book_activity,
+                new_input,
+                **self._booking_timeouts(),
+                retry_policy=RetryPolicy(
+                    non_retryable_error_types=["ValueError"],
+                    maximum_attempts=new_input.attempts,
+                ),
+            )
+            # Record the new booking before releasing the old one, so the saga's
+            # compensation for this leg cancels the new booking whatever happens next
+            self._book_input = new_input
+            self._state.results[result_key] = new_result
+            workflow.logger.info(f"Rebooked {amendment.leg}: {new_result}")
+            rebooked = {"leg": amendment.leg, "status": "rebooked", "new_id": amendment.new_id, "result": new_result}
+            try:
+                await self._execute_leg_activity(
+                    undo_activity,
+                    old_input,
+                    start_to_close_timeout=timedelta(seconds=10),
+                    retry_policy=COMPENSATION_RETRY_POLICY,
+                )
+            except ActivityError as compensation_error:
+                # Left to the reconciliation workflow, like a failed saga compensation
+                workflow.logger.error(f"Compensation {undo_activity.__name__} failed: {compensation_error.cause}")
+                if workflow.patched("compensation-failed-attribute"):
+                    workflow.upsert_search_attributes([COMPENSATION_FAILED_ATTRIBUTE.value_set(True)])
+                rebooked["failed_compensation"] = undo_activity.__name__
+            return rebooked
+
+    @amendBooking.validator
+    def validate_amendment(self, amendment: TripAmendment) -> None:
+        """Reject malformed amendments before they are written to history."""
+        if amendment.leg not in LEGS:
+            raise ValueError(f"Unknown leg {amendment.leg!r}, expected one of {', '.join(LEGS)}")
+        if not amendment.new_id:
+            raise ValueError("new_id must not be empty")
+        if amendment.leg == "hotel" and amendment.new_id.startswith("manual_"):
+            raise ValueError("Hotels that need manual approval require a new booking")
+        if self._finished:
+            raise ValueError("Booking has already finished and can no longer be amended")
+        if self._continuing:
+            raise ValueError("Booking is continuing as a new run, retry the amendment")
+
+    def _history_too_long(self):
+        """Whether this run's history is long enough to continue as new."""
+        info = workflow.info()
+        return (
+            info.get_current_history_length() > HISTORY_LENGTH_LIMIT
+            or info.is_continue_as_new_suggested()
+        )
+
+    def _time_to_departure(self) -> Optional[timedelta]:
+        """
+        Time left before the trip departs, or None when no departure was given.
+
+        Raises:
+            ApplicationError: If the trip has already departed.
+        """
+        departure = departure_time(self._book_input)
+        if departure is None:
+            return None
+        remaining = departure - workflow.now()
+        if remaining <= timedelta(0):
+            raise ApplicationError(f"Departure {self._book_input.departure} has passed", non_retryable=True)
+        return remaining
+
+    def _booking_timeouts(self) -> dict:
+        """
+        Timeouts for a booking activity, bounded by the time left before departure.
+
+        Retries stop at the departure deadline instead of booking a trip that has
+        already left. Compensations keep fixed timeouts so they always run.
+        """
+        remaining = self._time_to_departure()
+        if remaining is None:
+            return {"start_to_close_timeout": BOOKING_ACTIVITY_TIMEOUT}
+        return {
+            "start_to_close_timeout": min(BOOKING_ACTIVITY_TIMEOUT, remaining),
+            "schedule_to_close_timeout": remaining,
+        }
+
+    def _execute_leg_activity(self, activity, book_input, **options):
+        """
+        Start a booking or compensation activity for one leg.
+
+        Short calls run as local activities when the booking asks for them. Local
+        activity markers do not record their input, so the activity ID names the
+        leg and ID for reconciliation to find.
+        """
+        leg = LOCAL_ACTIVITY_LEGS.get(activity)
+        if leg is None or not book_input.local_activities:
+            return workflow.execute_activity(activity, book_input, **options)
+        self._local_activity_count += 1
+        options["start_to_close_timeout"] = min(options["start_to_close_timeout"], LOCAL_ACTIVITY_TIMEOUT)
+        return workflow.execute_local_activity(
+            activity,
+            book_input,
+            activity_id=local_activity_id(self._local_activity_count, leg, getattr(book_input, f"book_{leg}_id")),
+            local_retry_threshold=LOCAL_RETRY_THRESHOLD,
+            **options,
+        )
+
+    async def _continue_as_new(self, compensations):
+        """Continue as a new run, carrying the saga state over."""
+        self._continuing = True
+        # Let an amendment in progress finish; the lock is never released. Amendments
+        # still waiting for it see _continuing and are refused.
+        await self._step_lock.acquire()
+        await workflow.wait_condition(workflow.all_handlers_finished)
+        self._state.compensations = [compensation.__name__ for compensation in compensations]
+        # An approver may have decided while the amendment held the lock
+        self._state.approval_decision = self.approval_decision if self._approval_received else None
+        self._state.continued_runs += 1
+        workflow.logger.info(
+            f"History has {workflow.info().get_current_history_length()} events, "
+            f"continuing as new (run {self._state.continued_runs})"
+        )
+        workflow.continue_as_new(args=[self._book_input, self._state])
+
+    async def _continue_as_new_if_needed(self, compensations):
+        if self._history_too_long():
+            await self._continue_as_new(compensations)
+
+    async def _wait_for_human_approval(self, compensations, resumed):
+        """
+        Wait for an approver to decide on the hotel booking.
+
+        Args:
+            compensations: Compensations registered so far, carried over if the
+                wait continues as new.
+            resumed (bool): Whether this run continued from an earlier one.
+
+        Returns:
+            The decision from the approval signal, or the approval activity's result.
+        """
+        rules = self._state.approval_rules
+
+        # Make the booking visible to approval listings via visibility queries.
+        # Bookings already waiting when this was added replay without the upserts.
+        self._approval_search_attributes = workflow.patched("approval-search-attributes")
+        if self._approval_search_attributes:
+            search_attributes = [
+                APPROVAL_PENDING_ATTRIBUTE.value_set(True),
+                HOTEL_ID_ATTRIBUTE.value_set(self._book_input.book_hotel_id),
+            ]
+            if rules is not None:
+                search_attributes.append(APPROVAL_TIER_ATTRIBUTE.value_set(self._state.approval_tier))
+            workflow.upsert_search_attributes(search_attributes)
+
+        # Create a task for the wait_for_human_approval activity
+        activity_handle = workflow.start_activity(
+            wait_for_human_approval,
+            self._book_input,
+            start_to_close_timeout=timedelta(minutes=30),
+            # Retry quickly on another worker if this one stops heartbeating
+            heartbeat_timeout=timedelta(seconds=30),
+            cancellation_type=workflow.ActivityCancellationType.WAIT_CANCELLATION_COMPLETED,
+        )
+
+        # Wait for the approval signal or a timeout. The deadline is kept in the
+        # state so a continued run only waits for what is left of it. With rules,
+        # this is the first tier's deadline before escalating.
+        approval_timeout = APPROVAL_TIMEOUT
+        if rules is not None:
+            approval_timeout = timedelta(seconds=rules.escalate_after_seconds)
+        time_to_departure = self._time_to_departure()
+        if time_to_departure is not None:
+            # A decision after departure is of no use
+            approval_timeout = min(approval_timeout, time_to_departure)
+        if self._state.approval_deadline is None:
+            self._state.approval_deadline = (workflow.now() + approval_timeout).isoformat()
+        else:
+            approval_timeout = max(
+                datetime.fromisoformat(self._state.approval_deadline) - workflow.now(),
+                timedelta(0),
+            )
+        self._state.approval_status = "waiting"
+        workflow.logger.info(f"Waiting for approval signal with timeout of {approval_timeout}")
+
+        # Polling helper kept for workflows started before the wait_condition patch
+        async def wait_for_signal():
+            """Wait for the approval signal."""
+            workflow.logger.info("Starting to wait for approval signal")
+
+            # Wait for the signal with polling
+            check_interval = 1  # seconds - check more frequently
+            max_wait_time = approval_timeout.total_seconds()
+            elapsed_time = 0
+
+            while not self._approval_received and elapsed_time < max_wait_time:
+                # Log periodically but not too frequently
+                if elapsed_time % 5 == 0:  # Log every 5 seconds
+                    workflow.logger.info(f"Waiting for approval signal... ({elapsed_time}/{max_wait_time} seconds)")
+
+                # Short sleep to avoid busy waiting
+                await asyncio.sleep(check_interval)
+                elapsed_time += check_interval
+
+                # Check if we received a signal
+                if self._approval_received:
+                    workflow.logger.info(f"Signal received during wait! Decision: {self.approval_decision}")
+                    return self.approval_decision
+
+            if self._approval_received:
+                workflow.logger.info(f"Signal received! Decision: {self.approval_decision}")
+                return self.approval_decision
+            else:
+                workflow.logger.info("No signal received during polling period")
+                return None
+
+        # Wait for either the signal or a timeout
+        try:
+            # Reset approval state to ensure we're waiting for a fresh signal. A
+            # continued run keeps any signal that arrived before it got here.
+            if not resumed:
+                self._approval_received = False
+                self.approval_decision = None
+
+            if rules is not None:
+                await self._wait_for_approver(rules, activity_handle, compensations)
+                approval_result = self.approval_decision
+            elif workflow.patched("approval-wait-condition"):
+                # One timer for the whole wait instead of a timer per second
+                await workflow.wait_condition(
+                    lambda: self._approval_received or self._history_too_long(),
+                    timeout=approval_timeout,
+                )
+                if not self._approval_received:
+                    # History grew too long while waiting; the next run restarts
+                    # the approval activity and waits for the rest of the deadline
+                    activity_handle.cancel()
+                    await self._continue_as_new(compensations)
+                approval_result = self.approval_decision
+            else:
+                # Convert timedelta to seconds for asyncio.wait_for
+                timeout_seconds = approval_timeout.total_seconds()
+                workflow.logger.info(f"Starting wait_for_signal with timeout {timeout_seconds} seconds")
+                approval_result = await asyncio.wait_for(wait_for_signal(), timeout_seconds)
+            workflow.logger.info(f"Signal received within timeout: {approval_result}")
+
+            # Cancel the activity since we got the signal
+            if not activity_handle.done():
+                workflow.logger.info("Cancelling wait_for_human_approval activity")
+                activity_handle.cancel()
+
+        except asyncio.TimeoutError:
+            workflow.logger.info("Approval timeout reached")
+            if (resumed or rules is not None or approval_timeout < APPROVAL_TIMEOUT) and not activity_handle.done():
+                # The activity counts its own 10 minutes from when it started,
+                # so stop it at the carried-over, escalation or departure deadline
+                activity_handle.cancel()
+                approval_result = {"status": "timeout", "message": "Approval timed out"}
+            else:
+                # Wait for the activity to complete
+                approval_result = await activity_handle
+            workflow.logger.info(f"Activity completed with result: {approval_result}")
+
+        # The booking no longer waits for a human, whatever the decision
+        if self._approval_search_attributes:
+            workflow.upsert_search_attributes([APPROVAL_PENDING_ATTRIBUTE.value_set(False)])
+        return approval_result
+
+    async def _wait_for_approver(self, rules, activity_handle, compensations):
+        """
+        Wait for the approval signal, escalating to the second approver tier when
+        the first one does not decide before its deadline.
+
+        Raises:
+            asyncio.TimeoutError: If the second tier does not decide in time either.
+        """
+        while True:
+            remaining = max(
+                datetime.fromisoformat(self._state.approval_deadline) - workflow.now(),
+                timedelta(0),
+            )
+            try:
+                await workflow.wait_condition(
+                    lambda: self._approval_received or self._history_too_long(),
+                    timeout=remaining,
+                )
+            except asyncio.TimeoutError:
+                if self._state.approval_tier >= 2:
+                    raise
+                escalation_timeout = timedelta(seconds=rules.escalation_timeout_seconds)
+                departure = departure_time(self._book_input)
+                if departure is not None:
+                    # The first tier's wait ran up to departure, nobody is left to ask
+                    if departure <= workflow.now():
+                        raise
+                    escalation_timeout = min(escalation_timeout, departure - workflow.now())
+                self._state.approval_tier = 2
+                self._state.approval_deadline = (workflow.now() + escalation_timeout).isoformat()
+                if self._approval_search_attributes:
+                    workflow.upsert_search_attributes([APPROVAL_TIER_ATTRIBUTE.value_set(2)])
+                workflow.metric_meter().create_counter(
+                    "approval_escalations", "Manual bookings escalated to the second approver tier"
+                ).add(1)
+                workflow.logger.info(f"No decision in time, escalated to approver tier 2 for {escalation_timeout}")
+                continue
+
+            if not self._approval_received:
+                # History grew too long while waiting; the next run restarts the
+                # approval activity and waits for the rest of this tier's deadline
+                activity_handle.cancel()
+                await self._continue_as_new(compensations)
+            return
+
     @workflow.run
-    async def run(self, book_input: BookVacationInput):
+    async def run(self, book_input: BookVacationInput, state: Optional[BookingState] = None):
         """
         Executes the booking workflow.
 
         Args:
             book_input (BookVacationInput): Input data for the workflow.
+            state (BookingState): Progress carried over from a previous run, if any.
 
         Returns:
             str: Workflow result.
         """
-        compensations = []
-        results = {}
+        self._book_input = book_input
+        if state is not None:
+            self._state = state
+            if state.approval_decision is not None:
+                self.approval_decision = state.approval_decision
+                self._approval_received = True
+        resumed = self._state.continued_runs > 0
+        compensations = [COMPENSATIONS[name] for name in self._state.compensations]
+        results = self._state.results
         try:
-            compensations.append(undo_book_car)
-            car_result = await workflow.execute_activity(
-                book_car,
-                book_input,
-                start_to_close_timeout=timedelta(seconds=10),
-            )
-            results["booked_car"] = car_result
-
-            # Book hotel
-            compensations.append(undo_book_hotel)
-            hotel_result = await workflow.execute_activity(
-                book_hotel,
-                book_input,
-                start_to_close_timeout=timedelta(seconds=10),
-                retry_policy=RetryPolicy(
-                    non_retryable_error_types=["ValueError"],
-                    maximum_attempts=book_input.attempts,
-                ),
-            )
+            # Fail before booking anything if the trip has already left
+            self._time_to_departure()
 
-            # Check if manual approval is needed for hotel booking
-            needs_approval = False
-
-            # First check if the hotel ID itself indicates manual approval is needed
-            if book_input.book_hotel_id.startswith("manual_"):
-                needs_approval = True
-                workflow.logger.info(f"Manual approval needed based on hotel ID: {book_input.book_hotel_id}")
-            # Then check the hotel result for manual approval indicators
-            elif isinstance(hotel_result, str) and hotel_result.startswith("manual_approval_needed:"):
-                needs_approval = True
-                workflow.logger.info(f"Manual approval needed based on string result: {hotel_result}")
-            elif isinstance(hotel_result, dict):
-                # Only check for manual approval if the hotel ID starts with 'manual_'
-                if book_input.book_hotel_id.startswith("manual_") and (
-                    hotel_result.get("status") == "waiting_for_approval" or 
-                    hotel_result.get("message") == "manual_approval_needed" or
-                    hotel_result.get("manual_approval_needed") == True
-                ):
+            if "booked_car" not in results:
+                # Steps hold the lock so amendments apply between them, never during one
+                async with self._step_lock:
+                    compensations.append(undo_book_car)
+                    car_result = await self._execute_leg_activity(
+                        book_car,
+                        self._book_input,
+                        **self._booking_timeouts(),
+                    )
+                    results["booked_car"] = car_result
+                await self._continue_as_new_if_needed(compensations)
+
+            if "booked_hotel" not in results:
+                # Book hotel, unless a previous run already did and is waiting for approval
+                if self._state.hotel_result is None:
+                    async with self._step_lock:
+                        compensations.append(undo_book_hotel)
+                        hotel_result = await workflow.execute_activity(
+                            book_hotel,
+                            self._book_input,
+                            **self._booking_timeouts(),
+                            retry_policy=RetryPolicy(
+                                non_retryable_error_types=["ValueError"],
+                                maximum_attempts=self._book_input.attempts,
+                            ),
+                        )
+                        self._state.hotel_result = hotel_result
+                else:
+                    hotel_result = self._state.hotel_result
+
+                # Check if manual approval is needed for hotel booking
+                needs_approval = False
+
+                # First check if the hotel ID itself indicates manual approval is needed
+                if self._book_input.book_hotel_id.startswith("manual_"):
                     needs_approval = True
-                    workflow.logger.info(f"Manual approval needed based on dict result: {hotel_result}")
-
-            if needs_approval:
-                # Start the human approval activity
-                workflow.logger.info(f"Manual approval needed for hotel: {book_input.book_hotel_id}")
-
-                # Create a task for the wait_for_human_approval activity
-                activity_handle = workflow.start_activity(
-                    wait_for_human_approval,
-                    book_input,
-                    start_to_close_timeout=timedelta(minutes=30),
-                    cancellation_type=workflow.ActivityCancellationType.WAIT_CANCELLATION_COMPLETED,
-                )
+                    workflow.logger.info(f"Manual approval needed based on hotel ID: {self._book_input.book_hotel_id}")
+                # Then check the hotel result for manual approval indicators
+                elif isinstance(hotel_result, str) and hotel_result.startswith("manual_approval_needed:"):
+                    needs_approval = True
+                    workflow.logger.info(f"Manual approval needed based on string result: {hotel_result}")
+                elif isinstance(hotel_result, dict):
+                    # Only check for manual approval if the hotel ID starts with 'manual_'
+                    if self._book_input.book_hotel_id.startswith("manual_") and (
+                        hotel_result.get("status") == "waiting_for_approval" or 
+                        hotel_result.get("message") == "manual_approval_needed" or
+                        hotel_result.get("manual_approval_needed") == True
+                    ):
+                        needs_approval = True
+                        workflow.logger.info(f"Manual approval needed based on dict result: {hotel_result}")
+
+                if needs_approval:
+                    workflow.logger.info(f"Manual approval needed for hotel: {self._book_input.book_hotel_id}")
 
-                # Wait for the approval signal or a timeout
-                approval_timeout = timedelta(minutes=10)
-                workflow.logger.info(f"Waiting for approval signal with timeout of {approval_timeout}")
-
-                # Define a helper function to wait for the signal
-                async def wait_for_signal():
-                    """Wait for the approval signal."""
-                    workflow.logger.info("Starting to wait for approval signal")
-                    
-                    # Wait for the signal with polling
-                    check_interval = 1  # seconds - check more frequently
-                    max_wait_time = approval_timeout.total_seconds()
-                    elapsed_time = 0
-                    
-                    while not self._approval_received and elapsed_time < max_wait_time:
-                        # Log periodically but not too frequently
-                        if elapsed_time % 5 == 0:  # Log every 5 seconds
-                            workflow.logger.info(f"Waiting for approval signal... ({elapsed_time}/{max_wait_time} seconds)")
-                        
-                        # Short sleep to avoid busy waiting
-                        await asyncio.sleep(check_interval)
-                        elapsed_time += check_interval
-                        
-                        # Check if we received a signal
-                        if self._approval_received:
-                            workflow.logger.info(f"Signal received during wait! Decision: {self.approval_decision}")
-                            return self.approval_decision
-                    
-                    if self._approval_received:
-                        workflow.logger.info(f"Signal received! Decision: {self.approval_decision}")
-                        return self.approval_decision
+                    # Decide from the rules first, so only bookings they do not cover wait
+                    # for a person. A continued run already checked them.
+                    auto_decision = None
+                    if self._state.approval_rules is None and workflow.patched("approval-rules"):
+                        # A local activity records the rules in history, so replays use the
+                        # same rules even after the worker's rules file has changed
+                        self._state.approval_rules = await workflow.execute_local_activity(
+                            get_approval_rules,
+                            start_to_close_timeout=timedelta(seconds=5),
+                        )
+                        # Price rules use the supplier's quote, not a price from the request
+                        quoted_price = hotel_result.get("price") if isinstance(hotel_result, dict) else None
+                        auto_decision = evaluate_approval(self._state.approval_rules, self._book_input, quoted_price)
+
+                    if auto_decision is not None:
+                        workflow.logger.info(f"Approval rules decided to {auto_decision.decision}: {auto_decision.reason}")
+                        workflow.metric_meter().create_counter(
+                            "approval_auto_decisions", "Manual bookings decided by the approval rules"
+                        ).add(1, {"decision": auto_decision.decision})
+                        # The rules take precedence over a signal sent before the booking got here
+                        self._approval_received = False
+                        approval_result = auto_decision.decision
+                        results["approval_rule"] = auto_decision.reason
                     else:
-                        workflow.logger.info("No signal received during polling period")
-                        return None
+                        approval_result = await self._wait_for_human_approval(compensations, resumed)
 
-                # Wait for either the signal or a timeout
-                try:
-                    # Reset approval state to ensure we're waiting for a fresh signal
-                    self._approval_received = False
-                    self.approval_decision = None
-                    
-                    # Convert timedelta to seconds for asyncio.wait_for
-                    timeout_seconds = approval_timeout.total_seconds()
-                    workflow.logger.info(f"Starting wait_for_signal with timeout {timeout_seconds} seconds")
-                    approval_result = await asyncio.wait_for(wait_for_signal(), timeout_seconds)
-                    workflow.logger.info(f"Signal received within timeout: {approval_result}")
-
-                    # Cancel the activity since we got the signal
-                    if not activity_handle.done():
-                        workflow.logger.info("Cancelling wait_for_human_approval activity")
-                        try:
-                            # Force complete the activity instead of cancelling it
-                            # This is more reliable than cancellation
-                            workflow.logger.info("Force completing the activity")
-                            activity_handle.complete({"status": "approved", "message": "Approved via signal"})
-                            workflow.logger.info("Activity completed successfully")
-                        except Exception as e:
-                            workflow.logger.error(f"Error completing activity: {str(e)}")
-                            # Try cancellation as a fallback
-                            try:
-                                workflow.logger.info("Trying to cancel the activity")
-                                await activity_handle.cancel()
-                                workflow.logger.info("Activity cancelled successfully")
-                            except Exception as cancel_error:
-                                workflow.logger.error(f"Error cancelling activity: {str(cancel_error)}")
-
-                except asyncio.TimeoutError:
-                    workflow.logger.info("Approval timeout reached")
-                    # Wait for the activity to complete
-                    approval_result = await activity_handle
-                    workflow.logger.info(f"Activity completed with result: {approval_result}")
-
-                # Process the approval result
-                is_approved = False
+                    # Process the approval result
+                    is_approved = False
                 
-                # First check if we have a decision from the signal
-                if self._approval_received and self.approval_decision:
-                    workflow.logger.info(f"Using decision from signal: {self.approval_decision}")
-                    is_approved = self.approval_decision.lower() in ["approve", "approved"]
-                # Then check the approval_result if we have one
-                elif isinstance(approval_result, str):
-                    # String format: "approve", "approved", "reject", "rejected"
-                    workflow.logger.info(f"Using decision from string result: {approval_result}")
-                    is_approved = approval_result.lower() in ["approve", "approved"]
-                elif isinstance(approval_result, dict):
-                    if "decision" in approval_result:
-                        # Dict format: {"decision": "approve"} or {"decision": "reject"}
-                        workflow.logger.info(f"Using decision from dict result: {approval_result}")
-                        is_approved = approval_result["decision"].lower() in ["approve", "approved"]
-                    elif "status" in approval_result:
-                        # Dict format from activity: {"status": "completed", "message": "..."}
-                        workflow.logger.info(f"Using status from dict result: {approval_result}")
-                        is_approved = approval_result["status"].lower() in ["approved", "completed"]
+                    # First check if we have a decision from the signal
+                    if self._approval_received and self.approval_decision:
+                        workflow.logger.info(f"Using decision from signal: {self.approval_decision}")
+                        is_approved = self.approval_decision.lower() in ["approve", "approved"]
+                    # Then check the approval_result if we have one
+                    elif isinstance(approval_result, str):
+                        # String format: "approve", "approved", "reject", "rejected"
+                        workflow.logger.info(f"Using decision from string result: {approval_result}")
+                        is_approved = approval_result.lower() in ["approve", "approved"]
+                    elif isinstance(approval_result, dict):
+                        if "decision" in approval_result:
+                            # Dict format: {"decision": "approve"} or {"decision": "reject"}
+                            workflow.logger.info(f"Using decision from dict result: {approval_result}")
+                            is_approved = approval_result["decision"].lower() in ["approve", "approved"]
+                        elif "status" in approval_result:
+                            # Dict format from activity: {"status": "completed", "message": "..."}
+                            workflow.logger.info(f"Using status from dict result: {approval_result}")
+                            is_approved = approval_result["status"].lower() in ["approved", "completed"]
                 
-                workflow.logger.info(f"Final approval decision: {is_approved}")
-
-                if is_approved:
-                    # If approved, complete the hotel booking
-                    workflow.logger.info(f"Hotel booking approved: {book_input.book_hotel_id}")
-                    hotel_result = await workflow.execute_activity(
-                        complete_hotel_booking,
-                        book_input,
-                        start_to_close_timeout=timedelta(seconds=10),
-                    )
-                    results["booked_hotel"] = hotel_result
-                    results["approval_status"] = "approved"
+                    workflow.logger.info(f"Final approval decision: {is_approved}")
+
+                    if is_approved:
+                        # If approved, complete the hotel booking
+                        workflow.logger.info(f"Hotel booking approved: {self._book_input.book_hotel_id}")
+                        async with self._step_lock:
+                            hotel_result = await workflow.execute_activity(
+                                complete_hotel_booking,
+                                self._book_input,
+                                **self._booking_timeouts(),
+                            )
+                            results["booked_hotel"] = hotel_result
+                        results["approval_status"] = "approved"
+                        self._state.approval_status = "approved"
+                    else:
+                        # If rejected, cancel the workflow
+                        workflow.logger.info(f"Hotel booking rejected: {self._book_input.book_hotel_id}")
+                        self._state.approval_status = "rejected"
+                        if auto_decision is not None:
+                            raise ValueError(
+                                f"Hotel booking rejected by approval rules ({auto_decision.reason}): "
+                                f"{self._book_input.book_hotel_id}"
+                            )
+                        raise ValueError(f"Hotel booking rejected by human approver: {self._book_input.book_hotel_id}")
                 else:
-                    # If rejected, cancel the workflow
-                    workflow.logger.info(f"Hotel booking rejected: {book_input.book_hotel_id}")
-                    raise ValueError(f"Hotel booking rejected by human approver: {book_input.book_hotel_id}")
-            else:
-                # Normal hotel booking (no manual approval needed)
-                results["booked_hotel"] = hotel_result
+                    # Normal hotel booking (no manual approval needed)
+                    results["booked_hotel"] = hotel_result
+
+            await self._continue_as_new_if_needed(compensations)
 
             # Book flight
-            compensations.append(undo_book_flight)
-            flight_result = await workflow.execute_activity(
-                book_flight,
-                book_input,
-                start_to_close_timeout=timedelta(seconds=10),
-                retry_policy=RetryPolicy(
-                    initial_interval=timedelta(seconds=1),
-                    maximum_interval=timedelta(seconds=1),
-                ),
-            )
-            results["booked_flight"] = flight_result
+            async with self._step_lock:
+                compensations.append(undo_book_flight)
+                flight_result = await self._execute_leg_activity(
+                    book_flight,
+                    self._book_input,
+                    **self._booking_timeouts(),
+                    retry_policy=RetryPolicy(
+                        initial_interval=timedelta(seconds=1),
+                        maximum_interval=timedelta(seconds=1),
+                    ),
+                )
+                results["booked_flight"] = flight_result
+                self._finished = True
 
-            return {"status": "success", "message": results}
+            # Amendments that were waiting for the lock are rejected before completing
+            await workflow.wait_condition(workflow.all_handlers_finished)
+            # Reconciliation reads the legs a finished booking still holds from here,
+            # so it cancels only the ones an amendment failed to release
+            held_legs = {leg: getattr(self._book_input, f"book_{leg}_id") for leg in LEGS}
+            return {"status": "success", "message": results, "held_legs": held_legs}
 
         except Exception as ex:
+            # Let an amendment in progress finish, then stop accepting new ones
+            async with self._step_lock:
+                self._finished = True
+            # Compensate with the current input, so amended legs cancel the new booking.
+            # A compensation that keeps failing is left to the reconciliation workflow
+            # instead of blocking the others.
+            failed_compensations = []
             for compensation in reversed(compensations):
-                await workflow.execute_activity(
-                    compensation,
-                    book_input,
+                try:
+                    await self._execute_leg_activity(
+                        compensation,
+                        self._book_input,
+                        start_to_close_timeout=timedelta(seconds=10),
+                        retry_policy=COMPENSATION_RETRY_POLICY,
+                    )
+                except ActivityError as compensation_error:
+                    workflow.logger.error(f"Compensation {compensation.__name__} failed: {compensation_error.cause}")
+                    failed_compensations.append(compensation.__name__)
+            if failed_compensations and workflow.patched("compensation-failed-attribute"):
+                workflow.upsert_search_attributes([COMPENSATION_FAILED_ATTRIBUTE.value_set(True)])
+            await workflow.wait_condition(workflow.all_handlers_finished)
+            return {"status": "failure", "message": str(ex), "failed_compensations": failed_compensations}
+
+
+@workflow.defn(name=RECONCILIATION_WORKFLOW_NAME)
+class ReconcileBookingsWorkflow:
+    """
+    Workflow that cancels legs left booked by failed or terminated bookings.
+
+    Started by the booking-reconciliation schedule. Each run checks the bookings
+    that closed in one window and issues the missing compensations in batches.
+    """
+
+    @workflow.run
+    async def run(self, settings: ReconciliationInput) -> dict:
+        """
+        Reconcile the bookings that closed in this run's window.
+
+        Args:
+            settings (ReconciliationInput): Window, batch size and scan limit.
+
+        Returns:
+            dict: Window scanned, bookings checked, legs cancelled and legs that failed.
+        """
+        # Windows end at the scheduled time rather than the actual start, so runs
+        # that start late still cover consecutive windows
+        window_end = workflow.info().typed_search_attributes.get(SCHEDULED_START_TIME_ATTRIBUTE) or workflow.now()
+        window_end -= timedelta(seconds=settings.settle_seconds)
+        window_start = window_end - timedelta(seconds=settings.window_seconds)
+
+        scan = await workflow.execute_activity_method(
+            ReconciliationActivities.find_orphaned_bookings,
+            OrphanScan(
+                closed_after=window_start.isoformat(),
+                closed_before=window_end.isoformat(),
+                max_bookings=settings.max_bookings,
+            ),
+            start_to_close_timeout=timedelta(minutes=5),
+            heartbeat_timeout=timedelta(minutes=1),
+        )
+        if scan.bookings_skipped:
+            workflow.logger.warning(
+                f"{scan.bookings_skipped} bookings over the limit of {settings.max_bookings} were not reconciled"
+            )
+
+        cancelled, failed = await cancel_orphaned_legs(scan.orphans, settings.batch_size)
+        workflow.logger.info(
+            f"Reconciled {scan.bookings_scanned} bookings: {len(cancelled)} legs cancelled, {len(failed)} failed"
+        )
+
+        # Later runs scan later windows and never see these bookings again, so the
+        # legs go to a workflow that keeps retrying them after this run has ended
+        retry_workflow_id = None
+        if failed:
+            retry_workflow_id = f"{workflow.info().workflow_id}-retries"
+            await workflow.start_child_workflow(
+                RetryOrphanedLegsWorkflow.run,
+                OrphanRetry(
+                    legs=failed,
+                    retry_interval_seconds=settings.window_seconds,
+                    batch_size=settings.batch_size,
+                ),
+                id=retry_workflow_id,
+                parent_close_policy=ParentClosePolicy.ABANDON,
+            )
+
+        return {
+            "window": [window_start.isoformat(), window_end.isoformat()],
+            "bookings_scanned": scan.bookings_scanned,
+            "bookings_skipped": scan.bookings_skipped,
+            "cancelled": cancelled,
+            "failed": [leg_summary(orphan) for orphan in failed],
+            "retry_workflow_id": retry_workflow_id,
+        }
+
+
+@workflow.defn(name=RECONCILIATION_RETRY_WORKFLOW_NAME)
+class RetryOrphanedLegsWorkflow:
+    """
+    Workflow that retries the legs a reconciliation run could not cancel.
+
+    Each run waits one interval, retries the legs and continues as new with the
+    ones that failed again, so the history stays short however long a supplier
+    is down.
+    """
+
+    @workflow.run
+    async def run(self, retry: OrphanRetry) -> dict:
+        """
+        Retry the legs until they are cancelled or max_rounds is reached.
+
+        Args:
+            retry (OrphanRetry): Legs still held and the retry settings.
+
+        Returns:
+            dict: Legs cancelled in the last round and legs given up on.
+        """
+        await workflow.sleep(timedelta(seconds=retry.retry_interval_seconds))
+        cancelled, failed = await cancel_orphaned_legs(retry.legs, retry.batch_size)
+        rounds = retry.rounds + 1
+        if failed and rounds < retry.max_rounds:
+            workflow.logger.info(f"{len(failed)} legs still held after {rounds} retry rounds")
+            workflow.continue_as_new(dataclasses.replace(retry, legs=failed, rounds=rounds))
+
+        for orphan in failed:
+            workflow.logger.error(
+                f"Gave up cancelling {orphan.leg} for {orphan.workflow_id} after {rounds} rounds, cancel it by hand"
+            )
+        return {"cancelled": cancelled, "failed": [leg_summary(orphan) for orphan in failed]}
+
+
+def leg_summary(orphan):
+    return {"workflow_id": orphan.workflow_id, "leg": orphan.leg}
+
+
+async def cancel_orphaned_legs(orphans, batch_size):
+    """
+    Issue the missing compensations for orphaned legs in parallel batches.
+
+    Returns:
+        tuple: Summaries of the legs cancelled, and the OrphanedLegs that failed.
+    """
+    cancelled = []
+    failed = []
+    for start in range(0, len(orphans), batch_size):
+        batch = orphans[start:start + batch_size]
+        outcomes = await asyncio.gather(
+            *(
+                workflow.execute_activity(
+                    LEGS[orphan.leg][1],
+                    orphan.book_input,
                     start_to_close_timeout=timedelta(seconds=10),
+                    retry_policy=COMPENSATION_RETRY_POLICY,
                 )
-            return {"status": "failure", "message": str(ex)}
+                for orphan in batch
+            ),
+            return_exceptions=True,
+        )
+        for orphan, outcome in zip(batch, outcomes):
+            if isinstance(outcome, BaseException):
+                workflow.logger.error(f"Could not cancel {orphan.leg} for {orphan.workflow_id}: {outcome}")
+                failed.append(orphan)
+            else:
+                cancelled.append(leg_summary(orphan))
+    return cancelled, failed